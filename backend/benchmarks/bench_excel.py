@@ -0,0 +1,201 @@
+"""
+benchmarks/bench_excel.py
+Excel report writer: previous per-cell implementation vs utils/excel_writer.py
+
+    python benchmarks/bench_excel.py --rows 5000 --files 8
+
+Checks that both produce the same layout (values, fonts, borders, column
+widths) before timing them.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font, Border, Side
+from openpyxl.utils.dataframe import dataframe_to_rows
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import excel_writer
+
+
+# ---------------------------------------------
+# PREVIOUS IMPLEMENTATION (reference)
+# ---------------------------------------------
+
+THIN_BORDER = Border(
+    left=Side(style='thin'), right=Side(style='thin'),
+    top=Side(style='thin'), bottom=Side(style='thin')
+)
+
+
+def legacy_convert_json_file_to_excel(json_path, excel_path):
+    """full_pipeline.convert_json_file_to_excel before utils/excel_writer.py."""
+    thin_border = THIN_BORDER
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Data"
+    current_row = 1
+
+    def write_recursive(obj, indent=0):
+        nonlocal current_row
+
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if key in ["$schema", "title", "type"]: continue
+
+                if isinstance(value, list) and len(value) > 0 and isinstance(value[0], dict):
+                    df = pd.DataFrame(value)
+
+                    for r_idx, row_data in enumerate(dataframe_to_rows(df, index=False, header=True)):
+                        is_total_row = False
+                        if r_idx > 0:
+                            for val in row_data:
+                                if str(val).strip().lower() == "total":
+                                    is_total_row = True
+                                    break
+
+                        if is_total_row:
+                            num_columns = len(row_data)
+                            for _ in range(4):
+                                for c_idx in range(1, num_columns + 1):
+                                    blank_cell = ws.cell(row=current_row, column=c_idx + 1, value="")
+                                    blank_cell.border = thin_border
+                                current_row += 1
+
+                        for c_idx, cell_value in enumerate(row_data, 1):
+                            cell = ws.cell(row=current_row, column=c_idx + 1, value=cell_value)
+                            if r_idx == 0: cell.font = Font(bold=True)
+                            cell.border = thin_border
+                        current_row += 1
+                    current_row += 1
+
+                elif isinstance(value, dict):
+                    title = ws.cell(row=current_row, column=2, value=key.upper())
+                    title.font = Font(bold=True)
+                    current_row += 1
+                    write_recursive(value, indent + 1)
+
+                elif isinstance(value, list):
+                    ws.cell(row=current_row, column=2, value=key)
+                    ws.cell(row=current_row, column=3, value=str(value))
+                    current_row += 1
+
+                else:
+                    ws.cell(row=current_row, column=2, value=key)
+                    ws.cell(row=current_row, column=3, value=value)
+                    current_row += 1
+
+    write_recursive(data)
+
+    for column in ws.columns:
+        max_length = 0
+        column_list = list(column)
+        for cell in column_list:
+            if cell.value:
+                max_length = max(max_length, len(str(cell.value)))
+        ws.column_dimensions[column_list[0].column_letter].width = min(max_length + 2, 50)
+
+    wb.save(excel_path)
+
+
+# ---------------------------------------------
+# SYNTHETIC STATEMENTS
+# ---------------------------------------------
+
+def make_statement(rows: int, seed: int) -> dict:
+    """A vendor statement shaped like parse_ai_response() output."""
+    rng = random.Random(seed)
+    invoices = [
+        {
+            "Invoice Date": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2024",
+            "Invoice No": f"INV-{seed}-{i:06d}",
+            "Purchase order No. if available": rng.choice(["", f"PO{rng.randint(10000, 99999)}"]),
+            "Invoice Amount": round(rng.uniform(10, 250000), 2),
+            "Invoice Currency": rng.choice(["INR", "USD", "EUR"]),
+            "Invoice Due Date": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2025",
+            "Remarks if any": rng.choice(["", "Partially paid", "Disputed – credit note pending"]),
+        }
+        for i in range(rows)
+    ]
+    invoices.append({
+        "Invoice Date": "", "Invoice No": "", "Purchase order No. if available": "Total",
+        "Invoice Amount": round(sum(i["Invoice Amount"] for i in invoices), 2),
+        "Invoice Currency": "INR", "Invoice Due Date": "", "Remarks if any": "",
+    })
+    return {
+        "": "", "Company Code": "1000", "Legal Entity Name": "Example Industries Ltd",
+        "Vendor No": f"V{seed:05d}", "Vendor Name": "Example Supplies Pvt Ltd", " ": "",
+        "Subject": "Statement of account", "  ": "", "   ": invoices,
+    }
+
+
+def describe(excel_path) -> tuple:
+    """Everything the layout is made of: cell values and styles, column widths."""
+    ws = load_workbook(excel_path)["Data"]
+    cells = [
+        (cell.coordinate, cell.value, bool(cell.font.b), cell.border.left.style)
+        for row in ws.iter_rows() for cell in row
+        if cell.value not in (None, "") or cell.font.b or cell.border.left.style
+    ]
+    widths = {k: d.width for k, d in ws.column_dimensions.items() if d.width}
+    return cells, widths
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000, help="invoice rows per statement")
+    parser.add_argument("--files", type=int, default=8, help="statements for the batch run")
+    parser.add_argument("--workers", type=int, default=excel_writer.EXCEL_WORKERS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        json_paths = []
+        for i in range(args.files):
+            path = tmp / f"statement_{i}.json"
+            path.write_text(json.dumps(make_statement(args.rows, i)), encoding="utf-8")
+            json_paths.append(path)
+
+        # Same output first
+        legacy_convert_json_file_to_excel(json_paths[0], tmp / "legacy.xlsx")
+        excel_writer.write_report(json_paths[0], tmp / "fast.xlsx")
+        if describe(tmp / "legacy.xlsx") != describe(tmp / "fast.xlsx"):
+            sys.exit("✗ Layouts differ")
+        print("✓ Identical layout")
+
+        # One statement
+        legacy_one = timed(legacy_convert_json_file_to_excel, json_paths[0], tmp / "legacy.xlsx")
+        fast_one = timed(excel_writer.write_report, json_paths[0], tmp / "fast.xlsx")
+
+        # A batch of statements
+        legacy_all = timed(lambda: [
+            legacy_convert_json_file_to_excel(p, p.with_suffix(".legacy.xlsx")) for p in json_paths
+        ])
+        fast_all = timed(lambda: list(excel_writer.write_reports(
+            [(p, p.with_suffix(".fast.xlsx")) for p in json_paths], max_workers=args.workers,
+        )))
+
+    print(f"\n{args.rows} rows, 1 file : legacy {legacy_one:7.2f}s   fast {fast_one:7.2f}s   ({legacy_one / fast_one:.1f}x)")
+    print(f"{args.rows} rows, {args.files} files: legacy {legacy_all:7.2f}s   "
+          f"fast {fast_all:7.2f}s   ({legacy_all / fast_all:.1f}x, {args.workers} worker(s))")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+benchmarks/bench_pipeline.py
+End-to-end throughput benchmark on a synthetic corpus with a local fake LLM
+
+    python benchmarks/bench_pipeline.py --files 20 --pages 3 --rows 40
+    python benchmarks/bench_pipeline.py --latency 2 --rpm 120 --stages extract
+    python benchmarks/bench_pipeline.py --deployments 3 --rpm 60 --error-rate 0.3
+    python benchmarks/bench_pipeline.py --save-baseline      # after a known-good run
+
+Stages: convert (convert_pdfs_to_text), extract (extract_data_with_ai
+against benchmarks/fake_llm.py, one server per --deployments), excel (convert_json_to_excel) and api
+(/upload → /start → /download through the FastAPI app and its embedded
+workers). Each reports docs/sec, p50/p95 document latency (seconds from
+stage start until that document's output exists) and peak RSS of the
+process and its children.
+
+Results are compared with benchmarks/baseline.json: fewer docs/sec or a
+higher p95 than the baseline by more than --threshold, or more peak RSS
+than --rss-threshold, is a regression (exit code 1). Caches and vendor
+templates are disabled, so every run does the full work.
+
+Before the stages, `import main` is timed in fresh interpreters (the API's
+cold-start cost) and the heavy libraries it loaded are listed; the api
+stage also reports how long /readyz took once the app started.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import subprocess
+import tempfile
+import platform
+import threading
+from contextlib import ExitStack
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+from synthetic import make_corpus
+from fake_llm import FakeLLMServer
+
+STAGES = ["convert", "extract", "excel", "api"]
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+
+# Libraries the API process should not load just to answer requests
+HEAVY_MODULES = ("docling", "torch", "openai", "openpyxl", "pandas", "numpy", "fitz", "pyarrow", "tiktoken")
+
+# Import time changes below this many seconds are noise, not regressions
+IMPORT_NOISE_SECONDS = 0.1
+
+
+# ---------------------------------------------
+# MEASUREMENT
+# ---------------------------------------------
+
+def _children(pid: int) -> list:
+    found = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                found += [int(c) for c in f.read().split()]
+    except OSError:
+        pass
+    return found
+
+
+def tree_rss() -> int:
+    """Resident bytes of this process and all its descendants (Linux /proc)."""
+    total, pending = 0, [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            continue
+        pending += _children(pid)
+    return total
+
+
+class StageMonitor:
+    """
+    Samples peak RSS and the first time each expected output file exists
+    while a stage runs (works for outputs written by worker processes too).
+    """
+
+    def __init__(self, folder=None, suffix: str = "", interval: float = 0.02):
+        self.folder = Path(folder) if folder else None
+        self.suffix = suffix
+        self.interval = interval
+        self.seen = {}
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._proc = os.path.exists("/proc/self/statm")
+
+    def _sample(self):
+        now = time.perf_counter() - self.started
+        if self.folder is not None and self.folder.exists():
+            for path in self.folder.rglob(f"*{self.suffix}"):
+                self.seen.setdefault(path.stem, now)
+        if self._proc:
+            self.peak_rss = max(self.peak_rss, tree_rss())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        self.seconds = time.perf_counter() - self.started
+        if not self._proc:
+            # No /proc: lifetime peak of this process and its finished children
+            usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+            self.peak_rss = usage * (1 if platform.system() == "Darwin" else 1024)
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    index = (len(values) - 1) * q
+    low = int(index)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (index - low)
+
+
+def stage_result(docs: int, seconds: float, latencies: list, peak_rss: int) -> dict:
+    return {
+        "docs": docs,
+        "seconds": round(seconds, 3),
+        "docs_per_sec": round(len(latencies) / seconds, 3) if seconds else None,
+        "p50": round(percentile(latencies, 0.50), 3) if latencies else None,
+        "p95": round(percentile(latencies, 0.95), 3) if latencies else None,
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+        "failed": docs - len(latencies),
+    }
+
+
+def measure_import(module: str, runs: int) -> dict:
+    """Median seconds for a fresh interpreter to import module, and the heavy libraries it pulled in."""
+    code = (
+        "import sys, time, json; started = time.perf_counter(); import " + module + "; "
+        "print(json.dumps({'seconds': time.perf_counter() - started, "
+        f"'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))"
+    )
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", code], cwd=BENCH_DIR.parent, env=os.environ,
+                                capture_output=True, text=True, check=True)
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {
+        "import_seconds": round(percentile([s["seconds"] for s in samples], 0.5), 3),
+        "heavy_modules": samples[-1]["heavy"],
+    }
+
+
+# ---------------------------------------------
+# STAGES
+# ---------------------------------------------
+
+def configure_environment(args, llm_urls: list, workdir: Path):
+    """Point the pipeline at the fake LLM(s) and keep caches out of the measurement."""
+    if len(llm_urls) > 1:
+        os.environ["AZURE_DEPLOYMENTS"] = json.dumps([
+            {"name": f"fake-{i}", "deployment": f"fake-{i}", "endpoint": url} for i, url in enumerate(llm_urls)
+        ])
+    os.environ.update({
+        "AZURE_ENDPOINT": llm_urls[0],
+        "AZURE_API_KEY": "benchmark",
+        "AZURE_API_VERSION": os.environ.get("AZURE_API_VERSION", "2024-02-01"),
+        "AZURE_RPM": str(args.client_rpm or args.rpm or 100000),
+        "AZURE_TPM": str(args.client_tpm or args.tpm or 100000000),
+        "MARKDOWN_CACHE_ENABLED": "0",
+        "EXTRACTION_CACHE_ENABLED": "0",
+        "TEMPLATES_ENABLED": "0",
+        "TASK_DB_PATH": str(workdir / "tasks.sqlite3"),
+        "INVOICE_STORE_PATH": str(workdir / "invoices.sqlite3"),
+    })
+
+
+def run_batch_stages(args, stages: list, pdfs: list, workdir: Path) -> dict:
+    import full_pipeline
+
+    task_dir = workdir / "batch"
+    ctx = full_pipeline.PipelineContext.for_task_dir(task_dir, task_id="benchmark")
+    for folder in (ctx.input_folder, ctx.temp_txt_folder, ctx.output_json_folder, ctx.output_excel_folder):
+        os.makedirs(folder, exist_ok=True)
+    for pdf in pdfs:
+        shutil.copy(pdf, ctx.input_folder)
+
+    plan = [
+        ("convert", full_pipeline.convert_pdfs_to_text, ctx.temp_txt_folder, ".txt"),
+        ("extract", full_pipeline.extract_data_with_ai, ctx.output_json_folder, ".json"),
+        ("excel", full_pipeline.convert_json_to_excel, ctx.output_excel_folder, ".xlsx"),
+    ]
+    results = {}
+    last = max(i for i, (name, *_) in enumerate(plan) if name in stages)
+    # Later stages need the earlier stages' outputs: run them, report only the chosen ones
+    for name, function, folder, suffix in plan[:last + 1]:
+        with StageMonitor(folder, suffix) as monitor:
+            function(ctx)
+        if name in stages:
+            results[name] = stage_result(len(pdfs), monitor.seconds, list(monitor.seen.values()), monitor.peak_rss)
+    return results
+
+
+def wait_ready(client, timeout: float) -> float:
+    """Seconds until /readyz answers 200 (embedded workers load their models in the background)."""
+    started = time.perf_counter()
+    while True:
+        response = client.get("/readyz")
+        if response.status_code == 200:
+            return time.perf_counter() - started
+        if time.perf_counter() - started > timeout:
+            raise RuntimeError(f"API not ready after {timeout:.0f}s: {response.json()}")
+        time.sleep(0.05)
+
+
+def run_api_flow(args, pdfs: list) -> dict:
+    """/upload → /start → poll /status → /download, per-document latency from the event log."""
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        ready_seconds = wait_ready(client, args.timeout)
+        with StageMonitor() as monitor:
+            files = [("files", (pdf.name, open(pdf, "rb"), "application/pdf")) for pdf in pdfs]
+            try:
+                response = client.post("/upload", files=files)
+            finally:
+                for _, (_, handle, _) in files:
+                    handle.close()
+            response.raise_for_status()
+            task_id = response.json()["task_id"]
+
+            started = time.time()
+            client.post(f"/start/{task_id}").raise_for_status()
+            deadline = time.monotonic() + args.timeout
+            while True:
+                status = client.get(f"/status/{task_id}").json()
+                if status["status"] in ("finished", "failed") or time.monotonic() > deadline:
+                    break
+                time.sleep(0.1)
+            download = client.get(f"/download/{task_id}")
+
+            latencies = {}
+            for _, event in main.STORE.get_events(task_id, limit=100000):
+                if event.get("type") == "file" and event.get("state") == "done":
+                    latencies.setdefault(event["file"], event["at"] - started)
+            client.delete(f"/cleanup/{task_id}")
+
+    if status["status"] != "finished" or download.status_code != 200:
+        print(f"✗ API flow ended {status['status']}: {status.get('error')}")
+    result = stage_result(len(pdfs), monitor.seconds, list(latencies.values()), monitor.peak_rss)
+    result["ready_seconds"] = round(ready_seconds, 3)
+    return result
+
+
+# ---------------------------------------------
+# BASELINE
+# ---------------------------------------------
+
+def compare(results: dict, baseline: dict, threshold: float, rss_threshold: float, startup: dict = None) -> list:
+    """Regressions against the baseline, as printable lines."""
+    problems = []
+    previous_startup = baseline.get("startup") or {}
+    before = previous_startup.get("import_seconds")
+    if startup and before:
+        now = startup["import_seconds"]
+        if now - before > max(before * threshold, IMPORT_NOISE_SECONDS):
+            problems.append(f"startup: import main {before}s → {now}s")
+        heavy = set(startup["heavy_modules"]) - set(previous_startup.get("heavy_modules", []))
+        if heavy:
+            problems.append(f"startup: import main now loads {', '.join(sorted(heavy))}")
+    for stage, current in results.items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous:
+            continue
+        checks = [
+            ("docs/sec", current["docs_per_sec"], previous["docs_per_sec"], -1, threshold),
+            ("p95", current["p95"], previous["p95"], 1, threshold),
+            ("peak RSS MB", current["peak_rss_mb"], previous["peak_rss_mb"], 1, rss_threshold),
+        ]
+        for label, now, before, direction, limit in checks:
+            if now is None or not before:
+                continue
+            change = (now - before) / before
+            if change * direction > limit:
+                problems.append(f"{stage}: {label} {before} → {now} ({change:+.0%}, limit {limit:.0%})")
+        if current["failed"] > previous.get("failed", 0):
+            problems.append(f"{stage}: {current['failed']} failed document(s)")
+    return problems
+
+
+def print_results(results: dict, baseline: dict):
+    print(f"\n{'stage':<10}{'docs':>6}{'docs/s':>10}{'p50 s':>9}{'p95 s':>9}{'RSS MB':>9}{'base docs/s':>13}{'base p95':>10}")
+    for stage, r in results.items():
+        base = baseline.get("stages", {}).get(stage, {})
+        fmt = lambda v: format(v, ".2f") if v is not None else "-"
+        print(f"{stage:<10}{r['docs']:>6}{fmt(r['docs_per_sec']):>10}{fmt(r['p50']):>9}"
+              f"{fmt(r['p95']):>9}{r['peak_rss_mb']:>9.0f}"
+              f"{fmt(base.get('docs_per_sec')):>13}{fmt(base.get('p95')):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20, help="synthetic statements")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=40, help="invoice rows per page")
+    parser.add_argument("--scanned", type=int, default=0, help="of which image-only (Docling path)")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated: {', '.join(STAGES)}")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake LLM seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--rpm", type=int, default=0, help="fake LLM requests/minute (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="fake LLM tokens/minute (0 = unlimited)")
+    parser.add_argument("--client-rpm", type=int, default=0, help="AZURE_RPM for the pipeline (default: --rpm)")
+    parser.add_argument("--client-tpm", type=int, default=0, help="AZURE_TPM for the pipeline (default: --tpm)")
+    parser.add_argument("--deployments", type=int, default=1, help="fake LLM servers behind the router")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests the first fake deployment answers with 500")
+    parser.add_argument("--timeout", type=float, default=1800, help="API flow time limit, seconds")
+    parser.add_argument("--import-runs", type=int, default=3, help="fresh interpreters timing `import main` (0 = skip)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.20, help="allowed docs/sec drop and p95 growth")
+    parser.add_argument("--rss-threshold", type=float, default=0.25, help="allowed peak RSS growth")
+    parser.add_argument("--json", type=Path, help="also write the results here")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    config = {k: getattr(args, k) for k in ("files", "pages", "rows", "scanned", "latency", "jitter", "rpm", "tpm",
+                                            "deployments", "error_rate")}
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    if baseline and baseline.get("config") != config:
+        print(f"Baseline was recorded with {baseline.get('config')}; this run uses {config}")
+
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as servers:
+        llms = [
+            servers.enter_context(FakeLLMServer(latency=args.latency, jitter=args.jitter, rpm=args.rpm, tpm=args.tpm,
+                                                seed=i, error_rate=args.error_rate if i == 0 else 0.0))
+            for i in range(max(1, args.deployments))
+        ]
+        workdir = Path(tmp)
+        configure_environment(args, [llm.url for llm in llms], workdir)
+
+        startup = None
+        if args.import_runs > 0:
+            startup = measure_import("main", args.import_runs)
+            print(f"Startup: import main {startup['import_seconds']:.2f}s (median of {args.import_runs}), "
+                  f"heavy modules loaded: {', '.join(startup['heavy_modules']) or 'none'}")
+
+        started = time.perf_counter()
+        pdfs = make_corpus(workdir / "corpus", args.files, args.pages, args.rows, args.scanned)
+        print(f"Corpus: {len(pdfs)} PDF(s), {args.pages} page(s) × {args.rows} rows "
+              f"in {time.perf_counter() - started:.1f}s; fake LLM on {', '.join(llm.url for llm in llms)}")
+
+        results = {}
+        batch = [s for s in stages if s != "api"]
+        if batch:
+            results.update(run_batch_stages(args, batch, pdfs, workdir))
+        if "api" in stages:
+            results["api"] = run_api_flow(args, pdfs)
+        for llm in llms:
+            print(f"Fake LLM {llm.url}: {llm.stats['requests']} completion(s), "
+                  f"{llm.stats['throttled']} throttled (429), {llm.stats['errors']} failed (500)")
+
+    print_results(results, baseline)
+    if "api" in results:
+        print(f"API ready (/readyz) {results['api']['ready_seconds']:.2f}s after start-up")
+    run = {"config": config, "python": platform.python_version(), "cpus": os.cpu_count(),
+           "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "startup": startup, "stages": results}
+    if args.json:
+        args.json.write_text(json.dumps(run, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(run, indent=2) + "\n")
+        print(f"\n✓ Baseline saved to {args.baseline}")
+        return 0
+    if not baseline:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+
+    problems = compare(results, baseline, args.threshold, args.rss_threshold, startup)
+    for problem in problems:
+        print(f"✗ Regression: {problem}")
+    if not problems:
+        print("\n✓ No regressions against the baseline")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+benchmarks/bench_routing.py
+PDF → markdown: Docling only vs the text-layer router (CONVERT_ROUTING=auto)
+
+    python benchmarks/bench_routing.py --files 10 --pages 3
+    python benchmarks/bench_routing.py --pdf-dir /path/to/statements
+
+Synthetic statements (born-digital, plus a scanned copy of one) have known
+invoice numbers, dates and amounts: accuracy is the share of them found in
+the markdown. For --pdf-dir there is no ground truth, so the routed output
+is compared with Docling's (share of Docling's words it also contains).
+"""
+
+import re
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import text_layer
+from synthetic import make_statement, make_scan
+
+try:
+    from docling.document_converter import DocumentConverter
+except ImportError:
+    DocumentConverter = None
+
+
+# ---------------------------------------------
+# CONVERTERS
+# ---------------------------------------------
+
+def convert_docling(converter, pdf_path, txt_path):
+    result = converter.convert(str(pdf_path))
+    Path(txt_path).write_text(result.document.export_to_markdown(), encoding="utf-8")
+
+
+def convert_routed(converter, pdf_path, txt_path) -> str:
+    pages = text_layer.analyze_pdf(pdf_path)
+    if pages and all(p["usable"] for p in pages):
+        text_layer.convert_pdf(pdf_path, txt_path)
+        return "text"
+    if converter is None:
+        return "docling (not installed)"
+    convert_docling(converter, pdf_path, txt_path)
+    return "docling"
+
+
+def recall(markdown: str, truth: list) -> float:
+    return sum(1 for value in truth if value in markdown) / max(len(truth), 1)
+
+
+def overlap(markdown: str, reference: str) -> float:
+    words = set(re.findall(r"\w+", reference))
+    return len(words & set(re.findall(r"\w+", markdown))) / max(len(words), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10, help="synthetic statements")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=40, help="invoice rows per page")
+    parser.add_argument("--pdf-dir", help="benchmark these PDFs instead of synthetic ones")
+    args = parser.parse_args()
+
+    converter = DocumentConverter() if DocumentConverter is not None else None
+    if converter is None:
+        print("Docling is not installed: timing the text-layer path only")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        cases = []                            # (pdf_path, truth or None)
+        if args.pdf_dir:
+            cases = [(p, None) for p in sorted(Path(args.pdf_dir).glob("*.pdf"))]
+        else:
+            for i in range(args.files):
+                path = tmp / f"statement_{i}.pdf"
+                cases.append((path, make_statement(path, args.pages, args.rows, i)))
+            make_scan(cases[0][0], tmp / "scanned_0.pdf")
+            cases.append((tmp / "scanned_0.pdf", cases[0][1]))
+
+        totals = {"docling": 0.0, "routed": 0.0}
+        print(f"\n{'file':<22}{'route':<26}{'docling s':>10}{'routed s':>10}{'docling acc':>13}{'routed acc':>12}")
+        for pdf_path, truth in cases:
+            docling_seconds = docling_acc = None
+            docling_md = ""
+            if converter is not None:
+                start = time.perf_counter()
+                convert_docling(converter, pdf_path, tmp / "docling.md")
+                docling_seconds = time.perf_counter() - start
+                docling_md = (tmp / "docling.md").read_text(encoding="utf-8")
+                totals["docling"] += docling_seconds
+
+            start = time.perf_counter()
+            route = convert_routed(converter, pdf_path, tmp / "routed.md")
+            routed_seconds = time.perf_counter() - start
+            totals["routed"] += routed_seconds
+            routed_md = (tmp / "routed.md").read_text(encoding="utf-8") if (tmp / "routed.md").exists() else ""
+            (tmp / "routed.md").unlink(missing_ok=True)
+
+            if truth is not None:
+                routed_acc = recall(routed_md, truth)
+                docling_acc = recall(docling_md, truth) if converter is not None else None
+            else:
+                routed_acc = overlap(routed_md, docling_md) if converter is not None else None
+
+            fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+            print(f"{pdf_path.name:<22}{route:<26}{fmt(docling_seconds, '10.2f'):>10}{routed_seconds:>10.2f}"
+                  f"{fmt(docling_acc, '13.1%'):>13}{fmt(routed_acc, '12.1%'):>12}")
+
+    print(f"\nTotal: docling {totals['docling']:.2f}s, routed {totals['routed']:.2f}s"
+          + (f" ({totals['docling'] / totals['routed']:.1f}x faster)" if converter is not None and totals["routed"] else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+benchmarks/fake_llm.py
+Local OpenAI / Azure OpenAI compatible chat-completions stub for benchmarks
+
+    python benchmarks/fake_llm.py --port 8100 --latency 1.5 --jitter 0.5 --rpm 300
+
+Answers any POST .../chat/completions with an extraction of the markdown
+tables in the prompt (rows starting with a DD.MM.YYYY date, like the
+synthetic statements), after `latency` ± `jitter` seconds. Requests over
+the RPM/TPM limits get 429 with Retry-After, like Azure; --error-rate
+answers a share of requests with 500. Start several on different ports to
+stand in for several deployments (AZURE_DEPLOYMENTS).
+
+Tests script specific answers with fail_next() (e.g. a 429 carrying
+retry-after-ms, or a 400) and read the peak concurrency from stats.
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DATE_CELL = re.compile(r"^(\d{2})\.(\d{2})\.(\d{4})$")
+
+
+def fake_extraction(markdown: str) -> dict:
+    """What the model would answer for a synthetic statement."""
+    invoices, total = [], 0.0
+    for line in markdown.splitlines():
+        cells = [c.strip() for c in line.strip().strip("|").split("|")]
+        if len(cells) < 5 or not DATE_CELL.match(cells[0]):
+            continue
+        day, month, year = DATE_CELL.match(cells[0]).groups()
+        try:
+            amount = float(cells[3].replace(".", "").replace(",", "."))
+        except ValueError:
+            continue
+        total += amount
+        invoices.append({
+            "Invoice Date": f"{day}-{month}-{year}", "Invoice No": cells[1],
+            "Purchase order No. if available": re.sub(r"\D", "", cells[2]), "Invoice Amount": amount,
+            "Invoice Currency": cells[4], "Invoice Due Date": "", "Remarks if any": "",
+        })
+    invoices.append({
+        "Invoice Date": "", "Invoice No": "Total", "Purchase order No. if available": "",
+        "Invoice Amount": round(total, 2), "Invoice Currency": "EUR", "Invoice Due Date": "", "Remarks if any": "",
+    })
+    return {
+        "": "", "Company Code": "1000", "Legal Entity Name": "Example Industries Ltd",
+        "Vendor No": "", "Vendor Name": "Example Supplies Pvt Ltd", " ": "", "Subject": "Statement of account",
+        "  ": "", "   ": invoices,
+    }
+
+
+class FakeLLMServer:
+    """Chat-completions stub on 127.0.0.1:port, served from a background thread."""
+
+    def __init__(self, port: int = 0, latency: float = 1.0, jitter: float = 0.0,
+                 rpm: int = 0, tpm: int = 0, seed: int = 0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rpm = rpm                      # 0 = unlimited
+        self.tpm = tpm
+        self.error_rate = error_rate        # share of requests answered with 500
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+        self._window = deque()              # (time, tokens) of accepted requests, last 60 s
+        self._scripted = deque()            # (status, headers) answers queued by fail_next()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def fail_next(self, status: int, times: int = 1, headers: dict = None):
+        """Answer the next `times` requests with `status` (and headers) before any limit is checked."""
+        with self._lock:
+            self._scripted.extend([(status, dict(headers or {}))] * times)
+
+    def scripted(self):
+        """The next fail_next() answer, or None."""
+        with self._lock:
+            if not self._scripted:
+                return None
+            status, headers = self._scripted.popleft()
+            self.stats["throttled" if status == 429 else "errors"] += 1
+            return status, headers
+
+    def track(self, delta: int):
+        with self._lock:
+            self.stats["in_flight"] += delta
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def admit(self, tokens: int):
+        """None when the request fits the limits, else the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0][0] >= 60:
+                self._window.popleft()
+            used = sum(t for _, t in self._window)
+            if (self.rpm and len(self._window) >= self.rpm) or (self.tpm and used + tokens > self.tpm):
+                self.stats["throttled"] += 1
+                return max(0.1, 60 - (now - self._window[0][0])) if self._window else 1.0
+            self._window.append((now, tokens))
+            self.stats["requests"] += 1
+            return None
+
+    def delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def fails(self) -> bool:
+        with self._lock:
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return True
+            return False
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                if not self.path.split("?")[0].endswith("/chat/completions"):
+                    return self._reply(404, {"error": {"code": "404", "message": "Not found"}})
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+                prompt_tokens = len(prompt) // 4 + 1
+
+                scripted = server.scripted()
+                if scripted is not None:
+                    status, headers = scripted
+                    return self._reply(status, {"error": {"code": str(status), "message": "Scripted error"}}, headers)
+
+                wait = server.admit(prompt_tokens)
+                if wait is not None:
+                    return self._reply(
+                        429,
+                        {"error": {"code": "429", "message": f"Rate limit exceeded. Retry after {wait:.0f} seconds."}},
+                        {"Retry-After": str(max(1, round(wait))), "retry-after-ms": str(int(wait * 1000))},
+                    )
+
+                server.track(1)
+                try:
+                    time.sleep(server.delay())
+                finally:
+                    server.track(-1)
+                if server.fails():
+                    return self._reply(500, {"error": {"code": "500", "message": "Internal server error"}})
+                content = json.dumps(fake_extraction(prompt))
+                completion_tokens = len(content) // 4 + 1
+                self._reply(200, {
+                    "id": f"chatcmpl-fake-{time.time_ns()}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                })
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="± seconds around --latency")
+    parser.add_argument("--rpm", type=int, default=0, help="requests/minute before 429 (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="prompt tokens/minute before 429 (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.port, args.latency, args.jitter, args.rpm, args.tpm, error_rate=args.error_rate)
+    print(f"Fake LLM on {server.url} (AZURE_ENDPOINT={server.url}); Ctrl+C to stop")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
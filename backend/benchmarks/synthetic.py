@@ -0,0 +1,74 @@
+"""
+benchmarks/synthetic.py
+Synthetic vendor statements (PDF) with known invoice values
+"""
+
+import random
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+
+def make_statement(path, pages: int, rows_per_page: int, seed: int) -> list:
+    """Born-digital statement with a ruled invoice table; returns the ground-truth values."""
+    rng = random.Random(seed)
+    truth = []
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        page.insert_text((50, 50), f"Example Supplies Pvt Ltd - Statement of account - Vendor V{seed:05d}", fontsize=10)
+        page.insert_text((50, 66), "Company Code 1000 - Example Industries Ltd", fontsize=9)
+
+        x = [50, 140, 240, 340, 450, 545]
+        y = 90
+        header = ["Date", "Invoice No", "Reference", "Amount", "Currency"]
+        for row in [header] + [None] * rows_per_page:
+            if row is None:
+                invoice = f"INV{seed:03d}{p:02d}{len(truth):04d}"
+                date = f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.2024"
+                amount = f"{rng.randint(10, 99999)},{rng.randint(0, 99):02d}"
+                row = [date, invoice, f"PO{rng.randint(10000, 99999)}", amount, "EUR"]
+                truth += [invoice, date, amount]
+            for i, value in enumerate(row):
+                page.insert_text((x[i] + 3, y + 12), value, fontsize=8)
+            page.draw_line((x[0], y), (x[-1], y))
+            y += 16
+        page.draw_line((x[0], y), (x[-1], y))
+        for xi in x:
+            page.draw_line((xi, 90), (xi, y))
+
+        page.insert_text((50, y + 30), "Registered office: Example Street 1, 12345 Example City", fontsize=7)
+        page.insert_text((480, 810), f"Page {p + 1} of {pages}", fontsize=7)
+    doc.save(path)
+    return truth
+
+
+def make_scan(source, path, dpi: int = 150):
+    """Image-only copy of a PDF, like a scanned statement."""
+    src = fitz.open(source)
+    doc = fitz.open()
+    for page in src:
+        pix = page.get_pixmap(dpi=dpi)
+        new = doc.new_page(width=page.rect.width, height=page.rect.height)
+        new.insert_image(new.rect, pixmap=pix)
+    doc.save(path)
+
+
+def make_corpus(folder, files: int, pages: int, rows_per_page: int, scanned: int = 0) -> list:
+    """
+    files born-digital statements (the first `scanned` of them as image-only
+    copies instead) in folder. Returns the PDF paths.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = folder / f"statement_{i:04d}.pdf"
+        make_statement(path, pages, rows_per_page, i)
+        if i < scanned:
+            digital = folder / f"digital_{i:04d}.tmp"
+            path.rename(digital)
+            make_scan(digital, path)
+            digital.unlink()
+        paths.append(path)
+    return paths
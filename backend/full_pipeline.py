@@ -1,13 +1,25 @@
 import os
+import csv
 import json
-import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
-from docling.document_converter import DocumentConverter
-from openai import AzureOpenAI
+import time
+import shutil
+import queue
+import threading
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, ALL_COMPLETED
 from dotenv import load_dotenv
 
+from utils import converter_pool, text_layer, page_ranges, markdown_cache, markdown_chunker, markdown_cleaner
+from utils import llm_client, llm_router, extraction_cache, vendor_templates
+from utils import consolidated_export, invoice_store, checkpoints, metrics, zipper, lazy
+from utils.log import get_logger, setup_logging
+
+log = get_logger("pipeline")
+
+# openpyxl, openai and Docling load in the pipeline workers (preload()), not
+# when the API imports this module
+excel_writer = lazy.module("utils.excel_writer")
+
 
 load_dotenv()
 
@@ -27,13 +39,55 @@ TEMP_TXT_FOLDER = "temp_txt"
 OUTPUT_JSON_FOLDER = "output_json"
 OUTPUT_EXCEL_FOLDER = "output_excel"
 
+# Docling settings; part of the markdown cache key, so bump on any change
+DOCLING_OPTIONS = {"converter": "DocumentConverter()", "export": "markdown"}
+
+# PDF → markdown route: "auto" converts PDFs whose pages all have a usable
+# text layer with PyMuPDF (utils/text_layer.py) and sends scanned or complex
+# ones to Docling; "docling" always uses Docling
+CONVERT_ROUTING = os.getenv("CONVERT_ROUTING", "auto")
+
+# PDFs of at least DOCLING_SPLIT_MIN_PAGES pages going to Docling are split into
+# ranges of DOCLING_SPLIT_CHUNK_PAGES, converted in parallel by the converter
+# pool (DOCLING_POOL_SIZE workers) and stitched back together (0 = never split)
+DOCLING_SPLIT_MIN_PAGES = int(os.getenv("DOCLING_SPLIT_MIN_PAGES", "20"))
+DOCLING_SPLIT_CHUNK_PAGES = int(os.getenv("DOCLING_SPLIT_CHUNK_PAGES", "8"))
+
+# Streaming pipeline: max documents waiting between two stages
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+# Consolidated exports written next to the per-PDF workbooks when a task
+# does not choose its own: comma-separated xlsx, csv, parquet (empty = none)
+CONSOLIDATED_EXPORTS = os.getenv("CONSOLIDATED_EXPORTS", "")
+
+# Invoices found in other documents (utils/invoice_store.py) are listed in this
+# file inside output_excel, so they end up in the task's ZIP
+DUPLICATES_FILE_NAME = "duplicates.csv"
 
 # Azure OpenAI Credentials
 # REPLACE THESE WITH YOUR ACTUAL CREDENTIALS
 AZURE_ENDPOINT = AZURE_ENDPOINT
 AZURE_API_KEY = AZURE_API_KEY
 AZURE_API_VERSION = AZURE_API_VERSION
-AZURE_DEPLOYMENT = "jss-gpt-4o"
+AZURE_DEPLOYMENT = AZURE_DEPLOYMENT or "jss-gpt-4o"
+# More deployments, and which takes short statements: AZURE_DEPLOYMENTS (utils/llm_router.py)
+
+# Extraction requests kept in flight at once (RPM/TPM limits: utils/llm_client.py)
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "4"))
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", "120"))
+AI_TEMPERATURE = 0
+
+# "full" (default) or "compact": shorter prompts carrying the same rules
+AI_PROMPT_VARIANT = os.getenv("AI_PROMPT_VARIANT", "full")
+
+# Strip page boilerplate, image placeholders and table padding before extraction
+MARKDOWN_PREPROCESS = os.getenv("MARKDOWN_PREPROCESS", "1") == "1"
+
+# Long statements: markdown over the threshold is split into chunks of at
+# most AI_CHUNK_MAX_TOKENS, extracted in parallel and merged (0 = never split)
+AI_CHUNK_THRESHOLD_TOKENS = int(os.getenv("AI_CHUNK_THRESHOLD_TOKENS", "12000"))
+AI_CHUNK_MAX_TOKENS = int(os.getenv("AI_CHUNK_MAX_TOKENS", "6000"))
+AI_CHUNK_CONCURRENCY = int(os.getenv("AI_CHUNK_CONCURRENCY", "4"))
 
 # Embedded Schema (Reconstructed from your requirements to make script standalone)
 # You can also load this from a file if you prefer, but this makes the script single-file.
@@ -65,62 +119,112 @@ def setup_folders():
     for folder in folders:
         if not os.path.exists(folder):
             os.makedirs(folder)
-            print(f"✓ Created folder: {folder}")
-
-# ==========================================
-# 2. MODULE: PDF TO TEXT (Docling)
-# ==========================================
-
-def convert_pdfs_to_text():
-    """Converts PDFs from input folder to Markdown/Text."""
-    print(f"\n{'='*60}")
-    print("STEP 1: PDF → TEXT CONVERSION")
-    print(f"{'='*60}")
-
-    converter = DocumentConverter()
-    files_processed = 0
-
-    files = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith(".pdf")]
-    
-    if not files:
-        print("No PDF files found in input folder.")
+            log.info(f"✓ Created folder: {folder}")
+
+class PipelineContext:
+    """
+    Everything one pipeline run needs: its folders, the LLM router and the
+    options/worker slots it shares with other runs. Stage functions take
+    it explicitly, so several tasks can run side by side in one process.
+    """
+
+    def __init__(self, input_folder, temp_txt_folder, output_json_folder, output_excel_folder,
+                 task_id="default", client=None, ai_concurrency=None, queue_size=None,
+                 file_hashes=None, convert_slots=None, ai_slots=None, exports=None, manifest=None):
+        self.input_folder = str(input_folder)
+        self.temp_txt_folder = str(temp_txt_folder)
+        self.output_json_folder = str(output_json_folder)
+        self.output_excel_folder = str(output_excel_folder)
+        self.task_id = task_id
+        self.ai_concurrency = ai_concurrency or AI_CONCURRENCY
+        self.queue_size = queue_size or PIPELINE_QUEUE_SIZE
+        # SHA-256 per input file name, computed at upload (saves re-hashing for the cache)
+        self.file_hashes = file_hashes or {}
+        # utils.scheduler.FairShare gates shared between tasks (None = no sharing)
+        self.convert_slots = convert_slots
+        self.ai_slots = ai_slots
+        # Consolidated export formats (utils/consolidated_export.py)
+        self.exports = consolidated_export.parse_formats(
+            CONSOLIDATED_EXPORTS if exports is None else exports
+        )
+        # utils.checkpoints.Manifest of the task directory: finished stages are skipped
+        self.manifest = manifest
+        # An injected OpenAI-style client (tests) replaces the configured deployments
+        self._client = client
+        self._router = None
+        self._client_lock = threading.Lock()
+
+    @classmethod
+    def for_task_dir(cls, task_dir, **options):
+        """Context for the backend/uploads/<task_id>/ layout."""
+        return cls(
+            os.path.join(task_dir, "input_pdf"),
+            os.path.join(task_dir, "temp_txt"),
+            os.path.join(task_dir, "output_json"),
+            os.path.join(task_dir, "output_excel"),
+            **options,
+        )
+
+    @property
+    def router(self):
+        """utils.llm_router.LLMRouter the run's extraction requests go through."""
+        with self._client_lock:
+            if self._router is None:
+                if self._client is None:
+                    self._router = get_llm_router()
+                else:
+                    deployment = llm_router.Deployment(**default_deployment(), limiter=llm_client.get_limiter(),
+                                                       client=self._client)
+                    self._router = llm_router.LLMRouter([deployment])
+            return self._router
+
+    def convert_slot(self):
+        return self.convert_slots.slot(self.task_id) if self.convert_slots else nullcontext()
+
+    def ai_slot(self):
+        return self.ai_slots.slot(self.task_id) if self.ai_slots else nullcontext()
+
+
+def pdf_names(ctx):
+    """Input PDF file name per base name (outputs are named after the base name)."""
+    return {os.path.splitext(f)[0]: f for f in os.listdir(ctx.input_folder) if f.lower().endswith(".pdf")}
+
+
+def stage_input_sha(ctx, file_name, stage):
+    """SHA-256 a stage's output is made from: the PDF, or the previous stage's output."""
+    if stage == "convert":
+        return ctx.file_hashes.get(file_name) or checkpoints.file_sha256(os.path.join(ctx.input_folder, file_name))
+    previous = checkpoints.STAGES[checkpoints.STAGES.index(stage) - 1]
+    return ctx.manifest.output_sha(file_name, previous)
+
+
+def checkpoint_valid(ctx, file_name, stage, output_path):
+    """True when the task manifest says this stage is already done for the file."""
+    if ctx.manifest is None:
+        return False
+    return ctx.manifest.is_done(file_name, stage, output_path, stage_input_sha(ctx, file_name, stage))
+
+
+def checkpoint(ctx, file_name, stage, output_path=None, error=None):
+    """Record a stage's outcome in the task manifest (no-op without one)."""
+    if ctx.manifest is None:
         return
+    if error is not None:
+        ctx.manifest.failed(file_name, stage, error)
+    else:
+        ctx.manifest.done(file_name, stage, output_path, stage_input_sha(ctx, file_name, stage))
 
-    for file_name in files:
-        pdf_path = os.path.join(INPUT_FOLDER, file_name)
-        base_name = os.path.splitext(file_name)[0]
-        txt_path = os.path.join(TEMP_TXT_FOLDER, base_name + ".txt")
-
-        print(f"Converting: {file_name}...")
-        
-        try:
-            result = converter.convert(pdf_path)
-            with open(txt_path, "w", encoding="utf-8") as f:
-                f.write(result.document.export_to_markdown())
-            files_processed += 1
-        except Exception as e:
-            print(f"✗ Error converting {file_name}: {e}")
 
-    print(f"✓ converted {files_processed} file(s).")
+def default_context():
+    """Context built from the module-level folder settings (standalone script use)."""
+    return PipelineContext(INPUT_FOLDER, TEMP_TXT_FOLDER, OUTPUT_JSON_FOLDER, OUTPUT_EXCEL_FOLDER)
 
 # ==========================================
-# 3. MODULE: TEXT TO JSON (Azure OpenAI)
+# PROMPTS
 # ==========================================
 
-def extract_data_with_ai():
-    """Extracts structured JSON from text files using Azure OpenAI."""
-    print(f"\n{'='*60}")
-    print("STEP 2: AI DATA EXTRACTION")
-    print(f"{'='*60}")
-
-    client = AzureOpenAI(
-        azure_endpoint=AZURE_ENDPOINT,
-        api_key=AZURE_API_KEY,
-        api_version=AZURE_API_VERSION
-    )
-
-    # --- STRICT SYSTEM PROMPT (UNCHANGED) ---
-    system_prompt = """You are a precise data extraction assistant specialized in parsing invoice statements from markdown/text format into structured JSON.
+# --- STRICT SYSTEM PROMPT (UNCHANGED) ---
+SYSTEM_PROMPT = """You are a precise data extraction assistant specialized in parsing invoice statements from markdown/text format into structured JSON.
 
 
 Key responsibilities:
@@ -169,22 +273,41 @@ Key responsibilities:
 # - Follow the provided schema exactly
 # - Use empty strings "" for missing text fields and 0.0 for missing numeric amounts"""
 
-    files = [f for f in os.listdir(TEMP_TXT_FOLDER) if f.lower().endswith(".txt")]
-    processed_count = 0
-    error_count = 0
 
-    for file_name in files:
-        txt_path = os.path.join(TEMP_TXT_FOLDER, file_name)
-        json_path = os.path.join(OUTPUT_JSON_FOLDER, os.path.splitext(file_name)[0] + ".json")
-        
-        print(f"Processing: {file_name}")
+# --- COMPACT VARIANT (AI_PROMPT_VARIANT=compact) ---
+# Same rules as above without the repetition; schema sent as minified JSON.
+COMPACT_SYSTEM_PROMPT = """Extract an invoice statement (markdown from a PDF) into JSON. Return only one JSON object matching the schema; no other text.
+- Never calculate or sum amounts; copy them as printed. Convert European numbers (1.234,56) to 1234.56. Invoice Amount is a number.
+- Dates as DD-MM-YYYY; unparseable dates "".
+- Invoice Amount: the Debit amount when a Debit column/value exists; never use Credit; without Debit use the document's Total / Balance / Amount Due. Never net Debit and Credit.
+- Purchase order No. if available: the PO number, else the number from "Customer Ref", "REFERENCE", "Reference", "ref" or "PO" (case-insensitive), number only.
+- Invoice Currency: from the amount, else the currency shown elsewhere, e.g. on the total (£ GBP, $ USD, € EUR).
+- Keep invoices in source order. The last row is the Total exactly as printed ("Total", "Total Balance", "Total Amount Due", "Amount Payable", "Total Balance Outstanding"), with "Purchase order No. if available": "Total" and "Invoice Date", "Invoice No" set to "".
+- Missing text fields "", missing amounts 0.0; "Remarks if any" only when present.
+- Use the schema keys exactly, including the spacer keys "", " ", "  " and "   " (three spaces) as the invoice table key."""
 
-        try:
-            with open(txt_path, "r", encoding="utf-8") as f:
-                markdown_content = f.read()
 
-            # --- STRICT USER PROMPT (UNCHANGED) ---
-            prompt = f"""You are a data-extraction assistant. I will give you a markdown/text representation of an invoice statement extracted from a PDF. Parse that text and return **only** a single JSON object matching the schema described below. Do not add extra fields, comments, or explanations — return raw JSON and nothing else.
+def system_prompt():
+    """System prompt of the configured AI_PROMPT_VARIANT."""
+    return COMPACT_SYSTEM_PROMPT if AI_PROMPT_VARIANT == "compact" else SYSTEM_PROMPT
+
+
+def build_compact_user_prompt(markdown_content):
+    schema = json.dumps(JSON_SCHEMA, separators=(",", ":"), ensure_ascii=False)
+    return f"""Schema:
+{schema}
+
+Markdown:
+{markdown_content}"""
+
+
+def build_user_prompt(markdown_content):
+    """Builds the extraction prompt for one document's markdown."""
+    if AI_PROMPT_VARIANT == "compact":
+        return build_compact_user_prompt(markdown_content)
+
+    # --- STRICT USER PROMPT (UNCHANGED) ---
+    prompt = f"""You are a data-extraction assistant. I will give you a markdown/text representation of an invoice statement extracted from a PDF. Parse that text and return **only** a single JSON object matching the schema described below. Do not add extra fields, comments, or explanations — return raw JSON and nothing else.
 
 Rules and mapping:
 1. Top-level fields (strings):
@@ -268,197 +391,1001 @@ Markdown Content to Extract:
 ---
 
 Return ONLY the JSON object matching the schema above. No markdown, no code blocks, no explanations."""
+    return prompt
+
+# ==========================================
+# 2. MODULE: PDF TO TEXT (Docling, PyMuPDF text layer)
+# ==========================================
+
+def new_converter():
+    """In-process Docling converter, used when there is no converter pool."""
+    from docling.document_converter import DocumentConverter
+
+    return DocumentConverter()
+
+
+def preload(docling=False):
+    """
+    Import the heavy libraries now, while a worker starts, rather than in its
+    first task: openai and openpyxl, plus Docling when it converts in-process.
+    """
+    import openai  # noqa: F401
+    excel_writer.load()
+    consolidated_export.openpyxl_cell.load()
+    if docling:
+        import docling.document_converter  # noqa: F401
+
+
+def convert_pdf_file(converter, pdf_path, txt_path):
+    """Converts a single PDF to Markdown/Text."""
+    result = converter.convert(pdf_path)
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write(result.document.export_to_markdown(page_break_placeholder=markdown_chunker.PAGE_BREAK))
+
+
+def markdown_options():
+    """Everything besides the PDF bytes that shapes its markdown (cache key)."""
+    options = dict(DOCLING_OPTIONS, routing=CONVERT_ROUTING,
+                   split=[DOCLING_SPLIT_MIN_PAGES, DOCLING_SPLIT_CHUNK_PAGES],
+                   page_break=markdown_chunker.PAGE_BREAK)
+    if CONVERT_ROUTING == "auto":
+        options["text_layer"] = {
+            "min_chars": text_layer.TEXT_LAYER_MIN_CHARS,
+            "max_image_coverage": text_layer.TEXT_LAYER_MAX_IMAGE_COVERAGE,
+        }
+    return options
+
+
+def route_pdf(pdf_path):
+    """
+    Picks the converter for one PDF: "text" when every page has a usable
+    text layer, "docling" when none has, "mixed" otherwise.
+    Returns (route, info, page_routes); info (route and page counts) is
+    recorded with the file, page_routes is "text"/"docling" per page.
+    """
+    if CONVERT_ROUTING != "auto" or not text_layer.available():
+        return "docling", {"route": "docling"}, None
+
+    try:
+        pages = text_layer.analyze_pdf(pdf_path)
+    except Exception as e:
+        # Let Docling deal with PDFs PyMuPDF cannot read
+        log.warning(f"Text layer check failed for {os.path.basename(pdf_path)}: {e}")
+        return "docling", {"route": "docling"}, None
+
+    page_routes = ["text" if page["usable"] else "docling" for page in pages]
+    text_pages = page_routes.count("text")
+    if pages and text_pages == len(pages):
+        route = "text"
+    elif text_pages:
+        route = "mixed"
+    else:
+        route = "docling"
+    return route, {"route": route, "pages": len(pages), "text_pages": text_pages}, page_routes
+
+
+def plan_page_ranges(pdf_path, route, page_routes, pool):
+    """
+    [(start, end, route)] page ranges to convert separately and stitch, or
+    None to convert the PDF whole. Mixed PDFs: text-layer pages read
+    directly, only the other pages go to Docling. Large Docling PDFs:
+    ranges spread over the pool's workers.
+    """
+    split = DOCLING_SPLIT_CHUNK_PAGES if pool is not None else 0
+    if route == "mixed":
+        return page_ranges.plan_ranges(page_routes, split)
+    if route != "docling" or pool is None or not DOCLING_SPLIT_MIN_PAGES or not page_ranges.available():
+        return None
+
+    try:
+        pages = len(page_routes) if page_routes else page_ranges.page_count(pdf_path)
+    except Exception:
+        return None
+    if pages < DOCLING_SPLIT_MIN_PAGES:
+        return None
+    return page_ranges.plan_ranges(["docling"] * pages, split)
+
+
+def prepare_page_ranges(pdf_path, txt_path, ranges):
+    """
+    Writes the markdown of text-layer ranges right away and one PDF per
+    Docling range. Returns (part_dir, part markdown paths in page order,
+    [(part_pdf, part_txt)] still to convert with Docling).
+    """
+    part_dir = txt_path + ".parts"
+    os.makedirs(part_dir, exist_ok=True)
+    parts, docling_jobs = [], []
+    for start, end, route in ranges:
+        part_txt = os.path.join(part_dir, f"{start:05d}-{end:05d}.md")
+        if route == "text":
+            text_layer.convert_pdf(pdf_path, part_txt, pages=list(range(start, end)))
+        else:
+            part_pdf = os.path.join(part_dir, f"{start:05d}-{end:05d}.pdf")
+            page_ranges.write_range(pdf_path, start, end, part_pdf)
+            docling_jobs.append((part_pdf, part_txt))
+        parts.append(part_txt)
+    return part_dir, parts, docling_jobs
+
+
+def stitch_page_ranges(txt_path, parts):
+    """One markdown document from the ranges, page order and tables kept."""
+    markdown_parts = []
+    for part_txt in parts:
+        with open(part_txt, "r", encoding="utf-8") as f:
+            markdown_parts.append(f.read())
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write(page_ranges.stitch_markdown(markdown_parts))
+
+
+def convert_page_ranges(converter, pdf_path, txt_path, ranges):
+    """In-process: Docling ranges one after another, then stitched."""
+    part_dir, parts, docling_jobs = prepare_page_ranges(pdf_path, txt_path, ranges)
+    try:
+        for part_pdf, part_txt in docling_jobs:
+            convert_pdf_file(converter, part_pdf, part_txt)
+        stitch_page_ranges(txt_path, parts)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+
+def submit_page_ranges(ctx, pool, pdf_path, txt_path, ranges):
+    """
+    Docling ranges go to the converter pool side by side (each taking a
+    fair-share slot). Returns a Future that resolves once the stitched
+    markdown is written to txt_path.
+    """
+    combined = Future()
+    part_dir, parts, docling_jobs = prepare_page_ranges(pdf_path, txt_path, ranges)
+    futures = []
+    lock = threading.Lock()
+
+    def part_done(_):
+        with lock:
+            if not all(f.done() for f in futures) or combined.done():
+                return
+            try:
+                for future in futures:
+                    future.result()
+                stitch_page_ranges(txt_path, parts)
+                combined.set_result({"ranges": len(ranges)})
+            except Exception as e:
+                combined.set_exception(e)
+            finally:
+                shutil.rmtree(part_dir, ignore_errors=True)
+
+    try:
+        for part_pdf, part_txt in docling_jobs:
+            futures.append(submit_to_pool(ctx, pool, part_pdf, part_txt))
+    except Exception:
+        shutil.rmtree(part_dir, ignore_errors=True)
+        raise
+
+    if not futures:
+        part_done(None)
+    for future in futures:
+        future.add_done_callback(part_done)
+    return combined
+
+
+def record_conversion(info, seconds):
+    """Conversion time metrics for a freshly converted document (info from route_pdf)."""
+    route = info.get("route", "docling")
+    metrics.CONVERT_SECONDS.observe(seconds, route=route)
+    if info.get("pages"):
+        metrics.CONVERT_PAGE_SECONDS.observe(seconds / info["pages"], route=route)
+
+
+def read_markdown_cache(pdf_path, txt_path, pdf_sha256=None):
+    """
+    Writes previously converted markdown for this exact PDF to txt_path.
+    Returns (hit, key); key is None when the cache is disabled.
+    """
+    cache = markdown_cache.get_cache()
+    if cache is None:
+        return False, None
+
+    key = markdown_cache.cache_key(pdf_path, markdown_options(), pdf_sha256)
+    markdown = cache.get(key)
+    if markdown is None:
+        return False, key
+
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write(markdown)
+    return True, key
+
+
+def write_markdown_cache(key, txt_path):
+    """Stores freshly converted markdown under its cache key."""
+    if key is None:
+        return
+    with open(txt_path, "r", encoding="utf-8") as f:
+        markdown_cache.get_cache().put(key, f.read())
+
+
+def submit_to_pool(ctx, pool, pdf_path, txt_path):
+    """
+    Hands a PDF to the shared converter pool once this task gets a fair
+    share of its workers; the slot is given back when the worker is done.
+    """
+    if ctx.convert_slots is None:
+        return pool.submit(pdf_path, txt_path)
+
+    ctx.convert_slots.acquire(ctx.task_id)
+    try:
+        future = pool.submit(pdf_path, txt_path)
+    except Exception:
+        ctx.convert_slots.release(ctx.task_id)
+        raise
+    future.add_done_callback(lambda _: ctx.convert_slots.release(ctx.task_id))
+    return future
+
+
+def convert_pdfs_to_text(ctx=None):
+    """Converts PDFs from input folder to Markdown/Text."""
+    ctx = ctx or default_context()
+    log.info("STEP 1: PDF → TEXT CONVERSION", extra={"task_id": ctx.task_id})
+
+    pool = converter_pool.get_pool()
+    converter = None
+    files_processed = 0
+
+    files = [f for f in os.listdir(ctx.input_folder) if f.lower().endswith(".pdf")]
+    
+    if not files:
+        log.warning("No PDF files found in input folder.", extra={"task_id": ctx.task_id})
+        return
+
+    # Warm worker pool: hand every PDF over at once, workers convert in parallel
+    pending = {}
+
+    for file_name in files:
+        pdf_path = os.path.join(ctx.input_folder, file_name)
+        base_name = os.path.splitext(file_name)[0]
+        txt_path = os.path.join(ctx.temp_txt_folder, base_name + ".txt")
+
+        log.info(f"Converting: {file_name}...", extra={"task_id": ctx.task_id})
+        
+        try:
+            if checkpoint_valid(ctx, file_name, "convert", txt_path):
+                log.info(f"✓ Already converted: {file_name}", extra={"task_id": ctx.task_id})
+                files_processed += 1
+                continue
+
+            hit, key = read_markdown_cache(pdf_path, txt_path, ctx.file_hashes.get(file_name))
+            if hit:
+                checkpoint(ctx, file_name, "convert", txt_path)
+                log.info(f"✓ Cached markdown for {file_name}", extra={"task_id": ctx.task_id})
+                files_processed += 1
+                continue
+
+            # Born-digital PDF: read the text layer, no layout models needed
+            started = time.perf_counter()
+            route, info, page_routes = route_pdf(pdf_path)
+            if route == "text":
+                text_layer.convert_pdf(pdf_path, txt_path)
+                record_conversion(info, time.perf_counter() - started)
+                write_markdown_cache(key, txt_path)
+                checkpoint(ctx, file_name, "convert", txt_path)
+                log.info(f"✓ Text layer used for {file_name}", extra={"task_id": ctx.task_id})
+                files_processed += 1
+                continue
+
+            # Mixed or large PDFs: page ranges converted separately, then stitched
+            ranges = plan_page_ranges(pdf_path, route, page_routes, pool)
+
+            if pool is not None:
+                if ranges:
+                    future = submit_page_ranges(ctx, pool, pdf_path, txt_path, ranges)
+                else:
+                    future = submit_to_pool(ctx, pool, pdf_path, txt_path)
+                pending[file_name] = (future, key, info, started)
+                continue
+
+            if converter is None:
+                converter = new_converter()
+            with ctx.convert_slot():
+                if ranges:
+                    convert_page_ranges(converter, pdf_path, txt_path, ranges)
+                else:
+                    convert_pdf_file(converter, pdf_path, txt_path)
+            record_conversion(info, time.perf_counter() - started)
+            write_markdown_cache(key, txt_path)
+            checkpoint(ctx, file_name, "convert", txt_path)
+            files_processed += 1
+        except Exception as e:
+            checkpoint(ctx, file_name, "convert", error=f"conversion: {e}")
+            log.error(f"✗ Error converting {file_name}: {e}", extra={"task_id": ctx.task_id})
+
+    for file_name, (future, key, info, started) in pending.items():
+        txt_path = os.path.join(ctx.temp_txt_folder, os.path.splitext(file_name)[0] + ".txt")
+        try:
+            future.result()
+            record_conversion(info, time.perf_counter() - started)
+            write_markdown_cache(key, txt_path)
+            checkpoint(ctx, file_name, "convert", txt_path)
+            files_processed += 1
+        except Exception as e:
+            checkpoint(ctx, file_name, "convert", error=f"conversion: {e}")
+            log.error(f"✗ Error converting {file_name}: {e}", extra={"task_id": ctx.task_id})
+
+    log.info(f"✓ converted {files_processed} file(s).", extra={"task_id": ctx.task_id})
+
+# ==========================================
+# 3. MODULE: TEXT TO JSON (Azure OpenAI)
+# ==========================================
+
+def create_ai_client(endpoint=None, api_key=None, api_version=None):
+    """Creates an Azure OpenAI client (default: the configured credentials)."""
+    from openai import AzureOpenAI
+
+    return AzureOpenAI(
+        azure_endpoint=endpoint or AZURE_ENDPOINT,
+        api_key=api_key or AZURE_API_KEY,
+        api_version=api_version or AZURE_API_VERSION,
+        timeout=AI_REQUEST_TIMEOUT,
+        # Retries are handled by llm_router (rate-limit aware backoff, failover)
+        max_retries=0
+    )
 
-            response = client.chat.completions.create(
-                model=AZURE_DEPLOYMENT,
+
+def default_deployment():
+    """The AZURE_* deployment; also the defaults of every AZURE_DEPLOYMENTS entry."""
+    return dict(name=AZURE_DEPLOYMENT, deployment=AZURE_DEPLOYMENT, endpoint=AZURE_ENDPOINT,
+                api_key=AZURE_API_KEY, api_version=AZURE_API_VERSION)
+
+
+_LLM_ROUTER = None
+_LLM_ROUTER_LOCK = threading.Lock()
+
+
+def get_llm_router():
+    """Process-wide router: every task shares the deployments' quotas and health."""
+    global _LLM_ROUTER
+    with _LLM_ROUTER_LOCK:
+        if _LLM_ROUTER is None:
+            _LLM_ROUTER = llm_router.LLMRouter(
+                llm_router.load_deployments(llm_router.AZURE_DEPLOYMENTS, default_deployment()),
+                client_factory=lambda d: create_ai_client(d.endpoint, d.api_key, d.api_version),
+            )
+            names = ", ".join(d.name for d in _LLM_ROUTER.deployments)
+            log.info(f"✓ LLM deployments: {names}")
+        return _LLM_ROUTER
+
+
+def extraction_prompt_hash(router=None):
+    """
+    Hash of everything besides the markdown that shapes an extraction result:
+    prompts, schema, the deployments of the router the run uses, chunking.
+    """
+    router = router or get_llm_router()
+    return extraction_cache.prompt_hash(
+        system_prompt(),
+        build_user_prompt("{markdown_content}"),
+        JSON_SCHEMA,
+        router.signature(),
+        AI_TEMPERATURE,
+        {"threshold_tokens": AI_CHUNK_THRESHOLD_TOKENS, "max_tokens": AI_CHUNK_MAX_TOKENS},
+    )
+
+
+def parse_ai_response(result_content):
+    """Parses the model's JSON answer into the ordered output structure."""
+    result_content = result_content.strip()
+    
+    # Clean markdown code blocks
+    if result_content.startswith("```json"): result_content = result_content[7:]
+    if result_content.startswith("```"): result_content = result_content[3:]
+    if result_content.endswith("```"): result_content = result_content[:-3]
+    result_content = result_content.strip()
+
+    output_data = json.loads(result_content)
+
+    # Reorder and validate structure
+    ordered_data = {}
+    ordered_data[""] = output_data.get("", "")
+    ordered_data["Company Code"] = output_data.get("Company Code", "")
+    ordered_data["Legal Entity Name"] = output_data.get("Legal Entity Name", "")
+    ordered_data["Vendor No"] = output_data.get("Vendor No", "")
+    ordered_data["Vendor Name"] = output_data.get("Vendor Name", "")
+    ordered_data[" "] = output_data.get(" ", "")
+    ordered_data["Subject"] = output_data.get("Subject", "")
+    ordered_data["  "] = output_data.get("  ", "")
+
+    # Handle Table Data and enforce Total Row logic
+    table_data = output_data.get("   ", [])
+    for invoice in table_data:
+        if invoice.get("Invoice No", "").lower() == "total" or invoice.get("Invoice Date", "").lower() == "total":
+            invoice["Purchase order No. if available"] = "Total"
+            invoice["Invoice Date"] = ""
+            invoice["Invoice No"] = ""
+    
+    ordered_data["   "] = table_data
+    return ordered_data
+
+
+def request_extraction(router, markdown_content, ai_slot=nullcontext):
+    """One extraction request for markdown_content; returns (ordered_data, usage)."""
+    prompt = build_user_prompt(markdown_content)
+    prompt_tokens = llm_client.count_tokens(system_prompt()) + llm_client.count_tokens(prompt)
+    estimated_tokens = prompt_tokens + llm_client.AI_COMPLETION_TOKENS_ESTIMATE
+
+    with ai_slot():
+        response, attempts, deployment = router.create_chat_completion(
+            dict(
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": system_prompt()},
                     {"role": "user", "content": prompt}
                 ],
-                temperature=0,
+                temperature=AI_TEMPERATURE,
                 response_format={"type": "json_object"}
-            )
-
-            result_content = response.choices[0].message.content.strip()
-            
-            # Clean markdown code blocks
-            if result_content.startswith("```json"): result_content = result_content[7:]
-            if result_content.startswith("```"): result_content = result_content[3:]
-            if result_content.endswith("```"): result_content = result_content[:-3]
-            result_content = result_content.strip()
-
-            output_data = json.loads(result_content)
-
-            # Reorder and validate structure
-            ordered_data = {}
-            ordered_data[""] = output_data.get("", "")
-            ordered_data["Company Code"] = output_data.get("Company Code", "")
-            ordered_data["Legal Entity Name"] = output_data.get("Legal Entity Name", "")
-            ordered_data["Vendor No"] = output_data.get("Vendor No", "")
-            ordered_data["Vendor Name"] = output_data.get("Vendor Name", "")
-            ordered_data[" "] = output_data.get(" ", "")
-            ordered_data["Subject"] = output_data.get("Subject", "")
-            ordered_data["  "] = output_data.get("  ", "")
-
-            # Handle Table Data and enforce Total Row logic
-            table_data = output_data.get("   ", [])
-            for invoice in table_data:
-                if invoice.get("Invoice No", "").lower() == "total" or invoice.get("Invoice Date", "").lower() == "total":
-                    invoice["Purchase order No. if available"] = "Total"
-                    invoice["Invoice Date"] = ""
-                    invoice["Invoice No"] = ""
-            
-            ordered_data["   "] = table_data
-
+            ),
+            estimated_tokens,
+            prompt_tokens,
+        )
+
+    ordered_data = parse_ai_response(response.choices[0].message.content)
+
+    response_usage = getattr(response, "usage", None)
+    usage = {
+        "prompt_tokens": getattr(response_usage, "prompt_tokens", None),
+        "completion_tokens": getattr(response_usage, "completion_tokens", None),
+        "attempts": attempts,
+        "deployment": deployment,
+    }
+    return ordered_data, usage
+
+
+def is_total_invoice(invoice):
+    """parse_ai_response() marks the Total row in the PO column."""
+    return str(invoice.get("Purchase order No. if available", "")).strip().lower() == "total"
+
+
+def merge_chunk_results(results):
+    """
+    Chunk results (in document order) → one document: top-level fields from
+    the first chunk that has them, invoice rows concatenated in order, and
+    the Total row from the last chunk that reports one (normally the final
+    chunk, where the statement's total is printed).
+    """
+    merged = {}
+    for key in ["", "Company Code", "Legal Entity Name", "Vendor No", "Vendor Name", " ", "Subject", "  "]:
+        merged[key] = next((r[key] for r in results if r.get(key)), "")
+
+    rows, total = [], None
+    for result in results:
+        for invoice in result.get("   ", []):
+            if is_total_invoice(invoice):
+                total = invoice
+            else:
+                rows.append(invoice)
+    if total is not None:
+        rows.append(total)
+
+    merged["   "] = rows
+    return merged
+
+
+def extract_chunked(router, markdown_content, ai_slot=nullcontext):
+    """
+    Long statements: header section + each chunk of the invoice tables are
+    extracted in parallel, then merged. Latency follows the chunk size
+    rather than the document length.
+    """
+    header, chunks = markdown_chunker.chunk_markdown(
+        markdown_content, AI_CHUNK_MAX_TOKENS, llm_client.count_tokens
+    )
+    log.info(f"Long statement: extracting {len(chunks)} chunk(s) in parallel")
+
+    contents = []
+    for index, chunk in enumerate(chunks, 1):
+        note = (f"<!-- Part {index} of {len(chunks)} of a longer statement. Extract only the invoice rows "
+                f"in this part; include a Total row only if the statement total is printed in this part. -->")
+        contents.append("\n\n".join(part for part in (note, header, chunk) if part))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(AI_CHUNK_CONCURRENCY, len(contents)))) as executor:
+        outcomes = list(executor.map(lambda content: request_extraction(router, content, ai_slot), contents))
+
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "attempts": 0, "chunks": len(chunks)}
+    for _, chunk_usage in outcomes:
+        for field in ("prompt_tokens", "completion_tokens", "attempts"):
+            usage[field] += chunk_usage.get(field) or 0
+    usage["deployment"] = ",".join(sorted({chunk_usage["deployment"] for _, chunk_usage in outcomes}))
+    return merge_chunk_results([result for result, _ in outcomes]), usage
+
+
+def extract_file_with_ai(router, txt_path, json_path, ai_slot=nullcontext):
+    """
+    Extracts structured JSON from a single text file and writes it to json_path.
+    ai_slot() is held around the API call (fair share of requests in flight).
+    Returns token usage for the file.
+    """
+    with open(txt_path, "r", encoding="utf-8") as f:
+        markdown_content = f.read()
+
+    # Drop page boilerplate and padding; both counts are reported per file
+    raw_tokens = llm_client.count_tokens(markdown_content)
+    if MARKDOWN_PREPROCESS:
+        markdown_content = markdown_cleaner.clean_markdown(markdown_content)
+    tokens = llm_client.count_tokens(markdown_content)
+    input_tokens = {"markdown_tokens_raw": raw_tokens, "markdown_tokens": tokens}
+    log.info(f"{os.path.basename(txt_path)}: markdown {raw_tokens} → {tokens} tokens "
+             f"({100 * (raw_tokens - tokens) // max(raw_tokens, 1)}% less), {AI_PROMPT_VARIANT} prompt",
+             extra={"markdown_tokens_raw": raw_tokens, "markdown_tokens": tokens})
+
+    # Byte-identical markdown under the same prompts/deployment: reuse the result
+    cache = extraction_cache.get_cache()
+    if cache is not None:
+        current_prompt_hash = extraction_prompt_hash(router)
+        key = extraction_cache.cache_key(markdown_content, current_prompt_hash)
+        ordered_data = cache.get(key)
+        if ordered_data is not None:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(ordered_data, f, indent=2, ensure_ascii=False)
+            metrics.EXTRACTIONS.inc(source="cache")
+            return {"prompt_tokens": 0, "completion_tokens": 0, "attempts": 0, "llm_cache": "hit", **input_tokens}
+
+    # Known vendor layout: a verified template replaces the LLM when it is confident
+    templates = vendor_templates.get_index()
+    template_info = {}
+    if templates is not None:
+        ordered_data, template_info = templates.match(markdown_content)
+        if ordered_data is not None:
             with open(json_path, "w", encoding="utf-8") as f:
                 json.dump(ordered_data, f, indent=2, ensure_ascii=False)
+            metrics.EXTRACTIONS.inc(source="template")
+            return {"prompt_tokens": 0, "completion_tokens": 0, "attempts": 0,
+                    "extraction": "template", **template_info, **input_tokens}
 
-            processed_count += 1
-            print(f"✓ Extracted JSON for {file_name}")
+    if AI_CHUNK_THRESHOLD_TOKENS and tokens > AI_CHUNK_THRESHOLD_TOKENS:
+        ordered_data, usage = extract_chunked(router, markdown_content, ai_slot)
+    else:
+        ordered_data, usage = request_extraction(router, markdown_content, ai_slot)
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(ordered_data, f, indent=2, ensure_ascii=False)
 
+    metrics.EXTRACTIONS.inc(source="llm")
+    metrics.PROMPT_TOKENS.observe(usage.get("prompt_tokens"))
+    metrics.COMPLETION_TOKENS.observe(usage.get("completion_tokens"))
+
+    if cache is not None:
+        cache.put(key, current_prompt_hash, usage["deployment"], ordered_data, usage)
+        usage["llm_cache"] = "miss"
+    if templates is not None:
+        # Every LLM result verifies (or teaches) the template of its layout
+        try:
+            templates.learn(markdown_content, ordered_data)
         except Exception as e:
-            print(f"✗ Error processing {file_name}: {e}")
-            error_count += 1
+            log.warning(f"Template learning skipped for {os.path.basename(txt_path)}: {e}")
+    return {**usage, "extraction": "llm", **template_info, **input_tokens}
+
+
+def extract_data_with_ai(ctx=None):
+    """Extracts structured JSON from text files using Azure OpenAI."""
+    ctx = ctx or default_context()
+    log.info("STEP 2: AI DATA EXTRACTION", extra={"task_id": ctx.task_id})
+
+    files = [f for f in os.listdir(ctx.temp_txt_folder) if f.lower().endswith(".txt")]
+    pdfs = pdf_names(ctx)
+    processed_count = 0
+    error_count = 0
+
+    # Keep ctx.ai_concurrency requests in flight; the shared limiter enforces RPM/TPM
+    with ThreadPoolExecutor(max_workers=ctx.ai_concurrency) as executor:
+        futures = {}
+        for file_name in files:
+            txt_path = os.path.join(ctx.temp_txt_folder, file_name)
+            base_name = os.path.splitext(file_name)[0]
+            json_path = os.path.join(ctx.output_json_folder, base_name + ".json")
+            pdf_name = pdfs.get(base_name, base_name + ".pdf")
+
+            if checkpoint_valid(ctx, pdf_name, "extract", json_path):
+                log.info(f"✓ Already extracted: {file_name}", extra={"task_id": ctx.task_id})
+                processed_count += 1
+                continue
+
+            log.info(f"Processing: {file_name}", extra={"task_id": ctx.task_id})
+            future = executor.submit(extract_file_with_ai, ctx.router, txt_path, json_path, ctx.ai_slot)
+            futures[future] = (file_name, pdf_name, json_path)
+
+        for future in as_completed(futures):
+            file_name, pdf_name, json_path = futures[future]
+            try:
+                future.result()
+                checkpoint(ctx, pdf_name, "extract", json_path)
+                index_invoices(ctx, pdf_name, json_path)
+                processed_count += 1
+                log.info(f"✓ Extracted JSON for {file_name}", extra={"task_id": ctx.task_id})
+
+            except Exception as e:
+                checkpoint(ctx, pdf_name, "extract", error=f"extraction: {e}")
+                log.error(f"✗ Error processing {file_name}: {e}", extra={"task_id": ctx.task_id})
+                error_count += 1
     
-    print(f"\nAI Extraction Complete: {processed_count} success, {error_count} errors.")
+    log.info(f"AI Extraction Complete: {processed_count} success, {error_count} errors.", extra={"task_id": ctx.task_id})
 
 # ==========================================
-# 4. MODULE: JSON TO EXCEL (Pandas/OpenPyXL)
+# 4. MODULE: JSON TO EXCEL (OpenPyXL, utils/excel_writer.py)
 # ==========================================
 
-def convert_json_to_excel():
+def convert_json_file_to_excel(json_path, excel_path):
+    """Converts a single JSON file to a formatted Excel report."""
+    with metrics.EXCEL_SECONDS.time():
+        excel_writer.write_report(json_path, excel_path)
+
+
+def convert_json_to_excel(ctx=None):
     """Convert generated JSON files to formatted Excel."""
-    print(f"\n{'='*60}")
-    print("STEP 3: EXCEL REPORT GENERATION")
-    print(f"{'='*60}")
+    ctx = ctx or default_context()
+    log.info("STEP 3: EXCEL REPORT GENERATION", extra={"task_id": ctx.task_id})
 
-    json_files = [f for f in os.listdir(OUTPUT_JSON_FOLDER) if f.lower().endswith('.json')]
+    json_files = [f for f in os.listdir(ctx.output_json_folder) if f.lower().endswith('.json')]
     
     if not json_files:
-        print("No JSON files found to convert.")
+        log.warning("No JSON files found to convert.", extra={"task_id": ctx.task_id})
         return
 
     success_count = 0
-    
-    # Border style
-    thin_border = Border(
-        left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin')
-    )
+    jobs = []
+    pdfs = pdf_names(ctx)
+    pdf_of = {}
 
     for json_file in json_files:
-        json_path = os.path.join(OUTPUT_JSON_FOLDER, json_file)
-        excel_file = os.path.splitext(json_file)[0] + ".xlsx"
-        excel_path = os.path.join(OUTPUT_EXCEL_FOLDER, excel_file)
-        
-        print(f"Generating Report: {excel_file}")
+        json_path = os.path.join(ctx.output_json_folder, json_file)
+        base_name = os.path.splitext(json_file)[0]
+        excel_file = base_name + ".xlsx"
+        excel_path = os.path.join(ctx.output_excel_folder, excel_file)
+        pdf_of[json_path] = pdfs.get(base_name, base_name + ".pdf")
+
+        if checkpoint_valid(ctx, pdf_of[json_path], "excel", excel_path):
+            log.info(f"✓ Already written: {excel_file}", extra={"task_id": ctx.task_id})
+            success_count += 1
+            continue
 
-        try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Data"
-            current_row = 1
-
-            # Recursive function to write data
-            def write_recursive(obj, indent=0):
-                nonlocal current_row
-                
-                if isinstance(obj, dict):
-                    for key, value in obj.items():
-                        if key in ["$schema", "title", "type"]: continue
-
-                        # TABLE LOGIC
-                        if isinstance(value, list) and len(value) > 0 and isinstance(value[0], dict):
-                            df = pd.DataFrame(value)
-                            
-                            for r_idx, row_data in enumerate(dataframe_to_rows(df, index=False, header=True)):
-                                # Detect Total Row
-                                is_total_row = False
-                                if r_idx > 0:
-                                    for val in row_data:
-                                        if str(val).strip().lower() == "total":
-                                            is_total_row = True
-                                            break
-                                
-                                # Insert 4 blank rows before Total
-                                if is_total_row:
-                                    num_columns = len(row_data)
-                                    for _ in range(4):
-                                        for c_idx in range(1, num_columns + 1):
-                                            blank_cell = ws.cell(row=current_row, column=c_idx + 1, value="")
-                                            blank_cell.border = thin_border
-                                        current_row += 1
-                                
-                                # Write Row
-                                for c_idx, cell_value in enumerate(row_data, 1):
-                                    cell = ws.cell(row=current_row, column=c_idx + 1, value=cell_value)
-                                    if r_idx == 0: cell.font = Font(bold=True)
-                                    cell.border = thin_border
-                                current_row += 1
-                            current_row += 1
-
-                        # DICT LOGIC
-                        elif isinstance(value, dict):
-                            title = ws.cell(row=current_row, column=2, value=key.upper())
-                            title.font = Font(bold=True)
-                            current_row += 1
-                            write_recursive(value, indent + 1)
-
-                        # LIST LOGIC
-                        elif isinstance(value, list):
-                            ws.cell(row=current_row, column=2, value=key)
-                            ws.cell(row=current_row, column=3, value=str(value))
-                            current_row += 1
-
-                        # KEY-VALUE LOGIC
-                        else:
-                            ws.cell(row=current_row, column=2, value=key)
-                            ws.cell(row=current_row, column=3, value=value)
-                            current_row += 1
-
-            write_recursive(data)
-
-            # Column Auto-width
-            for column in ws.columns:
-                max_length = 0
-                column_list = list(column)
-                for cell in column_list:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                ws.column_dimensions[column_list[0].column_letter].width = min(max_length + 2, 50)
-
-            wb.save(excel_path)
+        log.info(f"Generating Report: {excel_file}", extra={"task_id": ctx.task_id})
+        jobs.append((json_path, excel_path))
+
+    # Reports are independent: written in parallel worker processes
+    for json_path, excel_path, error in excel_writer.write_reports(jobs):
+        if error is None:
+            checkpoint(ctx, pdf_of[json_path], "excel", excel_path)
             success_count += 1
-            
-        except Exception as e:
-            print(f"✗ Error converting {json_file}: {e}")
+        else:
+            checkpoint(ctx, pdf_of[json_path], "excel", error=f"excel: {error}")
+            log.error(f"✗ Error converting {os.path.basename(json_path)}: {error}", extra={"task_id": ctx.task_id})
+
+    log.info(f"✓ Excel Generation Complete: {success_count} files created.", extra={"task_id": ctx.task_id})
+
+
+def export_consolidated(ctx=None):
+    """
+    One row per invoice across all JSON outputs, with source file and
+    vendor columns, in each of ctx.exports (single sheet / CSV / Parquet).
+    Written under output_excel/consolidated/, so it is part of the ZIP.
+    """
+    ctx = ctx or default_context()
+    if not ctx.exports:
+        return None
+
+    table_key = "   "
+    result = consolidated_export.export_consolidated(
+        ctx.output_json_folder,
+        ctx.output_excel_folder,
+        ctx.exports,
+        invoice_columns=list(JSON_SCHEMA[table_key][0].keys()),
+        table_key=table_key,
+    )
+    log.info(f"✓ Consolidated export: {result['rows']} invoices → {', '.join(ctx.exports)}", extra={"task_id": ctx.task_id})
+    return result
+
+
+def index_invoices(ctx, file_name, json_path):
+    """
+    Add the document's invoices to the cross-task invoice store; returns how
+    many duplicate flags they got (None when the store is off or failed).
+    """
+    store = invoice_store.get_store()
+    if store is None:
+        return None
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        duplicates = store.index(ctx.task_id, file_name, data, table_key="   ")
+    except Exception as e:
+        # The outputs are fine without it; lookups just miss this document
+        log.warning(f"✗ Could not index invoices of {file_name}: {e}", extra={"task_id": ctx.task_id})
+        return None
+    if duplicates:
+        log.warning(f"Duplicate invoices in {file_name}: {len(duplicates)}", extra={"task_id": ctx.task_id})
+    return len(duplicates)
+
+
+def report_duplicates(ctx):
+    """
+    Write output_excel/duplicates.csv listing the task's invoices already
+    seen in another document (this task or an earlier one); returns the
+    number of rows, or None when the invoice store is off.
+    """
+    store = invoice_store.get_store()
+    if store is None:
+        return None
+    duplicates = store.duplicates(ctx.task_id)
+    path = os.path.join(ctx.output_excel_folder, DUPLICATES_FILE_NAME)
+    if not duplicates:
+        if os.path.exists(path):
+            os.remove(path)
+        return 0
+
+    os.makedirs(ctx.output_excel_folder, exist_ok=True)
+    partial = path + zipper.PARTIAL_SUFFIX
+    with open(partial, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Kind", "Source File", "Invoice No", "Vendor Name", "Invoice Date", "Invoice Amount",
+                         "Invoice Currency", "Seen In Task", "Seen In File", "Seen Invoice No"])
+        for d in duplicates:
+            seen = d["seen_in"]
+            writer.writerow([d["kind"], d["source_file"], d["invoice_no"], d["vendor_name"], d["invoice_date"],
+                             d["amount"], d["currency"], seen["task_id"], seen["source_file"], seen["invoice_no"]])
+    os.replace(partial, path)
+    log.info(f"✓ Duplicate invoices: {len(duplicates)} → {DUPLICATES_FILE_NAME}", extra={"task_id": ctx.task_id})
+    return len(duplicates)
 
-    print(f"✓ Excel Generation Complete: {success_count} files created.")
+# ==========================================
+# 5. MODULE: STREAMING PIPELINE
+# ==========================================
+# Each PDF moves PDF → TXT → JSON → XLSX on its own. The three stages run
+# in their own threads and are connected by bounded queues, so conversion,
+# AI extraction and report writing overlap instead of waiting on each other.
+
+_STAGE_DONE = object()
+
+
+def run_streaming_pipeline(ctx=None, on_event=None):
+    """
+    Runs all three steps per document with bounded queues between stages,
+    using the folders, LLM router and shared worker slots of ctx.
+
+    on_event(file_name, state, error=None, **info) is called on every stage
+    transition. state is one of: converting, converted, extracting,
+    extracted, writing, done, failed. info carries per-stage details
+    (markdown cache hit/miss, token usage, duplicate invoices) and, when a
+    stage ends, the seconds it took.
+
+    Returns {"done": [...], "failed": {file_name: error}}.
+    """
+    ctx = ctx or default_context()
+    log.info("STREAMING PIPELINE: PDF → TEXT → JSON → EXCEL", extra={"task_id": ctx.task_id})
+    text_queue = queue.Queue(maxsize=ctx.queue_size)
+    json_queue = queue.Queue(maxsize=ctx.queue_size)
+    summary = {"done": [], "failed": {}}
+    summary_lock = threading.Lock()
+    stage_started = {}
+    current_stage = {}
+    stage_of_state = {"converting": "convert", "extracting": "extract", "writing": "excel"}
+
+    def emit(file_name, state, error=None, **info):
+        with summary_lock:
+            if state in stage_of_state:
+                stage_started[file_name] = time.perf_counter()
+                current_stage[file_name] = stage_of_state[state]
+            elif file_name in stage_started:
+                info["seconds"] = round(time.perf_counter() - stage_started.pop(file_name), 3)
+
+        if state == "converted" and info.get("markdown_cache") != "hit" and not info.get("checkpoint") \
+                and "seconds" in info:
+            record_conversion(info, info["seconds"])
+        elif state == "done":
+            metrics.FILES.inc(state="done")
+            with summary_lock:
+                summary["done"].append(file_name)
+        elif state == "failed":
+            metrics.FILES.inc(state="failed")
+            try:
+                checkpoint(ctx, file_name, current_stage.get(file_name, "convert"), error=error)
+            except Exception as e:
+                log.warning(f"Could not record failure of {file_name}: {e}", extra={"task_id": ctx.task_id})
+            with summary_lock:
+                summary["failed"][file_name] = error
+            log.error(f"✗ {file_name}: {error}", extra={"task_id": ctx.task_id, "file": file_name})
+        if on_event:
+            on_event(file_name, state, error=error, **info)
+
+    files = [f for f in os.listdir(ctx.input_folder) if f.lower().endswith(".pdf")]
+    converted = set()
+
+    def convert_stage():
+        try:
+            pool = converter_pool.get_pool()
+            converter = None
+            in_flight = {}
+
+            def finish(file_name, txt_path, hit, key, **info):
+                if not hit:
+                    write_markdown_cache(key, txt_path)
+                if not info.get("checkpoint"):
+                    checkpoint(ctx, file_name, "convert", txt_path)
+                converted.add(file_name)
+                cache_state = ("hit" if hit else "miss") if key else None
+                emit(file_name, "converted", markdown_cache=cache_state, **info)
+                text_queue.put((file_name, txt_path))
+
+            # Warm worker pool: keep every worker busy, pass results on as they finish
+            def collect(return_when):
+                done, _ = wait(in_flight, return_when=return_when)
+                for future in done:
+                    file_name, txt_path, key, info = in_flight.pop(future)
+                    try:
+                        future.result()
+                        finish(file_name, txt_path, False, key, **info)
+                    except Exception as e:
+                        emit(file_name, "failed", f"conversion: {e}")
+
+            for file_name in files:
+                pdf_path = os.path.join(ctx.input_folder, file_name)
+                base_name = os.path.splitext(file_name)[0]
+                txt_path = os.path.join(ctx.temp_txt_folder, base_name + ".txt")
+                emit(file_name, "converting")
+
+                try:
+                    if checkpoint_valid(ctx, file_name, "convert", txt_path):
+                        finish(file_name, txt_path, True, None, checkpoint="hit")
+                        continue
+
+                    hit, key = read_markdown_cache(pdf_path, txt_path, ctx.file_hashes.get(file_name))
+                    if hit:
+                        finish(file_name, txt_path, True, key)
+                        continue
+
+                    route, info, page_routes = route_pdf(pdf_path)
+                    if route == "text":
+                        text_layer.convert_pdf(pdf_path, txt_path)
+                        finish(file_name, txt_path, False, key, **info)
+                        continue
+
+                    ranges = plan_page_ranges(pdf_path, route, page_routes, pool)
+                    if ranges:
+                        info["ranges"] = len(ranges)
+
+                    if pool is None:
+                        if converter is None:
+                            converter = new_converter()
+                        with ctx.convert_slot():
+                            if ranges:
+                                convert_page_ranges(converter, pdf_path, txt_path, ranges)
+                            else:
+                                convert_pdf_file(converter, pdf_path, txt_path)
+                        finish(file_name, txt_path, False, key, **info)
+                        continue
+                except Exception as e:
+                    emit(file_name, "failed", f"conversion: {e}")
+                    continue
+
+                if len(in_flight) >= pool.size:
+                    collect(FIRST_COMPLETED)
+                try:
+                    if ranges:
+                        future = submit_page_ranges(ctx, pool, pdf_path, txt_path, ranges)
+                    else:
+                        future = submit_to_pool(ctx, pool, pdf_path, txt_path)
+                except Exception as e:
+                    emit(file_name, "failed", f"conversion: {e}")
+                    continue
+                in_flight[future] = (file_name, txt_path, key, info)
+
+            if in_flight:
+                collect(ALL_COMPLETED)
+        except Exception as e:
+            for file_name in files:
+                if file_name not in converted and file_name not in summary["failed"]:
+                    emit(file_name, "failed", f"conversion: {e}")
+        finally:
+            text_queue.put(_STAGE_DONE)
+
+    def extract_stage():
+        item = None
+        in_flight = {}
+        try:
+            router = ctx.router
+
+            def collect(return_when):
+                done, _ = wait(in_flight, return_when=return_when)
+                for future in done:
+                    file_name, json_path = in_flight.pop(future)
+                    try:
+                        usage = future.result()
+                        checkpoint(ctx, file_name, "extract", json_path)
+                    except Exception as e:
+                        emit(file_name, "failed", f"extraction: {e}")
+                        continue
+                    emit(file_name, "extracted", duplicates=index_invoices(ctx, file_name, json_path), **usage)
+                    json_queue.put((file_name, json_path))
+
+            # Keep ctx.ai_concurrency requests in flight; the shared limiter enforces RPM/TPM
+            with ThreadPoolExecutor(max_workers=ctx.ai_concurrency, thread_name_prefix="pipeline-ai") as executor:
+                while True:
+                    item = text_queue.get()
+                    if item is _STAGE_DONE:
+                        break
+                    if len(in_flight) >= ctx.ai_concurrency:
+                        collect(FIRST_COMPLETED)
+                    file_name, txt_path = item
+                    base_name = os.path.splitext(file_name)[0]
+                    json_path = os.path.join(ctx.output_json_folder, base_name + ".json")
+                    emit(file_name, "extracting")
+                    if checkpoint_valid(ctx, file_name, "extract", json_path):
+                        emit(file_name, "extracted", checkpoint="hit")
+                        json_queue.put((file_name, json_path))
+                        continue
+                    future = executor.submit(extract_file_with_ai, router, txt_path, json_path, ctx.ai_slot)
+                    in_flight[future] = (file_name, json_path)
+                if in_flight:
+                    collect(ALL_COMPLETED)
+        except Exception as e:
+            # Drain the queue so the conversion stage never blocks on a dead consumer
+            while item is not _STAGE_DONE:
+                item = text_queue.get()
+                if item is not _STAGE_DONE:
+                    emit(item[0], "failed", f"extraction: {e}")
+            for file_name, _ in in_flight.values():
+                emit(file_name, "failed", f"extraction: {e}")
+        finally:
+            json_queue.put(_STAGE_DONE)
+
+    def excel_stage():
+        while True:
+            item = json_queue.get()
+            if item is _STAGE_DONE:
+                break
+            file_name, json_path = item
+            base_name = os.path.splitext(file_name)[0]
+            excel_path = os.path.join(ctx.output_excel_folder, base_name + ".xlsx")
+            emit(file_name, "writing")
+            if checkpoint_valid(ctx, file_name, "excel", excel_path):
+                emit(file_name, "done", checkpoint="hit")
+                continue
+            try:
+                convert_json_file_to_excel(json_path, excel_path)
+                checkpoint(ctx, file_name, "excel", excel_path)
+            except Exception as e:
+                emit(file_name, "failed", f"excel: {e}")
+                continue
+            emit(file_name, "done")
+
+    stages = [
+        threading.Thread(target=convert_stage, name="pipeline-convert", daemon=True),
+        threading.Thread(target=extract_stage, name="pipeline-extract", daemon=True),
+        threading.Thread(target=excel_stage, name="pipeline-excel", daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+
+    log.info(f"✓ Streaming pipeline complete: {len(summary['done'])} done, {len(summary['failed'])} failed.",
+             extra={"task_id": ctx.task_id})
+    return summary
 
 # ==========================================
-# 5. MAIN EXECUTION
+# 6. MAIN EXECUTION
 # ==========================================
 
 if __name__ == "__main__":
-    print("STARTING INVOICE PROCESSING PIPELINE...")
+    setup_logging()
+    log.info("STARTING INVOICE PROCESSING PIPELINE...")
     
     # 1. Setup
     setup_folders()
     
     # 2. Check for Inputs
     if not os.path.exists(INPUT_FOLDER) or not os.listdir(INPUT_FOLDER):
-        print(f"Please put your PDF files inside the '{INPUT_FOLDER}' directory and run this script again.")
+        log.warning(f"Please put your PDF files inside the '{INPUT_FOLDER}' directory and run this script again.")
     else:
         # 3. Execution Chain
         convert_pdfs_to_text()
         extract_data_with_ai()
         convert_json_to_excel()
+        export_consolidated()
+        report_duplicates(default_context())
         
-        print(f"\n{'='*60}")
-        print("PIPELINE FINISHED SUCCESSFULLY")
-        print(f"Check the '{OUTPUT_EXCEL_FOLDER}' folder for your reports.")
-        print(f"{'='*60}")
-
+        log.info("PIPELINE FINISHED SUCCESSFULLY")
+        log.info(f"Check the '{OUTPUT_EXCEL_FOLDER}' folder for your reports.")
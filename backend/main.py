@@ -5,24 +5,32 @@ Fully patched version – stable absolute paths & correct pipeline integration
 
 
 import os
+import json
 import uuid
+import time
 import shutil
+import asyncio
 from pathlib import Path
-from typing import Dict
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-# Import user’s full pipeline script
+# Import user’s full pipeline script and its worker
 import full_pipeline
+import worker
 
 # Import utilities
-from utils.file_manager import create_task_directories, save_uploaded_files
-from utils.zipper import zip_output_folder
+from utils.file_manager import create_task_directories, stream_uploaded_files, MAX_UPLOAD_REQUEST_BYTES
+from utils import converter_pool, markdown_cache, extraction_cache, consolidated_export, vendor_templates, metrics
+from utils import admission, zipper, invoice_store
+from utils.log import setup_logging
+from utils.task_store import get_store
 
 # Load environment variables
 load_dotenv()
+setup_logging()
 
 # ---------------------------------------------
 # ABSOLUTE BASE DIRECTORY FIX (VERY IMPORTANT)
@@ -47,154 +55,470 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory task tracking
-TASKS: Dict[str, dict] = {}
+# Task state and job queue (SQLite by default, shared with worker processes)
+STORE = get_store()
 
+STARTED_AT = time.time()
 
-def run_pipeline(task_id: str):
-    """
-    Background process:
-    - Updates full_pipeline paths
-    - Runs three steps
-    - Zips Excel output
-    """
-    try:
-        task_dir = BASE_UPLOAD_DIR / task_id
-
-        # Update task status
-        TASKS[task_id]["status"] = "running"
-        TASKS[task_id]["progress"] = 10
-
-        # ---------------------------------------------------
-        # CRITICAL: OVERRIDE user's script directory paths
-        # ---------------------------------------------------
-        full_pipeline.INPUT_FOLDER = str(task_dir / "input_pdf")
-        full_pipeline.TEMP_TXT_FOLDER = str(task_dir / "temp_txt")
-        full_pipeline.OUTPUT_JSON_FOLDER = str(task_dir / "output_json")
-        full_pipeline.OUTPUT_EXCEL_FOLDER = str(task_dir / "output_excel")
-
-        # DEBUG PRINTS – verify correct paths
-        print("\n================ PIPELINE PATHS ================")
-        print("INPUT_FOLDER :", full_pipeline.INPUT_FOLDER)
-        print("TEMP_TXT_FOLDER :", full_pipeline.TEMP_TXT_FOLDER)
-        print("OUTPUT_JSON_FOLDER :", full_pipeline.OUTPUT_JSON_FOLDER)
-        print("OUTPUT_EXCEL_FOLDER :", full_pipeline.OUTPUT_EXCEL_FOLDER)
-        print("FILES IN INPUT:", os.listdir(full_pipeline.INPUT_FOLDER))
-        print("================================================\n")
-
-        # Step 1: PDF → TXT
-        TASKS[task_id]["progress"] = 30
-        full_pipeline.convert_pdfs_to_text()
-
-        # Step 2: TXT → JSON (Azure AI)
-        TASKS[task_id]["progress"] = 60
-        full_pipeline.extract_data_with_ai()
-
-        # Step 3: JSON → EXCEL
-        TASKS[task_id]["progress"] = 85
-        full_pipeline.convert_json_to_excel()
-
-        # Step 4: ZIP EXCEL OUTPUT
-        excel_dir = task_dir / "output_excel"
-        zip_path = task_dir / "outputs.zip"
-
-        TASKS[task_id]["progress"] = 95
-        zip_output_folder(excel_dir, zip_path)
-
-        # Finished
-        TASKS[task_id]["status"] = "finished"
-        TASKS[task_id]["progress"] = 100
-        TASKS[task_id]["zip"] = str(zip_path)
+# Run pipeline workers inside the API process (set 0 when running worker.py separately)
+EMBEDDED_WORKERS = os.getenv("EMBEDDED_WORKERS", "1") == "1"
+
+# How often /events checks the store for new events, and sends a keep-alive
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "0.5"))
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# How often a download of a running task checks for newly written reports
+DOWNLOAD_POLL_INTERVAL = float(os.getenv("DOWNLOAD_POLL_INTERVAL", "1.0"))
+
+
+@app.on_event("startup")
+def start_embedded_workers():
+    """Load Docling models and start claiming jobs in the background; /readyz tells when done"""
+    if EMBEDDED_WORKERS:
+        worker.start_workers_in_background()
+
+
+@app.on_event("shutdown")
+def stop_embedded_workers():
+    if EMBEDDED_WORKERS:
+        worker.stop_workers()
 
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Refuse oversized uploads from Content-Length, before the body is read (chunked ones are cut off while streamed)"""
+    if request.url.path == "/upload":
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_REQUEST_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Upload exceeds {MAX_UPLOAD_REQUEST_BYTES} bytes"},
+            )
+    return await call_next(request)
+
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the API process answers (models may still be loading)"""
+    return {"status": "ok", "uptime_seconds": round(time.time() - STARTED_AT, 1)}
+
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: task store reachable and, with embedded workers, their models loaded (503 until then)"""
+    checks = {}
+    try:
+        STORE.queue_stats()
+        checks["task_store"] = {"status": "ok"}
     except Exception as e:
-        TASKS[task_id]["status"] = "failed"
-        TASKS[task_id]["error"] = str(e)
-        print("\n❌ PIPELINE ERROR:", e, "\n")
+        checks["task_store"] = {"status": "failed", "error": str(e)}
+    if EMBEDDED_WORKERS:
+        checks["workers"] = worker.readiness()
+
+    ready = all(check["status"] == "ok" for check in checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "checks": checks})
+
 
+# The body is parsed by hand (streamed to disk), so the form is declared for the docs only
+UPLOAD_FORM = {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["files"],
+        "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+    }}},
+}
 
-@app.post("/upload")
-async def upload_files(files: list[UploadFile] = File(...)):
+
+@app.post("/upload", openapi_extra={"requestBody": UPLOAD_FORM})
+async def upload_files(request: Request):
     """
-    Upload PDFs → create task directory → save PDFs
+    Upload PDFs ("files" form field) → create task directory → stream PDFs to disk
+
+    Refused with 429 (client quota) or 503 (server busy) and Retry-After
+    while the queue or this client has too much work in progress.
     """
+    client = admission.client_id(request)
+    admission.check(STORE, client)
+
     task_id = str(uuid.uuid4())
     task_dir = create_task_directories(BASE_UPLOAD_DIR, task_id)
     input_pdf_dir = task_dir / "input_pdf"
 
-   #Bug
-   #  save_uploaded_files(files, input_pdf_dir)
-    await save_uploaded_files(files, input_pdf_dir)
-
+    try:
+        with admission.upload_slot():
+            saved = await stream_uploaded_files(request, input_pdf_dir)
+    except Exception:
+        shutil.rmtree(task_dir, ignore_errors=True)
+        raise
+
+    # Per-file size, SHA-256 and work; byte-identical uploads point at the first copy
+    file_entries = {}
+    first_by_hash = {}
+    for item in saved:
+        entry = {"size": item["size"], "sha256": item["sha256"]}
+        if item["sha256"] in first_by_hash:
+            entry["duplicate_of"] = first_by_hash[item["sha256"]]
+            entry["work"] = 0
+        else:
+            first_by_hash[item["sha256"]] = item["filename"]
+            entry["work"] = await run_in_threadpool(admission.file_work, input_pdf_dir / item["filename"])
+        file_entries[item["filename"]] = entry
 
     # INITIAL TASK STATUS
-    TASKS[task_id] = {
+    STORE.create_task(task_id, {
         "status": "pending",
         "progress": 0,
         "task_dir": str(task_dir),
-        "zip": None
-    }
+        "client": client,
+        "work": sum(entry["work"] for entry in file_entries.values()),
+        "files": file_entries
+    })
+
+    return {"task_id": task_id, "files": saved}
 
-    return {"task_id": task_id}
+
+def queue_task(task_id: str, task: dict, work: int, priority: str, **status):
+    """Queue the task's job in its priority class and wake the workers"""
+    worker.set_task_status(task_id, status="queued", priority=priority, **status)
+    STORE.enqueue(task_id, admission.PRIORITIES[priority], work, task.get("client"))
+    if worker.SCHEDULER is not None:
+        worker.SCHEDULER.wake()
 
 
 @app.post("/start/{task_id}")
-async def start_pipeline(task_id: str, background_tasks: BackgroundTasks):
-    """Start pipeline run in background thread"""
-    if task_id not in TASKS:
+async def start_pipeline(task_id: str, exports: str = None, priority: str = None):
+    """
+    Queue pipeline run for the next free worker.
+    exports: optional consolidated outputs, e.g. ?exports=xlsx,csv,parquet
+    """
+    task = STORE.get_task(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    if TASKS[task_id]["status"] != "pending":
+    if task["status"] != "pending":
         raise HTTPException(status_code=400, detail="Task already started")
 
-    background_tasks.add_task(run_pipeline, task_id)
+    if exports is not None:
+        try:
+            STORE.update_task(task_id, exports=consolidated_export.parse_formats(exports))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Tasks uploaded before work was recorded count one unit per file
+    work = task.get("work", len(task["files"]))
+    priority = admission.priority_for(work, priority)
+    admission.check(STORE, task.get("client"), work)
+    queue_task(task_id, task, work, priority)
+
+    return {"message": "Pipeline started", "task_id": task_id, "priority": priority}
+
+
+@app.post("/retry/{task_id}")
+async def retry_failed_files(task_id: str):
+    """
+    Queue a finished task again for its failed files only: stages with a
+    valid checkpoint (task_dir/manifest.json) are skipped, so files that
+    went through are not converted or extracted twice.
+    """
+    task = STORE.get_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
 
-    return {"message": "Pipeline started", "task_id": task_id}
+    if task["status"] not in ("finished", "failed"):
+        raise HTTPException(status_code=400, detail=f"Task is {task['status']}")
+
+    # A failed task may have stopped before recording per-file results: retry all of it
+    failed_files = task.get("failed_files") or {}
+    if task["status"] == "finished" and not failed_files:
+        raise HTTPException(status_code=400, detail="No failed files to retry")
+
+    retrying = list(failed_files) if task["status"] == "finished" else list(task["files"])
+    work = max(1, sum(task["files"][name].get("work", 1) for name in retrying if name in task["files"]))
+    priority = admission.priority_for(work, task.get("priority"))
+    admission.check(STORE, task.get("client"), work)
+    for file_name in retrying:
+        STORE.update_file(task_id, file_name, state="queued", error=None)
+    queue_task(task_id, task, work, priority, error=None, failed_files={}, retries=task.get("retries", 0) + 1)
+
+    return {"message": "Retry queued", "task_id": task_id, "files": retrying}
 
 
 @app.get("/status/{task_id}")
 def get_status(task_id: str):
-    """Return pipeline status"""
-    if task_id not in TASKS:
+    """Return pipeline status (queue_position counts interactive tasks ahead of bulk ones)"""
+    task = STORE.get_task(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return TASKS[task_id]
+    if task["status"] == "queued":
+        task["queue_position"] = STORE.queue_position(task_id)
+    return task
+
+
+@app.get("/events/{task_id}")
+async def stream_events(task_id: str, request: Request, after: int = 0):
+    """
+    Server-sent events: one "file" event per file stage transition (with
+    stage seconds, token usage, cache hits, errors) and one "task" event per
+    status change. Ends once the task is finished or failed.
+
+    Reconnecting clients resume via Last-Event-ID (or ?after=<id>).
+    /status stays available for polling clients.
+    """
+    if STORE.get_task(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+
+    async def event_stream():
+        last_id = after
+        last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            events = await run_in_threadpool(STORE.get_events, task_id, last_id)
+            for event_id, event in events:
+                last_id = event_id
+                yield f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                last_sent = time.monotonic()
+            if events:
+                continue
+
+            task = await run_in_threadpool(STORE.get_task, task_id)
+            if task is None or task["status"] in ("finished", "failed"):
+                # Everything up to the final status event has been sent
+                yield "event: end\ndata: {}\n\n"
+                return
+
+            if time.monotonic() - last_sent >= EVENTS_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def parse_range(header: str, size: int):
+    """
+    (start, end) with end exclusive for a single "bytes=a-b" / "bytes=a-" /
+    "bytes=-n" range; None to send everything (multiple ranges).
+    ValueError when the range is malformed or outside the content.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        start, end = max(0, size - int(last)), size
+    else:
+        start = int(first)
+        end = min(size, int(last) + 1) if last else size
+    if start >= end:
+        raise ValueError(header)
+    return start, end
+
+
+def counted(chunks, mode: str):
+    for chunk in chunks:
+        metrics.DOWNLOAD_BYTES.inc(len(chunk), mode=mode)
+        yield chunk
+
+
+async def live_zip(task_id: str, excel_dir: Path):
+    """ZIP of the task's reports, each sent as soon as it is written; ends with the task."""
+    follower = zipper.ZipFollower()
+    while True:
+        task = await run_in_threadpool(STORE.get_task, task_id)
+        ended = task is None or task["status"] in ("finished", "failed")
+        # Consolidated exports (subfolders) are only complete once the task is
+        members = await run_in_threadpool(zipper.scan_members, excel_dir, ended)
+        for member in members:
+            if member.name not in follower.added:
+                async for chunk in iterate_in_threadpool(counted(follower.add(member), "live")):
+                    yield chunk
+        if ended:
+            break
+        await asyncio.sleep(DOWNLOAD_POLL_INTERVAL)
+    yield follower.finish()
 
 
 @app.get("/download/{task_id}")
-def download_results(task_id: str):
+async def download_results(task_id: str, request: Request):
     """
-    Download ZIP file after pipeline finished
+    Download the Excel outputs as a ZIP built on the fly; members are stored
+    as they are (XLSX is compressed already) instead of deflated again.
+
+    Finished tasks: Content-Length, ETag and Range (resumable downloads).
+    Queued or running tasks: the archive streams each report as soon as it
+    is written and ends when the task does.
     """
-    if task_id not in TASKS:
+    task = STORE.get_task(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    status = TASKS[task_id]
+    if task["status"] not in ("queued", "running", "finished"):
+        raise HTTPException(status_code=400, detail=f"Task is {task['status']}")
+
+    excel_dir = Path(task["task_dir"]) / "output_excel"
+    headers = {"Content-Disposition": 'attachment; filename="outputs.zip"'}
+    if task["status"] != "finished":
+        return StreamingResponse(live_zip(task_id, excel_dir), media_type="application/zip", headers=headers)
+
+    archive = zipper.ZipStream(await run_in_threadpool(zipper.scan_members, excel_dir))
+    headers.update({"Accept-Ranges": "bytes", "ETag": archive.etag})
+
+    # If-Range: resume only while the archive is unchanged, else send it whole
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", archive.etag) == archive.etag:
+        try:
+            byte_range = parse_range(range_header, archive.size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{archive.size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{archive.size}"
+            headers["Content-Length"] = str(end - start)
+            return StreamingResponse(counted(archive.iter_bytes(start, end), "range"), status_code=206,
+                                     media_type="application/zip", headers=headers)
+
+    headers["Content-Length"] = str(archive.size)
+    return StreamingResponse(counted(archive.iter_bytes(), "full"), media_type="application/zip", headers=headers)
+
+
+@app.get("/converter/stats")
+def get_converter_stats():
+    """Docling workers: model load vs convert time, current and peak RSS, replacements; cache hit rate"""
+    pool = converter_pool.get_pool()
+    cache = markdown_cache.get_cache()
+    return {
+        **(pool.stats() if pool is not None else {"workers": 0}),
+        "markdown_cache": cache.stats() if cache is not None else None,
+    }
 
-    if status["status"] != "finished":
-        raise HTTPException(status_code=400, detail="Pipeline not finished yet")
 
-    zip_file = status["zip"]
-    if not zip_file or not Path(zip_file).exists():
-        raise HTTPException(status_code=404, detail="ZIP file missing")
+@app.get("/scheduler/stats")
+def get_scheduler_stats():
+    """Queue depth, plus this process's workers when they run embedded"""
+    return {
+        "queue": STORE.queue_stats(),
+        "embedded_worker": worker.worker_stats(),
+    }
 
-    return FileResponse(
-        path=zip_file,
-        media_type="application/zip",
-        filename="outputs.zip"
-    )
+
+@app.get("/router/stats")
+def get_router_stats():
+    """This process's LLM deployments: quota left, requests in flight, errors, cooldowns"""
+    return {"deployments": full_pipeline.get_llm_router().stats()}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics of this process (stage timings, LLM latency and tokens, queue)"""
+    queue = STORE.queue_stats()
+    metrics.QUEUE_DEPTH.set(queue["queued"])
+    metrics.ACTIVE_TASKS.set(queue["running"])
+    metrics.QUEUED_WORK.set(queue["queued_work"])
+    metrics.RUNNING_WORK.set(queue["running_work"])
+    return Response(content=metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+@app.get("/invoices")
+def find_invoices(vendor: str = None, invoice_no: str = None, task_id: str = None, currency: str = None,
+                  date_from: str = None, date_to: str = None, amount_min: float = None, amount_max: float = None,
+                  limit: int = 100, offset: int = 0):
+    """
+    Look up invoices extracted by any task (kept after /cleanup).
+    vendor: vendor number or name; dates as DD-MM-YYYY or YYYY-MM-DD; ranges are inclusive.
+    """
+    store = invoice_store.get_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Invoice store disabled")
+    try:
+        return store.query(vendor=vendor, invoice_no=invoice_no, task_id=task_id, currency=currency,
+                           date_from=date_from, date_to=date_to, amount_min=amount_min, amount_max=amount_max,
+                           limit=limit, offset=offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/invoices/stats")
+def get_invoice_stats():
+    """Invoices, documents, tasks and vendors in the invoice store"""
+    store = invoice_store.get_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Invoice store disabled")
+    return store.stats()
+
+
+@app.get("/invoices/duplicates/{task_id}")
+def get_duplicate_invoices(task_id: str):
+    """The task's invoices also found in another document: same vendor and number, or same vendor, date and amount"""
+    store = invoice_store.get_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Invoice store disabled")
+    duplicates = store.duplicates(task_id)
+    return {"task_id": task_id, "count": len(duplicates), "items": duplicates}
+
+
+@app.get("/admin/extraction-cache")
+def get_extraction_cache():
+    """Inspect the AI extraction cache"""
+    cache = extraction_cache.get_cache()
+    if cache is None:
+        raise HTTPException(status_code=404, detail="Extraction cache disabled")
+    return cache.stats(full_pipeline.extraction_prompt_hash())
+
+
+@app.delete("/admin/extraction-cache")
+def purge_extraction_cache(stale_only: bool = False):
+    """
+    Purge the AI extraction cache.
+    stale_only=true keeps entries made with the current prompts/deployment.
+    """
+    cache = extraction_cache.get_cache()
+    if cache is None:
+        raise HTTPException(status_code=404, detail="Extraction cache disabled")
+    keep = full_pipeline.extraction_prompt_hash() if stale_only else None
+    return {"deleted": cache.purge(keep_prompt_hash=keep)}
+
+
+@app.get("/admin/templates")
+def get_templates():
+    """Learned vendor layouts and how often they replaced the LLM"""
+    index = vendor_templates.get_index()
+    if index is None:
+        raise HTTPException(status_code=404, detail="Vendor templates disabled")
+    return {**index.stats(), "items": index.list()}
+
+
+@app.delete("/admin/templates/{fingerprint}")
+def delete_template(fingerprint: str):
+    """Forget a learned layout; its documents go back to the LLM"""
+    index = vendor_templates.get_index()
+    if index is None:
+        raise HTTPException(status_code=404, detail="Vendor templates disabled")
+    if not index.delete(fingerprint):
+        raise HTTPException(status_code=404, detail="Template not found")
+    return {"deleted": fingerprint}
 
 
 @app.delete("/cleanup/{task_id}")
 def cleanup_task(task_id: str):
     """Delete task folder and remove status"""
-    if task_id not in TASKS:
+    task = STORE.get_task(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    task_dir = Path(TASKS[task_id]["task_dir"])
+    task_dir = Path(task["task_dir"])
 
     if task_dir.exists():
         shutil.rmtree(task_dir)
 
-    del TASKS[task_id]
+    STORE.delete_task(task_id)
 
     return {"message": "Task data cleaned up"}
 
@@ -0,0 +1,73 @@
+"""
+tests/conftest.py
+Shared fixtures: local fake LLM deployments (benchmarks/fake_llm.py) and synthetic statements
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(BACKEND), str(BACKEND / "benchmarks")]
+
+# Set before full_pipeline / utils read them at import: no real deployment,
+# caches or stores, and a process-wide limiter that never holds tests back;
+# main.py keeps its tasks in memory and starts no workers
+os.environ.update(
+    AZURE_DEPLOYMENT="gpt-test",
+    AZURE_RPM="100000",
+    AZURE_TPM="100000000",
+    EXTRACTION_CACHE_ENABLED="0",
+    MARKDOWN_CACHE_ENABLED="0",
+    TEMPLATES_ENABLED="0",
+    INVOICE_STORE_ENABLED="0",
+    TASK_BACKEND="memory",
+    EMBEDDED_WORKERS="0",
+)
+
+from fake_llm import FakeLLMServer  # noqa: E402
+import full_pipeline  # noqa: E402
+from utils import llm_router  # noqa: E402
+
+
+API_VERSION = "2024-02-01"
+
+
+def statement(rows: int = 3, start: int = 0) -> str:
+    """Markdown of a synthetic statement: one DD.MM.YYYY table row per invoice."""
+    lines = ["Example Supplies Pvt Ltd", "", "| Date | Invoice | PO | Amount | Currency |", "|---|---|---|---|---|"]
+    for i in range(start, start + rows):
+        lines.append(f"| {i % 28 + 1:02d}.01.2024 | INV-{i:05d} | PO-{i} | 1.{i % 1000:03d},00 | EUR |")
+    return "\n".join(lines) + "\n"
+
+
+@pytest.fixture
+def fake_llm():
+    """Starts FakeLLMServer(**options) (no latency unless given); all are stopped after the test."""
+    servers = []
+
+    def start(**options):
+        options.setdefault("latency", 0.0)
+        server = FakeLLMServer(**options).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def deployment():
+    """llm_router.Deployment talking to a fake server through a real Azure OpenAI client."""
+
+    def make(server, name, rpm=1000, tpm=1000000, max_prompt_tokens=0):
+        return llm_router.Deployment(
+            name, "gpt-test", endpoint=server.url, api_key="test", api_version=API_VERSION,
+            rpm=rpm, tpm=tpm, max_prompt_tokens=max_prompt_tokens,
+            client=full_pipeline.create_ai_client(server.url, "test", API_VERSION),
+        )
+
+    return make
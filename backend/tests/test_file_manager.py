@@ -0,0 +1,62 @@
+"""
+tests/test_file_manager.py
+Streaming multipart uploads: file names, PDF check and cleanup on rejection
+"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from utils.file_manager import stream_uploaded_files
+
+BOUNDARY = "testboundary"
+PDF = b"%PDF-1.4\n" + b"x" * 2000
+
+
+class Request:
+    """The parts of a Starlette request stream_uploaded_files uses, body sent in small chunks."""
+
+    def __init__(self, body: bytes, chunk_size: int = 100):
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+
+def form(*files) -> bytes:
+    body = b""
+    for name, content in files:
+        body += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"files\"; filename=\"{name}\"\r\n"
+                 f"Content-Type: application/pdf\r\n\r\n").encode() + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def upload(tmp_path, *files):
+    return asyncio.run(stream_uploaded_files(Request(form(*files)), tmp_path))
+
+
+def test_files_are_saved_with_unique_names(tmp_path):
+    saved = upload(tmp_path, ("a.pdf", PDF), ("dir/a.pdf", PDF), ("C:\\scans\\b.PDF", PDF))
+    assert [item["filename"] for item in saved] == ["a.pdf", "a (2).pdf", "b.PDF"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a (2).pdf", "a.pdf", "b.PDF"]
+    assert all(item["size"] == len(PDF) for item in saved)
+
+
+@pytest.mark.parametrize("name", ["..", ".", "", "../..", "scan.txt", "scan", ".pdf"])
+def test_bad_file_names_are_rejected(tmp_path, name):
+    with pytest.raises(HTTPException) as error:
+        upload(tmp_path, ("ok.pdf", PDF), (name, PDF))
+    assert error.value.status_code == 400
+    # Files written before the rejection are removed, the target directory is left alone
+    assert tmp_path.is_dir() and list(tmp_path.iterdir()) == []
+
+
+def test_non_pdf_content_is_rejected(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        upload(tmp_path, ("fake.pdf", b"<html>" + b"x" * 2000))
+    assert error.value.status_code == 415
+    assert list(tmp_path.iterdir()) == []
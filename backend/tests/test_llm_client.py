@@ -0,0 +1,199 @@
+"""
+tests/test_llm_client.py
+Rate limiting, retries and the extraction request against a fake Azure OpenAI deployment
+"""
+
+import os
+import time
+
+import openai
+import pytest
+
+import full_pipeline
+from conftest import API_VERSION, statement
+from utils import llm_client, llm_router
+from utils.llm_client import backoff_delay
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """Waits come from Retry-After alone, so the timings below are exact."""
+    monkeypatch.setattr(llm_client, "backoff_delay", lambda attempt: 0.0)
+
+
+def single_router(deployment):
+    return llm_router.LLMRouter([deployment], max_failures=3, cooldown_seconds=30)
+
+
+# ---------------------------------------------
+# LIMITER
+# ---------------------------------------------
+
+def test_rpm_pacing():
+    limiter = llm_client.RateLimiter(rpm=600, tpm=10 ** 9)
+    for _ in range(600):
+        limiter.acquire(1)
+
+    # Bucket empty: 600/minute refills one request every 0.1 s
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire(1)
+    assert 0.4 <= time.monotonic() - start < 1.0
+
+
+def test_tpm_pacing():
+    limiter = llm_client.RateLimiter(rpm=10 ** 6, tpm=6000)
+    limiter.acquire(6000)
+
+    # 6000 tokens/minute = 100 tokens/s
+    start = time.monotonic()
+    limiter.acquire(50)
+    assert 0.4 <= time.monotonic() - start < 1.0
+
+
+def test_oversized_request_waits_for_a_full_bucket():
+    limiter = llm_client.RateLimiter(rpm=100, tpm=1000)
+    assert limiter.acquire(5000) == 1000
+    assert limiter.stats()["tokens_available"] < 20
+
+
+def test_adjust_credits_back_unused_tokens():
+    limiter = llm_client.RateLimiter(rpm=100, tpm=10000)
+    reserved = limiter.acquire(5000)
+    limiter.adjust(reserved, 1200)
+    assert 8800 <= limiter.stats()["tokens_available"] <= 8810
+
+    # Usage above the estimate is charged
+    limiter.adjust(100, 600)
+    assert 8300 <= limiter.stats()["tokens_available"] <= 8310
+
+
+def test_pause_holds_callers_back():
+    limiter = llm_client.RateLimiter(rpm=100, tpm=10000)
+    limiter.pause(0.3)
+    assert limiter.stats()["paused_seconds"] > 0
+    start = time.monotonic()
+    limiter.acquire(1)
+    assert time.monotonic() - start >= 0.3
+
+
+# ---------------------------------------------
+# RETRY HELPERS
+# ---------------------------------------------
+
+class Response:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class Error(Exception):
+    def __init__(self, status_code, headers=None):
+        self.response = Response(status_code, headers or {})
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "250", "retry-after": "3"}, 0.25),
+    ({"retry-after": "3"}, 3.0),
+    ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, None),
+    ({}, None),
+])
+def test_retry_after_seconds(headers, expected):
+    assert llm_client.retry_after_seconds(Error(429, headers)) == expected
+
+
+def test_status_codes_worth_a_retry():
+    assert llm_client.is_retryable(Error(429))
+    assert llm_client.is_retryable(Error(503))
+    assert not llm_client.is_retryable(Error(400))
+    assert llm_client.status_code(Error(404)) == 404
+
+
+def test_backoff_delay_is_capped(monkeypatch):
+    monkeypatch.setattr(llm_client, "AI_BACKOFF_BASE", 0.5)
+    monkeypatch.setattr(llm_client, "AI_BACKOFF_MAX", 3.0)
+    for attempt in range(8):
+        for _ in range(50):
+            assert 0 <= backoff_delay(attempt) <= min(3.0, 0.5 * 2 ** attempt)
+
+
+# ---------------------------------------------
+# AGAINST THE FAKE DEPLOYMENT
+# ---------------------------------------------
+
+def test_requests_in_flight_stay_at_ai_concurrency(fake_llm, tmp_path):
+    server = fake_llm(latency=0.2)
+    folders = [tmp_path / name for name in ("input_pdf", "temp_txt", "output_json", "output_excel")]
+    for folder in folders:
+        folder.mkdir()
+    for i in range(12):
+        (folders[1] / f"s{i:02d}.txt").write_text(statement(3, start=i * 3), encoding="utf-8")
+
+    client = full_pipeline.create_ai_client(server.url, "test", API_VERSION)
+    ctx = full_pipeline.PipelineContext(*folders, client=client, ai_concurrency=3)
+    full_pipeline.extract_data_with_ai(ctx)
+
+    assert len(os.listdir(folders[2])) == 12
+    assert server.stats["requests"] == 12
+    assert server.stats["max_in_flight"] == 3
+
+
+def test_limiter_keeps_requests_under_the_deployment_quota(fake_llm, deployment):
+    server = fake_llm(rpm=4)
+    d = deployment(server, "main", rpm=4, tpm=10 ** 6)
+    router = single_router(d)
+    for i in range(4):
+        full_pipeline.request_extraction(router, statement(2, start=i))
+
+    assert server.stats["requests"] == 4 and server.stats["throttled"] == 0
+    # The next request would wait for the bucket instead of drawing a 429
+    assert d.limiter.stats()["requests_available"] < 1
+
+
+@pytest.mark.parametrize("headers, wait", [
+    ({"retry-after-ms": "400"}, 0.4),
+    ({"Retry-After": "1"}, 1.0),
+])
+def test_429_retry_after_is_honoured(fake_llm, deployment, headers, wait):
+    server = fake_llm()
+    server.fail_next(429, headers=headers)
+    router = single_router(deployment(server, "main"))
+
+    start = time.monotonic()
+    data, usage = full_pipeline.request_extraction(router, statement(3))
+    elapsed = time.monotonic() - start
+
+    assert usage["attempts"] == 2 and usage["deployment"] == "main"
+    assert [row["Invoice No"] for row in data["   "][:3]] == ["INV-00000", "INV-00001", "INV-00002"]
+    assert server.stats["throttled"] == 1 and server.stats["requests"] == 1
+    assert wait <= elapsed < wait + 1.0
+
+
+def test_usage_credits_back_the_reservation(fake_llm, deployment):
+    server = fake_llm()
+    d = deployment(server, "main", rpm=1000, tpm=60000)
+    router = single_router(d)
+
+    response, _, _ = router.create_chat_completion(
+        {"messages": [{"role": "user", "content": statement(5)}]}, estimated_tokens=20000)
+
+    # Only what the response reports as used stays charged
+    used = response.usage.total_tokens
+    assert used < 2000
+    assert abs(d.limiter.stats()["tokens_available"] - (60000 - used)) < 100
+
+
+def test_non_retryable_400_fails_immediately(fake_llm, deployment):
+    server = fake_llm()
+    server.fail_next(400)
+    d = deployment(server, "main")
+    router = single_router(d)
+
+    start = time.monotonic()
+    with pytest.raises(openai.BadRequestError):
+        full_pipeline.request_extraction(router, statement(3))
+
+    assert time.monotonic() - start < 0.5
+    assert server.stats["errors"] == 1 and server.stats["requests"] == 0
+    assert d.failures == 0 and d.cooldown_until == 0.0
+    assert d.in_flight == 0 and d.counts["errors"] == 1
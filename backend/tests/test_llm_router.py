@@ -0,0 +1,101 @@
+"""
+tests/test_llm_router.py
+Routing over several fake deployments: capacity spread, cooldown after failures, size tiers
+"""
+
+import time
+from collections import Counter
+
+import pytest
+
+import full_pipeline
+from conftest import statement
+from utils import llm_client, llm_router
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_client, "backoff_delay", lambda attempt: 0.0)
+
+
+def test_requests_spread_by_remaining_capacity(fake_llm, deployment):
+    small, large = fake_llm(rpm=20), fake_llm(rpm=60)
+    router = llm_router.LLMRouter([deployment(small, "small", rpm=20), deployment(large, "large", rpm=60)])
+
+    used = Counter(full_pipeline.request_extraction(router, statement(2, start=i))[1]["deployment"]
+                   for i in range(40))
+
+    # Both quotas drain at the same rate: a quarter of the requests go to the 20 RPM deployment
+    assert 8 <= used["small"] <= 12 and used["small"] + used["large"] == 40
+    assert small.stats["requests"] == used["small"] and large.stats["requests"] == used["large"]
+    assert small.stats["throttled"] == large.stats["throttled"] == 0
+
+
+def test_spills_over_when_a_deployment_is_out_of_quota(fake_llm, deployment):
+    first, second = fake_llm(), fake_llm()
+    router = llm_router.LLMRouter([deployment(first, "first"), deployment(second, "second")])
+    router.deployments[0].limiter.pause(5)
+
+    for i in range(3):
+        assert full_pipeline.request_extraction(router, statement(2, start=i))[1]["deployment"] == "second"
+    assert first.stats["requests"] == 0
+
+
+@pytest.mark.parametrize("status, headers", [
+    (429, {"retry-after-ms": "50"}),
+    (500, {}),
+    (503, {}),
+])
+def test_cooldown_after_repeated_failures(fake_llm, deployment, status, headers):
+    flaky, steady = fake_llm(), fake_llm()
+    flaky.fail_next(status, times=2, headers=headers)
+    router = llm_router.LLMRouter([deployment(flaky, "flaky"), deployment(steady, "steady")],
+                                  max_failures=2, cooldown_seconds=0.8)
+
+    # Every request still succeeds: a failure is retried on the other deployment
+    deadline = time.monotonic() + 5
+    while router.deployments[0].counts["cooldowns"] == 0:
+        assert time.monotonic() < deadline
+        data, usage = full_pipeline.request_extraction(router, statement(2))
+        assert usage["deployment"] == "steady"
+    assert router.stats()[0]["cooldown_seconds"] > 0
+
+    # Out of rotation while cooling down
+    for i in range(5):
+        assert full_pipeline.request_extraction(router, statement(2, start=i))[1]["deployment"] == "steady"
+    failed = flaky.stats["throttled"] + flaky.stats["errors"]
+    assert failed == 2 and flaky.stats["requests"] == 0
+
+    # Back in rotation once the cooldown has passed
+    time.sleep(0.9)
+    used = {full_pipeline.request_extraction(router, statement(2, start=i))[1]["deployment"] for i in range(6)}
+    assert "flaky" in used and flaky.stats["requests"] > 0
+
+
+def test_cooldown_lasts_at_least_retry_after(fake_llm, deployment):
+    flaky, steady = fake_llm(), fake_llm()
+    flaky.fail_next(429, headers={"retry-after-ms": "1500"})
+    router = llm_router.LLMRouter([deployment(flaky, "flaky"), deployment(steady, "steady")],
+                                  max_failures=1, cooldown_seconds=0.1)
+
+    assert full_pipeline.request_extraction(router, statement(2))[1]["deployment"] == "steady"
+    assert router.stats()[0]["cooldown_seconds"] > 1.0
+
+
+def test_short_statements_go_to_the_small_tier(fake_llm, deployment):
+    mini, full = fake_llm(), fake_llm()
+    short = statement(3)
+    short_tokens = (llm_client.count_tokens(full_pipeline.system_prompt())
+                    + llm_client.count_tokens(full_pipeline.build_user_prompt(short)))
+    router = llm_router.LLMRouter([
+        deployment(full, "full", rpm=1000),
+        deployment(mini, "mini", rpm=1000, max_prompt_tokens=short_tokens + 500),
+    ])
+
+    assert full_pipeline.request_extraction(router, short)[1]["deployment"] == "mini"
+    assert full_pipeline.request_extraction(router, statement(200))[1]["deployment"] == "full"
+
+    # The small tier spills over to the large one when it has no capacity left
+    router.deployments[1].limiter.pause(5)
+    assert full_pipeline.request_extraction(router, short)[1]["deployment"] == "full"
+    assert mini.stats["requests"] == 1 and full.stats["requests"] == 2
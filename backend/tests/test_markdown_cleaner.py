@@ -0,0 +1,32 @@
+"""
+tests/test_markdown_cleaner.py
+Page numbers are dropped from Docling markdown, dates and fractions that look like them are not
+"""
+
+import pytest
+
+from utils.markdown_cleaner import clean_markdown
+
+BREAK = "<!-- page break -->"
+
+
+def pages(*texts) -> str:
+    return f"\n\n{BREAK}\n\n".join(texts) + "\n"
+
+
+@pytest.mark.parametrize("line", ["Page 2", "page 2 of 3", "Page 2/3", "PAGE 2 / 3", "2 of 3", "2/3", "3 / 3"])
+def test_page_numbers_are_dropped(line):
+    markdown = pages("Statement", f"Invoices\n\n{line}", "Totals")
+    assert line not in clean_markdown(markdown)
+
+
+@pytest.mark.parametrize("line", ["03/2024", "12/31", "3/2", "0/3", "1 of 4", "1/2024"])
+def test_dates_and_fractions_are_kept(line):
+    # Three pages: a bare n/m is a page number only for n <= m <= 3
+    markdown = pages("Statement", f"Period\n\n{line}", "Totals")
+    assert line in clean_markdown(markdown).splitlines()
+
+
+def test_single_page_keeps_bare_fractions():
+    assert clean_markdown("Statement\n\n1/2\n").splitlines() == ["Statement", "", "1/2"]
+    assert clean_markdown("Statement\n\nPage 1 of 1\n").splitlines() == ["Statement"]
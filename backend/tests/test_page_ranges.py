@@ -0,0 +1,33 @@
+"""
+tests/test_page_ranges.py
+Stitching page ranges: a table cut by a range boundary is joined, a new table is not
+"""
+
+from utils.markdown_chunker import PAGE_BREAK
+from utils.page_ranges import stitch_markdown
+
+FIRST = "Statement\n\n| Date | Invoice | Amount |\n|---|---|---|\n| 01.01.2024 | INV-1 | 10,00 |\n"
+
+
+def test_rows_without_a_header_continue_the_table():
+    stitched = stitch_markdown([FIRST, "| 02.01.2024 | INV-2 | 20,00 |\n| 03.01.2024 | INV-3 | 30,00 |\n"])
+    assert PAGE_BREAK not in stitched
+    assert stitched.endswith("| 01.01.2024 | INV-1 | 10,00 |\n| 02.01.2024 | INV-2 | 20,00 |\n"
+                             "| 03.01.2024 | INV-3 | 30,00 |\n")
+
+
+def test_repeated_header_is_dropped():
+    stitched = stitch_markdown([FIRST, "| date | Invoice  | Amount |\n|---|---|---|\n| 02.01.2024 | INV-2 | 20,00 |\n"])
+    assert PAGE_BREAK not in stitched
+    assert stitched.count("|---|---|---|") == 1
+    assert stitched.endswith("| 01.01.2024 | INV-1 | 10,00 |\n| 02.01.2024 | INV-2 | 20,00 |\n")
+
+
+def test_table_with_another_header_is_a_new_table():
+    # Same width, different columns: e.g. the payments table after the invoices
+    second = "| Paid on | Reference | Amount |\n|---|---|---|\n| 05.01.2024 | PAY-1 | 10,00 |\n"
+    stitched = stitch_markdown([FIRST, second])
+    assert stitched == FIRST + f"\n{PAGE_BREAK}\n\n" + second
+
+    narrower = "| Note | Text |\n| 1 | see terms |\n"
+    assert stitch_markdown([FIRST, narrower]) == FIRST + f"\n{PAGE_BREAK}\n\n" + narrower
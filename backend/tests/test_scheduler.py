@@ -0,0 +1,64 @@
+"""
+tests/test_scheduler.py
+Task workers: jobs of a worker that stopped sending heartbeats are picked up again
+"""
+
+import time
+import threading
+
+import pytest
+
+from utils.scheduler import TaskScheduler
+from utils.task_store import MemoryTaskStore, SQLiteTaskStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return MemoryTaskStore() if request.param == "memory" else SQLiteTaskStore(tmp_path / "tasks.sqlite3")
+
+
+def run_until(scheduler, done, timeout=5.0):
+    scheduler.start()
+    try:
+        return done.wait(timeout)
+    finally:
+        scheduler.stop()
+
+
+def test_job_of_a_dead_worker_is_requeued_after_its_lease(store):
+    store.create_task("t1", {"status": "queued", "files": {}})
+    store.enqueue("t1")
+    # Claimed by a worker that then died: its heartbeat is still fresh when the next worker starts
+    assert store.claim_job("dead-worker") == "t1"
+
+    ran, done = [], threading.Event()
+    scheduler = TaskScheduler(store, lambda task_id: (ran.append(task_id), done.set()),
+                              max_concurrent=1, worker_id="w2", poll_interval=0.05, lease_seconds=0.5)
+    start = time.monotonic()
+    assert run_until(scheduler, done)
+    assert ran == ["t1"]
+    assert time.monotonic() - start >= 0.5
+
+
+def test_running_jobs_keep_their_lease(store):
+    for task_id in ("t1", "t2"):
+        store.create_task(task_id, {"status": "queued", "files": {}})
+        store.enqueue(task_id)
+
+    runs, release = [], threading.Event()
+
+    def run(task_id):
+        runs.append(task_id)
+        release.wait(5)
+
+    # Jobs running longer than the lease are heartbeated, never handed out twice
+    first = TaskScheduler(store, run, max_concurrent=2, worker_id="w1", poll_interval=0.05, lease_seconds=0.4)
+    second = TaskScheduler(store, run, max_concurrent=2, worker_id="w2", poll_interval=0.05, lease_seconds=0.4)
+    first.start()
+    time.sleep(0.2)
+    second.start()
+    time.sleep(1.5)
+    release.set()
+    first.stop()
+    second.stop()
+    assert sorted(runs) == ["t1", "t2"]
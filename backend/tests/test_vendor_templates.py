@@ -0,0 +1,175 @@
+"""
+tests/test_vendor_templates.py
+Learned vendor templates: when a recurring layout may skip the LLM, and when it must not
+"""
+
+import random
+
+import pytest
+
+from utils import vendor_templates as vt
+
+
+def statement(month: int, rows: int = 6, seed: int = 0):
+    """(markdown, LLM output) of one month's statement from the same vendor layout."""
+    rand = random.Random(seed * 100 + month)
+    lines, invoices, total = [], [], 0.0
+    for i in range(rows):
+        day = rand.randint(1, 28)
+        amount = rand.randint(100, 99999) + rand.randint(0, 99) / 100
+        total += amount
+        number = f"INV{month:02d}{i:03d}"
+        cell = f"{amount:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+        lines.append(f"| {day:02d}.{month:02d}.2024 | {number} | PO {40000 + i} | {cell} | EUR |")
+        invoices.append({
+            "Invoice Date": f"{day:02d}-{month:02d}-2024", "Invoice No": number,
+            "Purchase order No. if available": str(40000 + i), "Invoice Amount": round(amount, 2),
+            "Invoice Currency": "EUR", "Invoice Due Date": "", "Remarks if any": "",
+        })
+    total_cell = f"{total:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    markdown = (
+        "ACME GmbH\n"
+        "STATEMENTS OF ACCOUNT\n"
+        "VAT ID: DE123456789\n"
+        f"Statement no: STMT2024{month:02d}{seed:04d}\n"
+        f"Reference: REF2024{month:02d}0{rows:03d}\n"
+        "Customer: Example Industries Ltd\n"
+        f"Statement date: 28.{month:02d}.2024\n\n"
+        "| Date | Document | Reference | Amount | Cur |\n"
+        "|---|---|---|---|---|\n"
+        + "\n".join(lines)
+        + f"\n| Total balance | | | {total_cell} | EUR |\n"
+    )
+    output = {
+        "": "", "Company Code": "", "Legal Entity Name": "Example Industries Ltd", "Vendor No": "",
+        "Vendor Name": "ACME GmbH", " ": "", "Subject": "", "  ": "",
+        "   ": invoices + [{
+            "Invoice Date": "", "Invoice No": "", "Purchase order No. if available": "Total",
+            "Invoice Amount": round(total, 2), "Invoice Currency": "EUR", "Invoice Due Date": "", "Remarks if any": "",
+        }],
+    }
+    return markdown, output
+
+
+def test_fingerprint_is_stable_across_months():
+    layouts = [vt.layout_of(statement(month)[0]) for month in (1, 2, 3)]
+    assert layouts[0]["ids"] == ["DE123456789"]
+    assert len({vt.fingerprint(layout) for layout in layouts}) == 1
+
+
+def test_vendor_ids_need_a_vat_prefix_and_digits():
+    pattern = vt.VENDOR_ID_PATTERNS[1]
+    for vat_id in ("DE123456789", "ATU12345678", "NL123456789B01", "FR40303265045", "GB123456789"):
+        assert pattern.findall(f"VAT {vat_id}") == [vat_id]
+    for token in ("STATEMENTS", "DEPARTMENTS", "REF2024010045", "STMT2024030001", "INV2024000123"):
+        assert pattern.findall(token) == []
+
+
+@pytest.fixture
+def index(tmp_path):
+    return vt.TemplateIndex(tmp_path / "templates.sqlite3")
+
+
+def test_row_that_does_not_parse_goes_to_the_llm(index):
+    for month in (1, 2):
+        index.learn(*statement(month))
+    markdown, output = statement(3, rows=25)
+    assert vt.outputs_match(index.match(markdown)[0], output)
+
+    # One malformed amount among 25 rows: no output at all rather than 24 invoices
+    rows = markdown.splitlines()
+    bad = next(i for i, line in enumerate(rows) if "INV03007" in line)
+    cells = rows[bad].split("|")
+    cells[4] = " see note "
+    rows[bad] = "|".join(cells)
+    result, info = index.match("\n".join(rows))
+    assert result is None
+    assert info["template_confidence"] == 0.0
+    assert index.stats()["fallbacks"] == 1
+
+
+@pytest.mark.parametrize("row, is_total", [
+    (["Total", "", "1.000,00"], True),
+    (["Total balance", "", "1.000,00"], True),
+    (["", "Grand total", "1.000,00"], True),
+    (["Subtotal", "", "1.000,00"], False),
+    (["01.02.2024", "INV1", "TotalEnergies fuel", "1.000,00"], False),
+])
+def test_total_rows(row, is_total):
+    assert vt._is_total_row(row) == is_total
+
+
+def test_rows_mentioning_total_are_invoices(index):
+    def with_vendor_reference(month):
+        markdown, output = statement(month)
+        return markdown.replace("| PO 40003 |", "| TotalEnergies 40003 |"), output
+
+    for month in (1, 2):
+        index.learn(*with_vendor_reference(month))
+    markdown, output = with_vendor_reference(3)
+    result, _ = index.match(markdown)
+    assert vt.outputs_match(result, output)
+    assert "INV03003" in [row["Invoice No"] for row in result["   "]]
+
+
+def test_learn_verify_activate(index):
+    markdown, output = statement(1)
+    index.learn(markdown, output)
+    assert index.list()[0]["verifications"] == 1 and not index.list()[0]["active"]
+    # Not verified yet: still the LLM
+    assert index.match(statement(2)[0]) == (None, {})
+
+    index.learn(*statement(2))
+    template = index.list()[0]
+    assert template["verifications"] == vt.TEMPLATE_MIN_VERIFICATIONS and template["active"]
+
+    markdown, output = statement(3)
+    result, info = index.match(markdown)
+    assert vt.outputs_match(result, output)
+    assert info["template_confidence"] >= vt.TEMPLATE_MIN_CONFIDENCE
+    assert index.list()[0]["uses"] == 1
+    assert {k: index.stats()[k] for k in ("learned", "verified", "matches")} == {"learned": 1, "verified": 1, "matches": 1}
+
+
+def test_mismatch_deactivates_the_template(index):
+    for month in (1, 2):
+        index.learn(*statement(month))
+
+    # The LLM reads a value the template cannot reproduce: out of rotation, not re-learned
+    markdown, output = statement(3)
+    output["   "][0]["Invoice No"] = "XX-1"
+    index.learn(markdown, output)
+    template = index.list()[0]
+    assert (template["verifications"], template["mismatches"], template["active"]) == (0, 1, False)
+    assert index.match(statement(4)[0])[0] is None
+
+    # Verified from scratch by the next LLM results before it answers again
+    index.learn(*statement(4))
+    assert (index.list()[0]["verifications"], index.list()[0]["mismatches"]) == (1, 1)
+    assert not index.list()[0]["active"]
+    index.learn(*statement(5))
+    assert index.list()[0]["active"]
+    assert vt.outputs_match(index.match(statement(6)[0])[0], statement(6)[1])
+
+
+def test_low_confidence_goes_to_the_llm(index):
+    for month in (1, 2):
+        index.learn(*statement(month))
+    markdown, _ = statement(3)
+
+    # No total where the template expects one
+    result, info = index.match(markdown.replace("| Total balance |", "| Carried forward |"))
+    assert result is None and info["template_confidence"] < vt.TEMPLATE_MIN_CONFIDENCE
+
+    # Different header labels around the same table
+    relabelled = markdown.replace("Customer:", "Account holder:").replace("Statement date:", "Period end:")
+    result, info = index.match(relabelled)
+    assert result is None and info["template_confidence"] < vt.TEMPLATE_MIN_CONFIDENCE
+    assert index.stats()["fallbacks"] == 2
+
+
+def test_documents_without_tables_have_no_template(index):
+    markdown = "ACME GmbH\nVAT ID: DE123456789\nNothing due.\n"
+    assert vt.fingerprint(vt.layout_of(markdown)) is None
+    index.learn(markdown, statement(1)[1])
+    assert index.list() == [] and index.match(markdown) == (None, {})
@@ -0,0 +1,119 @@
+"""
+tests/test_zipper.py
+Streamed ZIP downloads: archives zipfile can read (ZIP64 included) and byte ranges
+"""
+
+import io
+import os
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from utils import zipper
+
+FILES = {"a.xlsx": os.urandom(3000), "b.xlsx": b"", "consolidated/all.xlsx": os.urandom(700)}
+
+
+def write_files(directory, files=FILES):
+    for name, content in files.items():
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return directory
+
+
+def read_zip(body: bytes) -> dict:
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        assert archive.testzip() is None
+        return {info.filename: archive.read(info) for info in archive.infolist()}
+
+
+def test_stream_is_a_valid_zip(tmp_path):
+    archive = zipper.ZipStream(zipper.scan_members(write_files(tmp_path)))
+    body = b"".join(archive.iter_bytes())
+    assert len(body) == archive.size
+    assert read_zip(body) == FILES
+
+
+def test_zip64_records(tmp_path, monkeypatch):
+    # Limits small enough that every member, offset and the member count take the ZIP64 path
+    monkeypatch.setattr(zipper, "ZIP64_LIMIT", 100)
+    monkeypatch.setattr(zipper, "ZIP64_COUNT_LIMIT", 2)
+    archive = zipper.ZipStream(zipper.scan_members(write_files(tmp_path)))
+    body = b"".join(archive.iter_bytes())
+    assert b"PK\x06\x06" in body and b"PK\x06\x07" in body
+    assert read_zip(body) == FILES
+
+
+def test_follower_is_a_valid_zip(tmp_path, monkeypatch):
+    monkeypatch.setattr(zipper, "ZIP64_LIMIT", 1000)
+    follower = zipper.ZipFollower()
+    body = b""
+    for member in zipper.scan_members(write_files(tmp_path)):
+        body += b"".join(follower.add(member))
+    body += follower.finish()
+    assert read_zip(body) == FILES
+
+
+def test_ranges_add_up_to_the_whole_archive(tmp_path):
+    archive = zipper.ZipStream(zipper.scan_members(write_files(tmp_path)))
+    full = b"".join(archive.iter_bytes())
+    cuts = [0, 1, 29, 30, 31, 1000, 3100, archive.size - 1, archive.size]
+    parts = [b"".join(archive.iter_bytes(start, end, chunk_size=64)) for start, end in zip(cuts, cuts[1:])]
+    assert [len(part) for part in parts] == [end - start for start, end in zip(cuts, cuts[1:])]
+    assert b"".join(parts) == full
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 100)),
+    ("bytes=100-", (100, 1000)),
+    ("bytes=-10", (990, 1000)),
+    ("bytes=990-5000", (990, 1000)),
+    ("bytes=-5000", (0, 1000)),
+    ("bytes=0-9,20-29", None),
+    ("items=0-9", None),
+])
+def test_parse_range(header, expected):
+    assert main.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=", "bytes=-", "bytes=abc", "bytes=1-x", "bytes=5-2",
+                                    "bytes=1000-", "bytes=2000-3000", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        main.parse_range(header, 1000)
+
+
+@pytest.fixture
+def download(tmp_path):
+    write_files(tmp_path / "output_excel")
+    main.STORE.create_task("zip-test", {"status": "finished", "task_dir": str(tmp_path), "files": {}})
+    client = TestClient(main.app)
+    yield lambda **headers: client.get("/download/zip-test", headers=headers)
+    main.STORE.delete_task("zip-test")
+
+
+def test_download_ranges(download):
+    full = download()
+    assert full.status_code == 200 and read_zip(full.content) == FILES
+    size, etag = len(full.content), full.headers["etag"]
+
+    first = download(range="bytes=0-999")
+    rest = download(range="bytes=1000-", **{"if-range": etag})
+    assert (first.status_code, rest.status_code) == (206, 206)
+    assert first.headers["content-range"] == f"bytes 0-999/{size}"
+    assert rest.headers["content-range"] == f"bytes 1000-{size - 1}/{size}"
+    assert first.content + rest.content == full.content
+
+    # The archive changed since the first part: everything again
+    stale = download(range="bytes=1000-", **{"if-range": '"other"'})
+    assert stale.status_code == 200 and stale.content == full.content
+
+
+@pytest.mark.parametrize("header", ["bytes=", "bytes=abc", "bytes=9-3", "bytes=999999-", "bytes=-0"])
+def test_download_unsatisfiable_range(download, header):
+    response = download(range=header)
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(download().content)}"
@@ -0,0 +1,159 @@
+"""
+utils/admission.py
+Admission control: work budget, per-client quotas and priority classes for /upload and /start
+"""
+
+import os
+import math
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+
+from utils import page_ranges, metrics
+
+
+# Work is counted in "pages" (PyMuPDF page count, 1 per file without it) or "files"
+WORK_UNIT = os.getenv("WORK_UNIT", "pages")
+
+# Work in flight across all workers; a job waits in the queue until it fits (0 = unlimited)
+WORK_BUDGET = int(os.getenv("WORK_BUDGET", "0"))
+
+# Queued + running work above which new uploads and starts get 503 (0 = unlimited)
+MAX_BACKLOG_WORK = int(os.getenv("MAX_BACKLOG_WORK", "0"))
+
+# Uploads being received at once by this API process; more get 503 (0 = unlimited)
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "8"))
+
+# Queued + running tasks and work per client (API key, else IP); more get 429 (0 = unlimited)
+CLIENT_MAX_TASKS = int(os.getenv("CLIENT_MAX_TASKS", "0"))
+CLIENT_MAX_WORK = int(os.getenv("CLIENT_MAX_WORK", "0"))
+
+# Per-key overrides, "key=tasks/work,key2=tasks/work" (0 = unlimited)
+CLIENT_QUOTAS = os.getenv("CLIENT_QUOTAS", "")
+
+# Tasks with at most this much work are "interactive" and run ahead of "bulk" ones
+INTERACTIVE_MAX_WORK = int(os.getenv("INTERACTIVE_MAX_WORK", "20"))
+
+# Retry-After hint: seconds per unit of work over the limit, clamped to [min, max]
+SECONDS_PER_WORK = float(os.getenv("SECONDS_PER_WORK", "2"))
+RETRY_AFTER_MIN = 5
+RETRY_AFTER_MAX = 600
+
+API_KEY_HEADER = "x-api-key"
+
+# Queue order: lower runs first
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+
+def _parse_quotas(spec: str) -> dict:
+    quotas = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, limits = item.partition("=")
+        tasks, _, work = limits.partition("/")
+        quotas[_key_id(key.strip())] = (int(tasks or 0), int(work or 0))
+    return quotas
+
+
+def _key_id(api_key: str) -> str:
+    # Raw keys never reach the task store or the logs
+    return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+_QUOTAS = _parse_quotas(CLIENT_QUOTAS)
+
+
+# ---------------------------------------------
+# CLIENTS, WORK AND PRIORITY
+# ---------------------------------------------
+
+def client_id(request) -> str:
+    """The API key's id when one is sent, else the client's IP."""
+    api_key = request.headers.get(API_KEY_HEADER)
+    if api_key:
+        return _key_id(api_key)
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def client_quota(client: str) -> tuple:
+    """(max tasks, max work) of the client; 0 = unlimited."""
+    return _QUOTAS.get(client, (CLIENT_MAX_TASKS, CLIENT_MAX_WORK))
+
+
+def file_work(pdf_path) -> int:
+    """Units of work one PDF costs."""
+    if WORK_UNIT != "pages" or not page_ranges.available():
+        return 1
+    try:
+        return max(1, page_ranges.page_count(pdf_path))
+    except Exception:
+        return 1
+
+
+def priority_for(work: int, requested: str = None) -> str:
+    """Priority class: small tasks are interactive; any task may ask for bulk."""
+    if requested is not None and requested not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {requested}")
+    if requested == "bulk" or work > INTERACTIVE_MAX_WORK:
+        return "bulk"
+    return "interactive"
+
+
+# ---------------------------------------------
+# LIMITS
+# ---------------------------------------------
+
+def retry_after(excess_work: float) -> int:
+    seconds = math.ceil(max(0, excess_work) * SECONDS_PER_WORK)
+    return max(RETRY_AFTER_MIN, min(RETRY_AFTER_MAX, seconds))
+
+
+def reject(status_code: int, reason: str, detail: str, wait: int):
+    metrics.ADMISSION_REJECTED.inc(reason=reason)
+    raise HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(wait)})
+
+
+def check(store, client: str, work: int = 0):
+    """
+    Raise 503 when the queue backlog has no room for `work` more units, or
+    429 when the client is at its task or work quota; both with Retry-After.
+    work=0 checks before an upload, when its size is not known yet.
+    """
+    stats = store.queue_stats()
+    backlog = stats["queued_work"] + stats["running_work"]
+    if MAX_BACKLOG_WORK and backlog > 0 and backlog + work > MAX_BACKLOG_WORK:
+        reject(503, "backlog", "Server is busy, try again later",
+               retry_after(backlog + work - MAX_BACKLOG_WORK))
+
+    max_tasks, max_work = client_quota(client)
+    load = store.client_load(client)
+    if max_tasks and load["tasks"] >= max_tasks:
+        reject(429, "client_tasks", f"Too many tasks in progress (limit {max_tasks})",
+               retry_after(load["work"] / max(1, load["tasks"])))
+    if max_work and load["work"] > 0 and load["work"] + work > max_work:
+        reject(429, "client_work", f"Too much work in progress (limit {max_work} {WORK_UNIT})",
+               retry_after(load["work"] + work - max_work))
+
+
+_uploads = 0
+_uploads_lock = threading.Lock()
+
+
+@contextmanager
+def upload_slot():
+    """One of MAX_CONCURRENT_UPLOADS; 503 when all are taken."""
+    global _uploads
+    with _uploads_lock:
+        if MAX_CONCURRENT_UPLOADS and _uploads >= MAX_CONCURRENT_UPLOADS:
+            full = True
+        else:
+            full = False
+            _uploads += 1
+    if full:
+        reject(503, "uploads", "Too many uploads in progress, try again later", RETRY_AFTER_MIN)
+    try:
+        yield
+    finally:
+        with _uploads_lock:
+            _uploads -= 1
@@ -0,0 +1,109 @@
+"""
+utils/checkpoints.py
+Per-file, per-stage checkpoint manifest of a task directory
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+
+
+MANIFEST_NAME = "manifest.json"
+STAGES = ("convert", "extract", "excel")
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    task_dir/manifest.json: for every file and stage, the output written,
+    its SHA-256 and the SHA-256 of the input it was made from.
+
+    A stage is done when its output still exists with the recorded hash and
+    was made from the current input (the previous stage's output, or the
+    PDF); a re-run skips it. Failures are kept per file until the stage
+    succeeds, so the task knows which files to retry.
+    """
+
+    def __init__(self, task_dir):
+        self.task_dir = Path(task_dir)
+        self.path = self.task_dir / MANIFEST_NAME
+        self._lock = threading.Lock()
+        try:
+            self._data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self._data = {"version": 1, "files": {}}
+
+    def _save(self):
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._data, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def _relative(self, path) -> str:
+        return Path(path).resolve().relative_to(self.task_dir.resolve()).as_posix()
+
+    def _entry(self, file_name) -> dict:
+        return self._data["files"].setdefault(file_name, {"stages": {}})
+
+    def output_sha(self, file_name, stage):
+        with self._lock:
+            record = self._data["files"].get(file_name, {}).get("stages", {}).get(stage)
+            return record["sha256"] if record else None
+
+    def is_done(self, file_name, stage, output_path, input_sha) -> bool:
+        """Stage output exists, is unchanged and was made from input_sha."""
+        with self._lock:
+            record = self._data["files"].get(file_name, {}).get("stages", {}).get(stage)
+        if not record or input_sha is None or record["input_sha256"] != input_sha:
+            return False
+        if record["output"] != self._relative(output_path):
+            return False
+        path = self.task_dir / record["output"]
+        try:
+            return path.stat().st_size == record["size"] and file_sha256(path) == record["sha256"]
+        except OSError:
+            return False
+
+    def done(self, file_name, stage, output_path, input_sha) -> str:
+        """Records a finished stage; returns the output's SHA-256 (input of the next stage)."""
+        output_path = Path(output_path)
+        sha = file_sha256(output_path)
+        record = {
+            "output": self._relative(output_path),
+            "sha256": sha,
+            "size": output_path.stat().st_size,
+            "input_sha256": input_sha,
+            "at": time.time(),
+        }
+        with self._lock:
+            entry = self._entry(file_name)
+            entry["stages"][stage] = record
+            entry.pop("failed", None)
+            self._save()
+        return sha
+
+    def failed(self, file_name, stage, error):
+        with self._lock:
+            self._entry(file_name)["failed"] = {"stage": stage, "error": str(error), "at": time.time()}
+            self._save()
+
+    def failed_files(self) -> dict:
+        """{file_name: {"stage", "error", "at"}} of files whose last attempt failed."""
+        with self._lock:
+            return {name: dict(entry["failed"]) for name, entry in self._data["files"].items() if "failed" in entry}
+
+    def summary(self) -> dict:
+        """Number of files with each stage done, and with a failure."""
+        with self._lock:
+            files = self._data["files"]
+            counts = {stage: sum(1 for e in files.values() if stage in e["stages"]) for stage in STAGES}
+            return {**counts, "failed": sum(1 for e in files.values() if "failed" in e)}
@@ -0,0 +1,199 @@
+"""
+utils/consolidated_export.py
+One row per invoice across every extracted document: single sheet, CSV, Parquet
+"""
+
+import os
+import csv
+import json
+from pathlib import Path
+
+from utils import lazy
+
+# Loaded by the first export, not when the API imports this module
+openpyxl = lazy.module("openpyxl")
+openpyxl_cell = lazy.module("openpyxl.cell")
+openpyxl_styles = lazy.module("openpyxl.styles")
+
+# pyarrow is optional; only the Parquet export needs it
+pa = lazy.optional("pyarrow")
+pq = lazy.optional("pyarrow.parquet")
+
+
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+
+# Consolidated files go in their own folder inside output_excel, so they end
+# up in outputs.zip without clashing with the per-PDF workbooks
+EXPORT_DIR_NAME = "consolidated"
+EXPORT_FILE_STEM = "invoices"
+
+# Document-level fields repeated on every invoice row
+DOCUMENT_COLUMNS = ["Company Code", "Legal Entity Name", "Vendor No", "Vendor Name", "Subject"]
+SOURCE_COLUMN = "Source File"
+AMOUNT_COLUMN = "Invoice Amount"
+
+PARQUET_BATCH_ROWS = 10000
+
+
+def available_formats() -> tuple:
+    return tuple(f for f in EXPORT_FORMATS if f != "parquet" or pa is not None)
+
+
+def parse_formats(value) -> list:
+    """'xlsx,csv' or ['xlsx', 'csv'] → validated, de-duplicated list; raises ValueError."""
+    if not value:
+        return []
+    items = value.split(",") if isinstance(value, str) else value
+    formats = list(dict.fromkeys(f.strip().lower() for f in items if f.strip()))
+    unknown = [f for f in formats if f not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown export format(s): {', '.join(unknown)} (choose from {', '.join(EXPORT_FORMATS)})")
+    if "parquet" in formats and pa is None:
+        raise ValueError("Parquet export needs pyarrow installed")
+    return formats
+
+
+def to_amount(value):
+    """'1,234.50' → 1234.5; anything that is not a number → None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+def is_total_row(invoice: dict) -> bool:
+    return any(str(v).strip().lower() == "total" for v in invoice.values())
+
+
+def iter_invoice_rows(json_folder, invoice_columns: list, table_key: str):
+    """
+    Yields one list of values per invoice, in column order, reading the
+    JSON files one at a time. Total rows are per-statement sums and are left out.
+    """
+    for json_file in sorted(os.listdir(json_folder)):
+        if not json_file.lower().endswith(".json"):
+            continue
+        with open(os.path.join(json_folder, json_file), "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        source = os.path.splitext(json_file)[0] + ".pdf"
+        document = [data.get(c, "") for c in DOCUMENT_COLUMNS]
+        for invoice in data.get(table_key) or []:
+            if not isinstance(invoice, dict) or is_total_row(invoice):
+                continue
+            row = [invoice.get(c) for c in invoice_columns]
+            yield [source] + document + row
+
+
+# ---------------------------------------------
+# WRITERS (all fed from the same pass)
+# ---------------------------------------------
+
+class _XlsxWriter:
+    def __init__(self, path, columns):
+        self.path = path
+        self.wb = openpyxl.Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("Invoices")
+        self.ws.freeze_panes = "A2"
+        header = []
+        for name in columns:
+            cell = openpyxl_cell.WriteOnlyCell(self.ws, value=name)
+            cell.font = openpyxl_styles.Font(bold=True)
+            header.append(cell)
+        self.ws.append(header)
+
+    def write(self, row):
+        self.ws.append(row)
+
+    def close(self):
+        self.wb.save(self.path)
+
+
+class _CsvWriter:
+    def __init__(self, path, columns):
+        # utf-8-sig so Excel opens non-ASCII vendor names correctly
+        self.file = open(path, "w", encoding="utf-8-sig", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, row):
+        self.writer.writerow(["" if v is None else v for v in row])
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.schema = pa.schema([
+            (name, pa.float64() if name == AMOUNT_COLUMN else pa.string()) for name in columns
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch = []
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= PARQUET_BATCH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if not self.batch:
+            return
+        arrays = []
+        for i, name in enumerate(self.columns):
+            values = [r[i] for r in self.batch]
+            if name == AMOUNT_COLUMN:
+                values = [to_amount(v) for v in values]
+            else:
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(pa.array(values, type=self.schema.field(name).type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.batch = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+WRITERS = {"xlsx": _XlsxWriter, "csv": _CsvWriter, "parquet": _ParquetWriter}
+
+
+def export_consolidated(json_folder, output_dir, formats: list, invoice_columns: list, table_key: str) -> dict:
+    """
+    Writes <output_dir>/consolidated/invoices.<format> for each requested
+    format in a single pass over the JSON records.
+
+    Returns {"rows": n, "files": {format: path}}.
+    """
+    export_dir = Path(output_dir) / EXPORT_DIR_NAME
+    export_dir.mkdir(parents=True, exist_ok=True)
+
+    columns = [SOURCE_COLUMN] + DOCUMENT_COLUMNS + list(invoice_columns)
+    amount_index = columns.index(AMOUNT_COLUMN) if AMOUNT_COLUMN in columns else None
+
+    paths = {f: export_dir / f"{EXPORT_FILE_STEM}.{f}" for f in formats}
+    writers = []
+    try:
+        for f in formats:
+            writers.append(WRITERS[f](paths[f], columns))
+
+        rows = 0
+        for row in iter_invoice_rows(json_folder, invoice_columns, table_key):
+            if amount_index is not None:
+                # Numbers in every format; unparseable text stays as-is (null in Parquet)
+                amount = to_amount(row[amount_index])
+                if amount is not None:
+                    row[amount_index] = amount
+            for writer in writers:
+                writer.write(row)
+            rows += 1
+    finally:
+        for writer in writers:
+            writer.close()
+
+    return {"rows": rows, "files": {f: str(p) for f, p in paths.items()}}
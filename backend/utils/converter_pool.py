@@ -0,0 +1,427 @@
+"""
+utils/converter_pool.py
+Supervised worker processes holding warm Docling converters, recycled before they grow too large
+"""
+
+import os
+import sys
+import time
+import queue
+import pickle
+import threading
+import multiprocessing
+from concurrent.futures import Future
+
+try:
+    import resource
+except ImportError:
+    # Windows: peak memory then comes from /proc only, i.e. not at all
+    resource = None
+
+from utils import metrics
+from utils.markdown_chunker import PAGE_BREAK
+from utils.log import get_logger
+
+log = get_logger("converter_pool")
+
+
+# Documents a worker converts before a fresh one replaces it (0 = never)
+CONVERTER_MAX_DOCUMENTS = int(os.getenv("CONVERTER_MAX_DOCUMENTS", "200"))
+
+# Resident memory (MB) after which a worker is replaced once its current document is done (0 = no limit)
+CONVERTER_MAX_RSS_MB = int(os.getenv("CONVERTER_MAX_RSS_MB", "4096"))
+
+# A document still converting after this many seconds fails and its worker is replaced (0 = no limit)
+CONVERTER_DOCUMENT_TIMEOUT = float(os.getenv("CONVERTER_DOCUMENT_TIMEOUT", "0"))
+
+# Seconds a new worker gets to load its models, and a retired one to exit
+WORKER_START_TIMEOUT = 600
+WORKER_STOP_TIMEOUT = 30
+
+MB = 1024 * 1024
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process died (e.g. killed for running out of memory) before answering."""
+
+
+def memory_usage() -> dict:
+    """Resident and peak resident memory of this process, in bytes."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {"rss": int(fields["VmRSS"].split()[0]) * 1024, "peak_rss": int(fields["VmHWM"].split()[0]) * 1024}
+    except (OSError, KeyError, ValueError):
+        if resource is None:
+            return {"rss": 0, "peak_rss": 0}
+        # ru_maxrss is in KB on Linux, bytes on macOS; no current RSS, so use the peak for both
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        return {"rss": peak, "peak_rss": peak}
+
+
+# ---------------------------------------------
+# WORKER PROCESS SIDE
+# ---------------------------------------------
+# Each worker builds one DocumentConverter when it starts and keeps it
+# (and its layout/table models) loaded for every document it converts.
+
+_converter = None
+_load_seconds = 0.0
+
+
+def _init_worker():
+    """Load Docling and its PDF pipeline models once per worker process."""
+    global _converter, _load_seconds
+
+    start = time.perf_counter()
+    from docling.document_converter import DocumentConverter
+
+    _converter = DocumentConverter()
+    try:
+        from docling.datamodel.base_models import InputFormat
+        _converter.initialize_pipeline(InputFormat.PDF)
+    except (ImportError, AttributeError):
+        # Older Docling: models load on the first convert() instead
+        pass
+    _load_seconds = time.perf_counter() - start
+
+
+def _take_load_seconds() -> float:
+    """Return the model load time once, so it is only counted once per worker."""
+    global _load_seconds
+    seconds, _load_seconds = _load_seconds, 0.0
+    return seconds
+
+
+def _warmup() -> dict:
+    return {"pid": os.getpid(), "load_seconds": _take_load_seconds(), "convert_seconds": 0.0}
+
+
+def _convert(pdf_path: str, txt_path: str) -> dict:
+    start = time.perf_counter()
+    result = _converter.convert(pdf_path)
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write(result.document.export_to_markdown(page_break_placeholder=PAGE_BREAK))
+
+    return {
+        "pid": os.getpid(),
+        "load_seconds": _take_load_seconds(),
+        "convert_seconds": time.perf_counter() - start,
+    }
+
+
+def _portable(error: Exception) -> Exception:
+    """The exception itself if it survives pickling, else a RuntimeError with its text."""
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _worker_main(conn):
+    """
+    Worker loop: load the models, answer ("ready", timing, memory), then
+    for every (pdf_path, txt_path) received answer ("ok", timing, memory)
+    or ("error", exception, memory). None (or a closed pipe) ends it.
+    """
+    try:
+        _init_worker()
+    except Exception as e:
+        conn.send(("error", _portable(e), memory_usage()))
+        return
+    conn.send(("ready", _warmup(), memory_usage()))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        try:
+            conn.send(("ok", _convert(*job), memory_usage()))
+        except Exception as e:
+            conn.send(("error", _portable(e), memory_usage()))
+
+
+# ---------------------------------------------
+# SERVER SIDE
+# ---------------------------------------------
+
+class _Slot:
+    """One worker position of the pool and the process currently filling it."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.documents = 0          # converted by the current process
+        self.rss = 0
+        self.peak_rss = 0           # of the current process
+        self.busy = False
+        self.error = None           # why the last start failed
+        self.ready = threading.Event()
+
+
+class ConverterPool:
+    """
+    Pool of pre-initialised Docling converters, one process per slot, each
+    watched by a supervisor thread in this process.
+
+    submit() returns a Future that resolves to
+    {"pid", "load_seconds", "convert_seconds", "peak_rss_mb"} once the
+    markdown is written.
+
+    A worker is replaced by a fresh one (models loaded before it takes
+    work) after max_documents documents, or once its resident memory
+    passes max_rss_mb. A worker that dies mid-document fails only that
+    document; the next one gets a new worker.
+    """
+
+    def __init__(self, size: int, max_documents: int = CONVERTER_MAX_DOCUMENTS,
+                 max_rss_mb: int = CONVERTER_MAX_RSS_MB, document_timeout: float = CONVERTER_DOCUMENT_TIMEOUT):
+        self.size = size
+        self.max_documents = max_documents
+        self.max_rss_mb = max_rss_mb
+        self.document_timeout = document_timeout or None
+        # "spawn": torch/Docling are not fork-safe once threads exist
+        self._context = multiprocessing.get_context("spawn")
+        self._jobs = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._stats = {
+            "workers": size,
+            "documents": 0,
+            "errors": 0,
+            "crashes": 0,
+            "recycled": 0,
+            "model_load_seconds": 0.0,
+            "convert_seconds": 0.0,
+            "peak_rss_mb": 0.0,
+        }
+        self._slots = [_Slot(i) for i in range(size)]
+        self._threads = [
+            threading.Thread(target=self._supervise, args=(slot,), name=f"converter-{slot.index}", daemon=True)
+            for slot in self._slots
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def warmup(self):
+        """Wait until every worker has its models loaded."""
+        for slot in self._slots:
+            slot.ready.wait()
+            if slot.process is None:
+                raise RuntimeError(f"Converter worker {slot.index} could not start: {slot.error}")
+
+    def submit(self, pdf_path: str, txt_path: str):
+        if self._closed:
+            raise RuntimeError("Converter pool is shut down")
+        future = Future()
+        self._jobs.put((future, str(pdf_path), str(txt_path)))
+        return future
+
+    def convert(self, pdf_path: str, txt_path: str) -> dict:
+        return self.submit(pdf_path, txt_path).result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "processes": [{
+                    "slot": s.index,
+                    "pid": s.process.pid if s.process is not None else None,
+                    "busy": s.busy,
+                    "documents": s.documents,
+                    "rss_mb": round(s.rss / MB, 1),
+                    "peak_rss_mb": round(s.peak_rss / MB, 1),
+                } for s in self._slots],
+            }
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[0].cancel()
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    # ---- supervisor thread, one per slot ----
+
+    def _supervise(self, slot: _Slot):
+        while True:
+            if slot.process is None and not self._closed:
+                self._start(slot)
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, pdf_path, txt_path = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            if slot.process is None:
+                future.set_exception(RuntimeError(f"Converter worker could not start: {slot.error}"))
+                continue
+            self._run(slot, future, pdf_path, txt_path)
+        self._stop(slot)
+
+    def _receive(self, slot: _Slot, timeout: float = None):
+        """Next message from the slot's worker; WorkerCrashed if it dies, TimeoutError if it takes too long."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not slot.conn.poll(0.5):
+            if not slot.process.is_alive():
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"no answer from converter worker {slot.process.pid} in {timeout:.0f}s")
+        try:
+            return slot.conn.recv()
+        except (EOFError, OSError):
+            slot.process.join(1)
+            code = slot.process.exitcode
+            reason = f"killed by signal {-code}" if code is not None and code < 0 else f"exit code {code}"
+            raise WorkerCrashed(f"converter worker {slot.process.pid} died ({reason})")
+
+    def _start(self, slot: _Slot):
+        """Start a worker in the slot and wait for its models to load."""
+        parent, child = self._context.Pipe()
+        slot.process = self._context.Process(
+            target=_worker_main, args=(child,), name=f"docling-worker-{slot.index}", daemon=True)
+        slot.conn = parent
+        slot.documents = 0
+        slot.peak_rss = 0
+        try:
+            slot.process.start()
+            child.close()
+            kind, payload, memory = self._receive(slot, WORKER_START_TIMEOUT)
+            if kind != "ready":
+                raise payload
+        except Exception as e:
+            slot.error = str(e)
+            log.error(f"✗ Converter worker {slot.index} could not start: {e}")
+            self._kill(slot)
+        else:
+            slot.error = None
+            self._record_memory(slot, memory)
+            with self._lock:
+                self._stats["model_load_seconds"] += payload["load_seconds"]
+            log.info(f"✓ Converter worker {payload['pid']} ready in {payload['load_seconds']:.1f}s "
+                     f"({slot.rss / MB:.0f} MB)", extra={"pid": payload["pid"]})
+        finally:
+            slot.ready.set()
+
+    def _run(self, slot: _Slot, future: Future, pdf_path: str, txt_path: str):
+        pid = slot.process.pid
+        slot.busy = True
+        try:
+            slot.conn.send((pdf_path, txt_path))
+            kind, payload, memory = self._receive(slot, self.document_timeout)
+        except Exception as e:
+            # Only this document fails; the slot starts a new worker before its next one
+            reason = "timeout" if isinstance(e, TimeoutError) else "crash"
+            with self._lock:
+                self._stats["crashes"] += 1
+                self._stats["errors"] += 1
+            metrics.CONVERTER_RECYCLED.inc(reason=reason)
+            log.error(f"✗ Converter worker {pid} lost while converting {os.path.basename(pdf_path)}: {e}",
+                      extra={"pid": pid, "documents": slot.documents, "peak_rss_mb": round(slot.peak_rss / MB)})
+            self._kill(slot)
+            future.set_exception(e if isinstance(e, (WorkerCrashed, TimeoutError)) else WorkerCrashed(str(e)))
+            return
+        finally:
+            slot.busy = False
+
+        slot.documents += 1
+        self._record_memory(slot, memory)
+        if kind == "ok":
+            with self._lock:
+                self._stats["documents"] += 1
+                self._stats["model_load_seconds"] += payload["load_seconds"]
+                self._stats["convert_seconds"] += payload["convert_seconds"]
+            future.set_result({**payload, "peak_rss_mb": round(slot.peak_rss / MB, 1)})
+        else:
+            with self._lock:
+                self._stats["errors"] += 1
+            future.set_exception(payload)
+
+        reason = self._recycle_reason(slot)
+        if reason is not None:
+            log.info(f"↻ Replacing converter worker {pid} after {slot.documents} document(s), "
+                     f"{slot.peak_rss / MB:.0f} MB peak RSS ({reason})",
+                     extra={"pid": pid, "documents": slot.documents, "peak_rss_mb": round(slot.peak_rss / MB)})
+            metrics.CONVERTER_RECYCLED.inc(reason=reason)
+            with self._lock:
+                self._stats["recycled"] += 1
+            self._stop(slot)
+
+    def _recycle_reason(self, slot: _Slot):
+        if self.max_rss_mb and slot.rss >= self.max_rss_mb * MB:
+            return "memory"
+        if self.max_documents and slot.documents >= self.max_documents:
+            return "documents"
+        return None
+
+    def _record_memory(self, slot: _Slot, memory: dict):
+        with self._lock:
+            slot.rss = memory["rss"]
+            slot.peak_rss = max(slot.peak_rss, memory["peak_rss"])
+            self._stats["peak_rss_mb"] = max(self._stats["peak_rss_mb"], round(slot.peak_rss / MB, 1))
+        metrics.CONVERTER_RSS_BYTES.set(slot.rss, slot=slot.index)
+        metrics.CONVERTER_PEAK_RSS_BYTES.set(slot.peak_rss, slot=slot.index)
+
+    def _stop(self, slot: _Slot):
+        """Let the slot's worker exit after its current document (killed if it does not)."""
+        if slot.process is None:
+            return
+        try:
+            slot.conn.send(None)
+        except OSError:
+            pass
+        slot.process.join(WORKER_STOP_TIMEOUT)
+        self._kill(slot)
+
+    def _kill(self, slot: _Slot):
+        if slot.process is not None:
+            if slot.process.is_alive():
+                slot.process.kill()
+            slot.process.join()
+        if slot.conn is not None:
+            slot.conn.close()
+        slot.process = None
+        slot.conn = None
+        slot.rss = 0
+
+
+_POOL = None
+
+
+def start_pool(size: int) -> ConverterPool:
+    """Start the shared pool (no-op if already running)."""
+    global _POOL
+    if _POOL is None:
+        pool = ConverterPool(size)
+        try:
+            pool.warmup()
+        except Exception:
+            pool.shutdown()
+            raise
+        _POOL = pool
+        log.info(f"✓ Docling converter pool ready: {size} worker(s)")
+    return _POOL
+
+
+def get_pool():
+    """Return the shared pool, or None when conversions run in-process."""
+    return _POOL
+
+
+def shutdown_pool():
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown()
+        _POOL = None
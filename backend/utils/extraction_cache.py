@@ -0,0 +1,156 @@
+"""
+utils/extraction_cache.py
+SQLite cache of AI extraction results, keyed by markdown + prompts + deployment
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "1") == "1"
+EXTRACTION_CACHE_PATH = Path(os.getenv(
+    "EXTRACTION_CACHE_PATH",
+    Path(__file__).resolve().parent.parent / "cache" / "extraction.sqlite3",
+))
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def prompt_hash(system_prompt: str, user_prompt_template: str, schema: dict,
+                deployment: str, temperature: float, chunking: dict = None) -> str:
+    """Everything except the document itself; any change here invalidates entries."""
+    parts = {
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt_template,
+        "schema": schema,
+        "deployment": deployment,
+        "temperature": temperature,
+        "chunking": chunking,
+    }
+    return sha256_text(json.dumps(parts, sort_keys=True, ensure_ascii=False))
+
+
+def cache_key(markdown_content: str, current_prompt_hash: str) -> str:
+    return sha256_text(current_prompt_hash + "\n" + sha256_text(markdown_content))
+
+
+class ExtractionCache:
+    """
+    One row per (markdown, prompt configuration). Rows written under an
+    older prompt configuration are never matched again and can be purged.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS extractions (
+                    key TEXT PRIMARY KEY,
+                    prompt_hash TEXT NOT NULL,
+                    deployment TEXT,
+                    result TEXT NOT NULL,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    created_at REAL NOT NULL,
+                    last_hit_at REAL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_extractions_prompt ON extractions(prompt_hash)")
+
+    def _connect(self):
+        # A short-lived connection per call keeps this safe across pipeline threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM extractions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE extractions SET hits = hits + 1, last_hit_at = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+
+        with self._lock:
+            self._stats["hits" if row is not None else "misses"] += 1
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, current_prompt_hash: str, deployment: str, result: dict, usage: dict):
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO extractions
+                    (key, prompt_hash, deployment, result, prompt_tokens, completion_tokens, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    key, current_prompt_hash, deployment,
+                    json.dumps(result, ensure_ascii=False),
+                    usage.get("prompt_tokens"), usage.get("completion_tokens"),
+                    time.time(),
+                ),
+            )
+
+    def stats(self, current_prompt_hash: str = None) -> dict:
+        with self._connect() as conn:
+            entries, tokens_saved = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(hits * (COALESCE(prompt_tokens, 0) + COALESCE(completion_tokens, 0))), 0) FROM extractions"
+            ).fetchone()
+            current = conn.execute(
+                "SELECT COUNT(*) FROM extractions WHERE prompt_hash = ?", (current_prompt_hash,)
+            ).fetchone()[0]
+            by_deployment = dict(conn.execute(
+                "SELECT COALESCE(deployment, ''), COUNT(*) FROM extractions GROUP BY deployment"
+            ).fetchall())
+
+        with self._lock:
+            counters = dict(self._stats)
+        return {
+            **counters,
+            "entries": entries,
+            "current_prompt_entries": current,
+            "stale_entries": entries - current,
+            "tokens_saved": tokens_saved,
+            "by_deployment": by_deployment,
+            "prompt_hash": current_prompt_hash,
+            "size_bytes": self.path.stat().st_size if self.path.exists() else 0,
+        }
+
+    def purge(self, keep_prompt_hash: str = None) -> int:
+        """Delete every entry, or only the ones not matching keep_prompt_hash."""
+        with self._connect() as conn:
+            if keep_prompt_hash is None:
+                deleted = conn.execute("DELETE FROM extractions").rowcount
+            else:
+                deleted = conn.execute(
+                    "DELETE FROM extractions WHERE prompt_hash != ?", (keep_prompt_hash,)
+                ).rowcount
+        with self._connect() as conn:
+            conn.execute("VACUUM")
+        return deleted
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Return the shared extraction cache, or None when caching is disabled."""
+    global _CACHE
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ExtractionCache(EXTRACTION_CACHE_PATH)
+        return _CACHE
@@ -3,9 +3,27 @@ utils/file_manager.py
 Helper functions for directory and file management
 """
 
+import os
+import hashlib
 from pathlib import Path
 from typing import List
-from fastapi import UploadFile
+
+import aiofiles
+from fastapi import HTTPException
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+PDF_MAGIC = b"%PDF-"
+
+# Upload limits (bytes)
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(500 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(2 * 1024 * 1024 * 1024)))
 
 
 def create_task_directories(base_dir: Path, task_id: str) -> Path:
@@ -29,17 +47,169 @@ def create_task_directories(base_dir: Path, task_id: str) -> Path:
     return task_dir
 
 
-async def save_uploaded_files(files: List[UploadFile], target_dir: Path):
+def upload_file_name(raw: bytes) -> str:
+    """
+    Base name of an uploaded file (client paths dropped). 400 for names
+    that are empty, '.'/'..' or not *.pdf: the pipeline only picks up .pdf files.
+    """
+    file_name = Path(raw.decode("utf-8", "replace").replace("\\", "/")).name
+    if not file_name or file_name in (".", ".."):
+        raise HTTPException(status_code=400, detail="Uploaded file has no name")
+    if not file_name.lower().endswith(".pdf") or file_name.lower() == ".pdf":
+        raise HTTPException(status_code=400, detail=f"{file_name}: only .pdf files can be uploaded")
+    return file_name
+
+
+def unique_name(file_name: str, taken: set) -> str:
+    """'a.pdf' → 'a (2).pdf' when 'a.pdf' was already uploaded in the same request."""
+    name, n = file_name, 1
+    while name.lower() in taken:
+        n += 1
+        name = f"{Path(file_name).stem} ({n}){Path(file_name).suffix}"
+    taken.add(name.lower())
+    return name
+
+
+class UploadedFile:
+    """One file part being written: PDF check, size limit and SHA-256 while its bytes arrive."""
+
+    def __init__(self, file_name: str, path: Path):
+        self.file_name = file_name
+        self.path = path
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b""        # first bytes, held back until the PDF header was checked
+        self.checked = False
+        self.file = None
+
+    async def open(self):
+        self.file = await aiofiles.open(self.path, "wb")
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > MAX_UPLOAD_FILE_BYTES:
+            raise HTTPException(status_code=413, detail=f"{self.file_name} exceeds {MAX_UPLOAD_FILE_BYTES} bytes")
+        if not self.checked:
+            self.head += data
+            # PDF header must appear within the first 1024 bytes
+            if PDF_MAGIC not in self.head[:1024] and len(self.head) < 1024:
+                return
+            data, self.head = self.head, b""
+            self._check(data)
+        self.digest.update(data)
+        await self.file.write(data)
+
+    async def close(self) -> dict:
+        if not self.checked:
+            self._check(self.head)
+            self.digest.update(self.head)
+            await self.file.write(self.head)
+        await self.file.close()
+        return {"filename": self.file_name, "size": self.size, "sha256": self.digest.hexdigest()}
+
+    def _check(self, head: bytes):
+        if PDF_MAGIC not in head[:1024]:
+            raise HTTPException(status_code=415, detail=f"{self.file_name} is not a PDF")
+        self.checked = True
+
+
+async def stream_uploaded_files(request, target_dir: Path, field: str = "files") -> List[dict]:
     """
-    Save uploaded files to target directory
+    Parse a multipart/form-data upload straight from the request body into
+    target_dir, without spooling it to a temporary file first
+
+    - reads the body as it arrives (chunked transfer encoding included)
+    - rejects non-PDF content from its first bytes (415)
+    - enforces per-file and per-request size limits while reading (413),
+      so a bad upload is refused without receiving the rest of it
+    - computes each file's SHA-256 while writing (dedup / caching)
+    - a file name repeated within the request is saved as 'name (2).pdf'
+
+    Only parts of the given form field are saved. Returns
+    [{"filename", "size", "sha256"}] in upload order.
+    On any rejection every file written so far is removed.
     """
-    for file in files:
-        file_path = target_dir / file.filename
-        
-        # Write file in chunks
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        # Reset file pointer for potential reuse
-        await file.seek(0)
\ No newline at end of file
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    # The parser's callbacks are synchronous: they queue events, written after each chunk
+    events = []
+    header = {"field": b"", "value": b"", "headers": {}}
+
+    def on_part_begin():
+        header["headers"] = {}
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        header["headers"][header["field"].lower()] = header["value"]
+        header["field"] = header["value"] = b""
+
+    def on_headers_finished():
+        events.append(("begin", header["headers"]))
+
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    saved = []
+    written_paths = []
+    taken = set()
+    part = None            # UploadedFile being written; other form fields are skipped
+    request_bytes = 0
+
+    try:
+        async for chunk in request.stream():
+            request_bytes += len(chunk)
+            if request_bytes > MAX_UPLOAD_REQUEST_BYTES:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_REQUEST_BYTES} bytes")
+            try:
+                parser.write(chunk)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Malformed multipart upload: {e}")
+
+            for event, value in events:
+                if event == "begin":
+                    _, options = parse_options_header(value.get(b"content-disposition", b""))
+                    if options.get(b"name", b"").decode("latin-1") != field:
+                        continue
+                    file_name = unique_name(upload_file_name(options.get(b"filename", b"")), taken)
+                    part = UploadedFile(file_name, target_dir / file_name)
+                    written_paths.append(part.path)
+                    await part.open()
+                elif event == "data" and part is not None:
+                    await part.write(value)
+                elif event == "end" and part is not None:
+                    saved.append(await part.close())
+                    part = None
+            events.clear()
+
+        if part is not None:
+            raise HTTPException(status_code=400, detail="Upload ended in the middle of a file")
+        if not saved:
+            raise HTTPException(status_code=400, detail="No files uploaded")
+    except Exception:
+        if part is not None and part.file is not None:
+            await part.file.close()
+        for path in written_paths:
+            path.unlink(missing_ok=True)
+        raise
+
+    return saved
@@ -0,0 +1,257 @@
+"""
+utils/invoice_store.py
+Indexed SQLite store of every extracted invoice across tasks: lookups, range filters, duplicate detection
+"""
+
+import os
+import re
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from utils.consolidated_export import to_amount, is_total_row
+
+
+INVOICE_STORE_ENABLED = os.getenv("INVOICE_STORE_ENABLED", "1") == "1"
+# Kept next to the task database: /cleanup removes task folders, not this
+INVOICE_STORE_PATH = Path(os.getenv(
+    "INVOICE_STORE_PATH",
+    Path(__file__).resolve().parent.parent / "uploads" / "invoices.sqlite3",
+))
+
+DATE_FORMATS = ("%d-%m-%Y", "%d.%m.%Y", "%d/%m/%Y", "%Y-%m-%d", "%d-%m-%y", "%d.%m.%y", "%d/%m/%y")
+
+# Query results per call at most
+MAX_QUERY_LIMIT = 1000
+
+COLUMNS = ("id", "task_id", "source_file", "company_code", "legal_entity", "vendor_no", "vendor_name",
+           "invoice_no", "invoice_date", "due_date", "amount", "currency", "po_no", "remarks", "created_at")
+
+
+def normalize_key(value) -> str:
+    """'INV-00 12/a' → 'INV0012A': what two spellings of one id have in common."""
+    return re.sub(r"[^0-9A-Z]", "", str(value or "").upper())
+
+
+def iso_date(value):
+    """'31-01-2024', '31.01.2024', '2024-01-31', ... → '2024-01-31'; None if not a date."""
+    text = str(value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def vendor_key(vendor_no, vendor_name) -> str:
+    """Vendor number when the statement has one, else the vendor name."""
+    return "no:" + normalize_key(vendor_no) if normalize_key(vendor_no) else "name:" + normalize_key(vendor_name)
+
+
+class InvoiceStore:
+    """
+    One row per invoice of every extracted document. A document's rows are
+    replaced whenever it is extracted again (re-runs, retries), so the store
+    always holds the latest result of each (task, file).
+
+    Duplicates: the same vendor and invoice number in another document
+    ("exact"), or the same vendor, date and amount under another invoice
+    number ("possible").
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS invoices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL,
+                    source_file TEXT NOT NULL,
+                    company_code TEXT,
+                    legal_entity TEXT,
+                    vendor_no TEXT,
+                    vendor_name TEXT,
+                    vendor_key TEXT NOT NULL,
+                    vendor_no_key TEXT NOT NULL,
+                    vendor_name_key TEXT NOT NULL,
+                    invoice_no TEXT,
+                    invoice_no_key TEXT NOT NULL,
+                    invoice_date TEXT,
+                    due_date TEXT,
+                    amount REAL,
+                    currency TEXT,
+                    po_no TEXT,
+                    remarks TEXT,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_invoices_document ON invoices(task_id, source_file);
+                CREATE INDEX IF NOT EXISTS idx_invoices_vendor_invoice ON invoices(vendor_key, invoice_no_key);
+                CREATE INDEX IF NOT EXISTS idx_invoices_vendor_date ON invoices(vendor_key, invoice_date, amount);
+                CREATE INDEX IF NOT EXISTS idx_invoices_vendor_no ON invoices(vendor_no_key);
+                CREATE INDEX IF NOT EXISTS idx_invoices_vendor_name ON invoices(vendor_name_key);
+                CREATE INDEX IF NOT EXISTS idx_invoices_invoice_no ON invoices(invoice_no_key);
+                CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(invoice_date);
+                CREATE INDEX IF NOT EXISTS idx_invoices_amount ON invoices(amount);
+            """)
+
+    def _connect(self):
+        # A short-lived connection per call keeps this safe across pipeline threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    # ---- writes ----
+
+    def index(self, task_id: str, source_file: str, data: dict, table_key: str) -> list:
+        """
+        Replace the document's rows with the invoices of one extraction
+        result; returns the duplicates they have elsewhere (see duplicates()).
+        """
+        vendor_no, vendor_name = data.get("Vendor No", ""), data.get("Vendor Name", "")
+        document = (
+            task_id, source_file, data.get("Company Code", ""), data.get("Legal Entity Name", ""),
+            vendor_no, vendor_name, vendor_key(vendor_no, vendor_name),
+            normalize_key(vendor_no), normalize_key(vendor_name),
+        )
+        rows = []
+        for invoice in data.get(table_key) or []:
+            if not isinstance(invoice, dict) or is_total_row(invoice):
+                continue
+            invoice_no = str(invoice.get("Invoice No") or "")
+            rows.append(document + (
+                invoice_no, normalize_key(invoice_no),
+                iso_date(invoice.get("Invoice Date")), iso_date(invoice.get("Invoice Due Date")),
+                to_amount(invoice.get("Invoice Amount")),
+                str(invoice.get("Invoice Currency") or "").strip().upper(),
+                str(invoice.get("Purchase order No. if available") or ""),
+                str(invoice.get("Remarks if any") or ""),
+                time.time(),
+            ))
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM invoices WHERE task_id = ? AND source_file = ?", (task_id, source_file))
+            conn.executemany(
+                """
+                INSERT INTO invoices (task_id, source_file, company_code, legal_entity, vendor_no, vendor_name,
+                    vendor_key, vendor_no_key, vendor_name_key, invoice_no, invoice_no_key, invoice_date,
+                    due_date, amount, currency, po_no, remarks, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+        return self.duplicates(task_id, source_file)
+
+    # ---- reads ----
+
+    def duplicates(self, task_id: str, source_file: str = None) -> list:
+        """
+        [{"kind", "source_file", "invoice_no", "vendor_name", "invoice_date",
+        "amount", "currency", "seen_in": {"task_id", "source_file",
+        "invoice_no", "invoice_date", "amount"}}] for the task's invoices
+        (or one document's) that also appear in another document.
+        """
+        document_filter = "AND n.source_file = ?" if source_file is not None else ""
+        params = (task_id,) + ((source_file,) if source_file is not None else ())
+        other = "NOT (o.task_id = n.task_id AND o.source_file = n.source_file)"
+        queries = (
+            ("exact", f"""
+                o.vendor_key = n.vendor_key AND o.invoice_no_key = n.invoice_no_key AND {other}
+                WHERE n.task_id = ? {document_filter} AND n.invoice_no_key != ''"""),
+            ("possible", f"""
+                o.vendor_key = n.vendor_key AND o.invoice_date = n.invoice_date AND o.amount = n.amount
+                AND o.invoice_no_key != n.invoice_no_key AND {other}
+                WHERE n.task_id = ? {document_filter} AND n.invoice_date IS NOT NULL AND n.amount IS NOT NULL"""),
+        )
+        found = []
+        with self._connect() as conn:
+            for kind, condition in queries:
+                for row in conn.execute(f"""
+                    SELECT n.source_file, n.invoice_no, n.vendor_name, n.invoice_date, n.amount, n.currency,
+                           o.task_id, o.source_file, o.invoice_no, o.invoice_date, o.amount
+                    FROM invoices n JOIN invoices o ON {condition}
+                    ORDER BY n.source_file, n.id, o.id
+                """, params):
+                    found.append({
+                        "kind": kind, "source_file": row[0], "invoice_no": row[1], "vendor_name": row[2],
+                        "invoice_date": row[3], "amount": row[4], "currency": row[5],
+                        "seen_in": {"task_id": row[6], "source_file": row[7], "invoice_no": row[8],
+                                    "invoice_date": row[9], "amount": row[10]},
+                    })
+        return found
+
+    def query(self, vendor: str = None, invoice_no: str = None, task_id: str = None, currency: str = None,
+              date_from: str = None, date_to: str = None, amount_min: float = None, amount_max: float = None,
+              limit: int = 100, offset: int = 0) -> dict:
+        """
+        Invoices matching every given filter, newest first. vendor matches the
+        vendor number or name, invoice_no the number, both ignoring case and
+        punctuation; dates in any of DATE_FORMATS. Raises ValueError on bad dates.
+        """
+        where, params = [], []
+        if vendor:
+            where.append("(vendor_no_key = ? OR vendor_name_key = ?)")
+            params += [normalize_key(vendor)] * 2
+        if invoice_no:
+            where.append("invoice_no_key = ?")
+            params.append(normalize_key(invoice_no))
+        if task_id:
+            where.append("task_id = ?")
+            params.append(task_id)
+        if currency:
+            where.append("currency = ?")
+            params.append(currency.strip().upper())
+        for value, op in ((date_from, ">="), (date_to, "<=")):
+            if value:
+                date = iso_date(value)
+                if date is None:
+                    raise ValueError(f"Not a date: {value}")
+                where.append(f"invoice_date {op} ?")
+                params.append(date)
+        if amount_min is not None:
+            where.append("amount >= ?")
+            params.append(amount_min)
+        if amount_max is not None:
+            where.append("amount <= ?")
+            params.append(amount_max)
+
+        clause = ("WHERE " + " AND ".join(where)) if where else ""
+        limit = max(1, min(int(limit), MAX_QUERY_LIMIT))
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM invoices {clause}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM invoices {clause} ORDER BY id DESC LIMIT ? OFFSET ?",
+                params + [limit, max(0, int(offset))],
+            ).fetchall()
+        return {"total": total, "items": [dict(zip(COLUMNS, row)) for row in rows]}
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            invoices, documents, tasks, vendors = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT task_id || '/' || source_file), COUNT(DISTINCT task_id), "
+                "COUNT(DISTINCT vendor_key) FROM invoices"
+            ).fetchone()
+        return {
+            "invoices": invoices,
+            "documents": documents,
+            "tasks": tasks,
+            "vendors": vendors,
+            "size_bytes": self.path.stat().st_size if self.path.exists() else 0,
+        }
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store():
+    """Return the shared invoice store, or None when it is disabled."""
+    global _STORE
+    if not INVOICE_STORE_ENABLED:
+        return None
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = InvoiceStore(INVOICE_STORE_PATH)
+        return _STORE
@@ -0,0 +1,49 @@
+"""
+utils/lazy.py
+Heavy dependencies imported on first use, so the API process starts without loading them
+"""
+
+import importlib
+import importlib.util
+import threading
+
+
+class LazyModule:
+    """Stands in for a module and imports it the first time one of its attributes is used."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Import the module now (e.g. while a worker warms up) and return it."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r} ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+def module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def optional(name: str):
+    """LazyModule for an optional dependency, or None when it is not installed."""
+    try:
+        # Only the top-level package: a submodule's spec would import its parent
+        found = importlib.util.find_spec(name.partition(".")[0]) is not None
+    except (ImportError, ValueError):
+        found = False
+    return LazyModule(name) if found else None
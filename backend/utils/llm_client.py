@@ -0,0 +1,177 @@
+"""
+utils/llm_client.py
+Rate limiting, retry/backoff and token estimates for Azure OpenAI calls
+"""
+
+import os
+import time
+import random
+import threading
+
+from utils.log import get_logger
+
+log = get_logger("llm")
+
+
+# Deployment quota (Azure portal → Deployments → Rate limit)
+AZURE_RPM = int(os.getenv("AZURE_RPM", "60"))
+AZURE_TPM = int(os.getenv("AZURE_TPM", "60000"))
+
+# Retry policy for throttled / transient errors
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "6"))
+AI_BACKOFF_BASE = float(os.getenv("AI_BACKOFF_BASE", "1.0"))
+AI_BACKOFF_MAX = float(os.getenv("AI_BACKOFF_MAX", "60.0"))
+
+# Completion tokens reserved up front, corrected from response.usage afterwards
+AI_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("AI_COMPLETION_TOKENS_ESTIMATE", "1500"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+# ---------------------------------------------
+# TOKEN ESTIMATES
+# ---------------------------------------------
+
+_ENCODING = None
+_ENCODING_LOCK = threading.Lock()
+
+
+def _encoding():
+    """tiktoken's encoding, loaded on the first count (False when tiktoken is unavailable)."""
+    global _ENCODING
+    if _ENCODING is None:
+        with _ENCODING_LOCK:
+            if _ENCODING is None:
+                try:
+                    import tiktoken
+                    _ENCODING = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    # tiktoken is optional; ~4 characters per token is close enough for limiting
+                    log.warning(f"✗ tiktoken unavailable ({e}): token counts are estimates (~4 characters per token)")
+                    _ENCODING = False
+    return _ENCODING
+
+
+def count_tokens(text: str) -> int:
+    """Token count of text (tiktoken when installed, else a character estimate)."""
+    encoding = _encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+# ---------------------------------------------
+# TOKEN-BUCKET LIMITER
+# ---------------------------------------------
+
+class RateLimiter:
+    """
+    Thread-safe token bucket for requests/minute and tokens/minute.
+
+    acquire() blocks until one request and the estimated tokens fit in both
+    buckets. adjust() corrects the token bucket once the real usage is known,
+    pause() holds every caller back after the service has throttled us.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens: int) -> int:
+        # A single request bigger than the whole TPM quota waits for a full bucket
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return tokens
+
+                wait = max(
+                    self._paused_until - now,
+                    (1 - self._requests) * 60.0 / self.rpm,
+                    (tokens - self._tokens) * 60.0 / self.tpm,
+                )
+            time.sleep(min(max(wait, 0.01), 5.0))
+
+    def adjust(self, reserved: int, used: int):
+        """Give back (or charge) the difference between the estimate and real usage."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.tpm, self._tokens + reserved - used)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "requests_available": round(self._requests, 2),
+                "tokens_available": int(self._tokens),
+                "paused_seconds": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            }
+
+
+_LIMITER = None
+_LIMITER_LOCK = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    """Process-wide limiter of the AZURE_* deployment: every task shares its quota."""
+    global _LIMITER
+    with _LIMITER_LOCK:
+        if _LIMITER is None:
+            _LIMITER = RateLimiter(AZURE_RPM, AZURE_TPM)
+        return _LIMITER
+
+
+# ---------------------------------------------
+# RETRY / BACKOFF
+# ---------------------------------------------
+
+def status_code(error):
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+def is_retryable(error) -> bool:
+    """Throttling, timeouts, connection drops and 5xx are worth another try."""
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def retry_after_seconds(error):
+    """Server-suggested wait from Retry-After / retry-after-ms headers, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(AI_BACKOFF_MAX, AI_BACKOFF_BASE * (2 ** attempt)))
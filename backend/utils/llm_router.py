@@ -0,0 +1,258 @@
+"""
+utils/llm_router.py
+Spreads chat completions over several Azure OpenAI deployments by capacity, health and prompt size
+"""
+
+import os
+import json
+import math
+import time
+import threading
+
+from utils import llm_client, metrics
+from utils.log import get_logger
+
+log = get_logger("llm")
+
+
+# Deployments as a JSON list, or the path of a JSON file with one; empty = the
+# single AZURE_ENDPOINT / AZURE_DEPLOYMENT. Each entry:
+#   {"name": "mini", "deployment": "gpt-4o-mini", "endpoint": "https://...",
+#    "api_key_env": "AZURE_API_KEY_MINI", "api_version": "...", "rpm": 300,
+#    "tpm": 200000, "max_prompt_tokens": 6000}
+# Missing endpoint / key / version / rpm / tpm fall back to the AZURE_* settings.
+# max_prompt_tokens > 0 marks a deployment for short statements only.
+AZURE_DEPLOYMENTS = os.getenv("AZURE_DEPLOYMENTS", "")
+
+# Consecutive 429 / 5xx / timeouts that take a deployment out of rotation, and for how long
+ROUTER_MAX_FAILURES = int(os.getenv("ROUTER_MAX_FAILURES", "3"))
+ROUTER_COOLDOWN_SECONDS = float(os.getenv("ROUTER_COOLDOWN_SECONDS", "30"))
+
+
+class Deployment:
+    """One deployment: its own client, RPM/TPM limiter and health."""
+
+    def __init__(self, name, deployment, endpoint=None, api_key=None, api_version=None,
+                 rpm=None, tpm=None, max_prompt_tokens=0, limiter=None, client=None):
+        self.name = name
+        self.deployment = deployment
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.api_version = api_version
+        self.max_prompt_tokens = int(max_prompt_tokens or 0)
+        self.limiter = limiter or llm_client.RateLimiter(
+            int(rpm or llm_client.AZURE_RPM), int(tpm or llm_client.AZURE_TPM))
+        self.client = client
+        # Guarded by the router's lock
+        self.in_flight = 0
+        self.failures = 0           # consecutive
+        self.cooldown_until = 0.0
+        self.counts = {"requests": 0, "errors": 0, "cooldowns": 0}
+
+    @property
+    def size_limit(self) -> float:
+        return self.max_prompt_tokens or math.inf
+
+    def fits(self, tokens: int) -> bool:
+        return tokens <= self.size_limit
+
+    def headroom(self, tokens: int) -> float:
+        """Share of the RPM/TPM quota still free, 0 when the request would have to wait."""
+        stats = self.limiter.stats()
+        if stats["paused_seconds"] > 0 or stats["requests_available"] < 1:
+            return 0.0
+        if stats["tokens_available"] < min(tokens, self.limiter.tpm):
+            return 0.0
+        return min(stats["requests_available"] / self.limiter.rpm, stats["tokens_available"] / self.limiter.tpm)
+
+
+def load_deployments(spec: str, defaults: dict) -> list:
+    """
+    Deployments from AZURE_DEPLOYMENTS (JSON text or file path). Without one,
+    the single default deployment shares llm_client's process-wide limiter.
+    """
+    spec = (spec or "").strip()
+    if not spec:
+        return [Deployment(**defaults, limiter=llm_client.get_limiter())]
+
+    if not spec.startswith("["):
+        with open(spec, "r", encoding="utf-8") as f:
+            spec = f.read()
+    entries = json.loads(spec)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("AZURE_DEPLOYMENTS must be a non-empty JSON list")
+
+    deployments, names = [], set()
+    for index, entry in enumerate(entries):
+        entry = dict(entry)
+        key_env = entry.pop("api_key_env", None)
+        if key_env:
+            entry["api_key"] = os.getenv(key_env)
+        config = {**defaults, **entry}
+        config.setdefault("deployment", defaults.get("deployment"))
+        name = config.get("name") or config["deployment"]
+        if name in names:
+            name = f"{name}-{index}"
+        names.add(name)
+        config["name"] = name
+        deployments.append(Deployment(**config))
+    return deployments
+
+
+# ---------------------------------------------
+# ROUTER
+# ---------------------------------------------
+
+class LLMRouter:
+    """
+    Picks a deployment for every request:
+
+    - size: the smallest tier whose max_prompt_tokens fits the request
+      (short statements go to the faster, cheaper deployment), spilling
+      over to larger tiers when that tier has no free capacity;
+    - capacity: within a tier, the deployment with the largest share of
+      its RPM/TPM quota free (fewest requests in flight on a tie);
+    - health: ROUTER_MAX_FAILURES retryable errors in a row take a
+      deployment out of rotation for ROUTER_COOLDOWN_SECONDS (or the
+      service's Retry-After, if longer).
+
+    A failed request is retried on another deployment right away when one
+    is available, else after the usual backoff.
+    """
+
+    def __init__(self, deployments: list, client_factory=None,
+                 max_failures: int = ROUTER_MAX_FAILURES, cooldown_seconds: float = ROUTER_COOLDOWN_SECONDS):
+        if not deployments:
+            raise ValueError("LLMRouter needs at least one deployment")
+        self.deployments = list(deployments)
+        self.client_factory = client_factory
+        self.max_failures = max(1, max_failures)
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+
+    def signature(self) -> str:
+        """Models that may answer (part of the extraction cache key)."""
+        return ",".join(sorted({d.deployment for d in self.deployments}))
+
+    def _client(self, deployment: Deployment):
+        with self._lock:
+            if deployment.client is None:
+                deployment.client = self.client_factory(deployment)
+            return deployment.client
+
+    def select(self, tokens: int, prompt_tokens: int = None, avoid: Deployment = None) -> Deployment:
+        """
+        Deployment for a request reserving `tokens` of quota, `prompt_tokens`
+        of them in the prompt (size tier); counted in flight until release().
+        """
+        with self._lock:
+            now = time.monotonic()
+            size = tokens if prompt_tokens is None else prompt_tokens
+            fitting = [d for d in self.deployments if d.fits(size)]
+            if not fitting:
+                # Bigger than every limit: the deployment that takes the most
+                fitting = [max(self.deployments, key=lambda d: d.size_limit)]
+
+            healthy = [d for d in fitting if d.cooldown_until <= now]
+            if not healthy:
+                # Everything is cooling down: the first one back
+                chosen = min(fitting, key=lambda d: d.cooldown_until)
+            else:
+                if avoid is not None and len(healthy) > 1:
+                    healthy = [d for d in healthy if d is not avoid]
+                ranked = sorted(healthy, key=lambda d: (d.size_limit, -d.headroom(tokens), d.in_flight))
+                # Smallest tier with room now; if none has room, the smallest tier anyway
+                chosen = next((d for d in ranked if d.headroom(tokens) > 0), ranked[0])
+
+            chosen.in_flight += 1
+            chosen.counts["requests"] += 1
+        metrics.LLM_ROUTED.inc(deployment=chosen.name)
+        return chosen
+
+    def release(self, deployment: Deployment, ok: bool, retryable: bool = False, wait: float = 0.0):
+        """Request done: a success resets the deployment's failure count, retryable errors add to it."""
+        with self._lock:
+            deployment.in_flight -= 1
+            if ok:
+                deployment.failures = 0
+                return
+            deployment.counts["errors"] += 1
+            if not retryable:
+                return
+            deployment.failures += 1
+            if deployment.failures < self.max_failures:
+                return
+            seconds = max(self.cooldown_seconds, wait)
+            deployment.cooldown_until = time.monotonic() + seconds
+            deployment.failures = 0
+            deployment.counts["cooldowns"] += 1
+        metrics.LLM_COOLDOWNS.inc(deployment=deployment.name)
+        log.warning(f"✗ Deployment {deployment.name} out of rotation for {seconds:.0f}s "
+                    f"after {self.max_failures} failed request(s)", extra={"deployment": deployment.name})
+
+    def create_chat_completion(self, request: dict, estimated_tokens: int, prompt_tokens: int = None):
+        """
+        request (without "model") on the chosen deployment under its rate
+        limiter, retrying throttled/transient errors on the next choice.
+        estimated_tokens is reserved from the quota; prompt_tokens picks the size tier.
+
+        Returns (response, attempts, deployment name).
+        """
+        attempt = 0
+        failed = None
+        delay = 0.0
+        while True:
+            deployment = self.select(estimated_tokens, prompt_tokens, avoid=failed)
+            cooling = deployment.cooldown_until - time.monotonic()
+            if deployment is failed or cooling > 0:
+                # No other deployment to fail over to: back off on this one
+                time.sleep(max(delay, cooling, 0.0))
+
+            reserved = deployment.limiter.acquire(estimated_tokens)
+            started = time.perf_counter()
+            try:
+                response = self._client(deployment).chat.completions.create(
+                    **{**request, "model": deployment.deployment})
+            except Exception as e:
+                metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                                    outcome="error", deployment=deployment.name)
+                # A failed request still used its slot; hand back the tokens
+                deployment.limiter.adjust(reserved, 0)
+                retryable = llm_client.is_retryable(e)
+                status_code = llm_client.status_code(e)
+                delay = max(llm_client.retry_after_seconds(e) or 0.0, llm_client.backoff_delay(attempt))
+                self.release(deployment, ok=False, retryable=retryable, wait=delay if status_code == 429 else 0.0)
+                if attempt >= llm_client.AI_MAX_RETRIES or not retryable:
+                    raise
+
+                if status_code == 429:
+                    deployment.limiter.pause(delay)
+                metrics.LLM_RETRIES.inc(reason=status_code or type(e).__name__)
+                log.warning(f"… retrying ({type(e).__name__} from {deployment.name})",
+                            extra={"status_code": status_code, "attempt": attempt + 1, "deployment": deployment.name})
+                failed = deployment
+                attempt += 1
+                continue
+
+            metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                                outcome="ok", deployment=deployment.name)
+            self.release(deployment, ok=True)
+            usage = getattr(response, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None):
+                deployment.limiter.adjust(reserved, usage.total_tokens)
+            return response, attempt + 1, deployment.name
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            rows = [(d, d.in_flight, dict(d.counts), max(0.0, d.cooldown_until - now)) for d in self.deployments]
+        return [{
+            "name": d.name,
+            "deployment": d.deployment,
+            "endpoint": d.endpoint,
+            "max_prompt_tokens": d.max_prompt_tokens or None,
+            "in_flight": in_flight,
+            "cooldown_seconds": round(cooldown, 1),
+            **counts,
+            **d.limiter.stats(),
+        } for d, in_flight, counts, cooldown in rows]
@@ -0,0 +1,64 @@
+"""
+utils/log.py
+Structured logging: JSON lines (LOG_FORMAT=json) or readable text with key=value fields
+"""
+
+import os
+import sys
+import json
+import logging
+from datetime import datetime, timezone
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" for people, "json" for log collectors (one object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# Attributes every LogRecord has; anything else came in through extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _fields(record) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS and v is not None}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s", "%H:%M:%S")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += "  " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+def setup_logging(level: str = None, fmt: str = None):
+    """Route all loggers to stdout in the configured format (idempotent)."""
+    root = logging.getLogger()
+    if getattr(root, "_ocr_configured", False):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+    root.handlers = [handler]
+    root.setLevel(level or LOG_LEVEL)
+    root._ocr_configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
@@ -0,0 +1,148 @@
+"""
+utils/markdown_cache.py
+Content-addressed disk cache of Docling markdown, keyed by PDF hash
+"""
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from importlib import metadata
+
+
+MARKDOWN_CACHE_ENABLED = os.getenv("MARKDOWN_CACHE_ENABLED", "1") == "1"
+MARKDOWN_CACHE_DIR = Path(os.getenv(
+    "MARKDOWN_CACHE_DIR",
+    Path(__file__).resolve().parent.parent / "cache" / "markdown",
+))
+MARKDOWN_CACHE_MAX_BYTES = int(os.getenv("MARKDOWN_CACHE_MAX_BYTES", str(1024 ** 3)))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def docling_version() -> str:
+    try:
+        return metadata.version("docling")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def cache_key(pdf_path, options: dict, pdf_sha256: str = None) -> str:
+    """
+    SHA-256 of the PDF bytes + Docling version + pipeline options.
+    A Docling upgrade or an options change never serves stale markdown.
+    """
+    parts = {
+        "pdf": pdf_sha256 or file_sha256(pdf_path),
+        "docling": docling_version(),
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class MarkdownCache:
+    """
+    <dir>/<key[:2]>/<key>.md files, evicted least-recently-used first
+    (file mtime is bumped on every hit) once the total passes max_bytes.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.md"
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            markdown = path.read_text(encoding="utf-8")
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+
+        with self._lock:
+            self._stats["hits"] += 1
+        return markdown
+
+    def put(self, key: str, markdown: str):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write-then-rename so a concurrent reader never sees half a file
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(markdown, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += path.stat().st_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan_size(self) -> int:
+        return sum(p.stat().st_size for p in self.directory.rglob("*.md"))
+
+    def _evict(self):
+        """Drop oldest entries until the cache is back under 90% of max_bytes."""
+        entries = []
+        for p in self.directory.rglob("*.md"):
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+
+        size = sum(e[1] for e in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, file_size, p in entries:
+            if size <= target:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            size -= file_size
+            self._stats["evictions"] += 1
+        self._size = size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "size_bytes": self._size if self._size is not None else self._scan_size(),
+                "max_bytes": self.max_bytes,
+            }
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Return the shared markdown cache, or None when caching is disabled."""
+    global _CACHE
+    if not MARKDOWN_CACHE_ENABLED:
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = MarkdownCache(MARKDOWN_CACHE_DIR, MARKDOWN_CACHE_MAX_BYTES)
+        return _CACHE
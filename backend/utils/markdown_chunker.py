@@ -0,0 +1,123 @@
+"""
+utils/markdown_chunker.py
+Splits long Docling markdown into token-bounded chunks at page/table boundaries
+"""
+
+import re
+
+
+TABLE_SEPARATOR = re.compile(r"^\s*\|?[\s:\-|]+\|[\s:\-|]*$")
+PAGE_BREAK = "<!-- page break -->"
+
+
+def split_blocks(markdown: str) -> list:
+    """
+    [(kind, text)] where kind is "table" (consecutive | lines) or "text"
+    (a paragraph). Blank lines and Docling page-break placeholders end a block.
+    """
+    blocks = []
+    lines, kind = [], None
+
+    def flush():
+        nonlocal lines, kind
+        if lines:
+            blocks.append((kind, "\n".join(lines)))
+        lines, kind = [], None
+
+    for line in markdown.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped == PAGE_BREAK:
+            flush()
+            continue
+        line_kind = "table" if stripped.startswith("|") else "text"
+        if kind is not None and line_kind != kind:
+            flush()
+        lines.append(line)
+        kind = line_kind
+    flush()
+    return blocks
+
+
+def split_table(table: str, max_tokens: int, count_tokens) -> list:
+    """Row groups within max_tokens, each repeating the table's header row(s)."""
+    rows = table.split("\n")
+    header_size = 2 if len(rows) > 1 and TABLE_SEPARATOR.match(rows[1]) else 1
+    header, body = rows[:header_size], rows[header_size:]
+    header_tokens = count_tokens("\n".join(header))
+
+    pieces, current, current_tokens = [], [], header_tokens
+    for row in body:
+        row_tokens = count_tokens(row) + 1
+        if current and current_tokens + row_tokens > max_tokens:
+            pieces.append("\n".join(header + current))
+            current, current_tokens = [], header_tokens
+        current.append(row)
+        current_tokens += row_tokens
+    if current or not pieces:
+        pieces.append("\n".join(header + current))
+    return pieces
+
+
+def split_text(text: str, max_tokens: int, count_tokens) -> list:
+    """Line groups within max_tokens (a single over-long line stays whole)."""
+    pieces, current, current_tokens = [], [], 0
+    for line in text.split("\n"):
+        line_tokens = count_tokens(line) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            pieces.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def chunk_markdown(markdown: str, max_tokens: int, count_tokens, header_tokens: int = None):
+    """
+    Returns (header, chunks).
+
+    header is the text before the first table (vendor, entity, subject...),
+    capped at header_tokens (default max_tokens // 4); it is meant to be sent
+    along with every chunk. chunks cover the rest of the document in order,
+    each within max_tokens, split between blocks and, for oversized
+    tables, between rows.
+    """
+    header_tokens = header_tokens or max_tokens // 4
+    blocks = split_blocks(markdown)
+    first_table = next((i for i, (kind, _) in enumerate(blocks) if kind == "table"), len(blocks))
+
+    header_parts, used = [], 0
+    body_start = 0
+    for i, (_, text) in enumerate(blocks[:first_table]):
+        tokens = count_tokens(text)
+        if used + tokens > header_tokens:
+            break
+        header_parts.append(text)
+        used += tokens
+        body_start = i + 1
+
+    # No table at all: nothing to repeat, every block goes to the chunks
+    if first_table == len(blocks):
+        header_parts, body_start = [], 0
+
+    chunks, current, current_tokens = [], [], 0
+    for kind, text in blocks[body_start:]:
+        tokens = count_tokens(text)
+        if tokens > max_tokens:
+            pieces = split_table(text, max_tokens, count_tokens) if kind == "table" \
+                else split_text(text, max_tokens, count_tokens)
+        else:
+            pieces = [text]
+
+        for piece in pieces:
+            piece_tokens = count_tokens(piece) if len(pieces) > 1 else tokens
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+
+    return "\n\n".join(header_parts), chunks
@@ -0,0 +1,114 @@
+"""
+utils/markdown_cleaner.py
+Strips tokens the extraction does not need from Docling markdown
+"""
+
+import re
+from collections import Counter
+
+
+# A text line on more than this share of a document's pages (at least 2)
+# is page header/footer boilerplate
+REPEATED_LINE_MIN_PAGE_SHARE = 0.5
+
+IMAGE_PLACEHOLDER = re.compile(r"^\s*<!--\s*image\s*-->\s*$", re.IGNORECASE)
+PAGE_BREAK = re.compile(r"^\s*<!--\s*page break\s*-->\s*$", re.IGNORECASE)
+PAGE_NUMBER = re.compile(r"^\s*page\s*\d+(\s*(/|of)\s*\d+)?\s*$", re.IGNORECASE)
+# "2 of 3" / "2/3" without "Page": also dates ("03/2024") and fractions, see is_page_number
+BARE_PAGE_NUMBER = re.compile(r"^\s*(\d+)\s*(/|of)\s*(\d+)\s*$", re.IGNORECASE)
+TABLE_SEPARATOR = re.compile(r"^\s*\|?(\s*:?-+:?\s*\|)+\s*:?-*:?\s*$")
+SPACES = re.compile(r"[ \t]{2,}")
+
+
+def compact_table_row(line: str) -> str:
+    """'| a      |   b |' → '| a | b |'; separator rows → '|---|---|'."""
+    if TABLE_SEPARATOR.match(line):
+        return "|" + "---|" * max(1, line.strip().strip("|").count("|") + 1)
+    cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+    return "| " + " | ".join(cells) + " |"
+
+
+def is_page_number(line: str, page_count: int) -> bool:
+    """"Page 2", "Page 2 of 3"; a bare "2/3" or "2 of 3" only when n <= m <= page_count."""
+    if PAGE_NUMBER.match(line):
+        return True
+    match = BARE_PAGE_NUMBER.match(line)
+    return bool(match) and 1 <= int(match.group(1)) <= int(match.group(3)) <= page_count
+
+
+def repeated_lines(lines: list, is_table: list) -> set:
+    """
+    Text lines found on most pages (pages split on page-break markers).
+    A line repeated within one page is content, not boilerplate, and a
+    document without page breaks has none.
+    """
+    pages, page = [], set()
+    for line, table in zip(lines, is_table):
+        if PAGE_BREAK.match(line):
+            pages.append(page)
+            page = set()
+        elif line.strip() and not table:
+            page.add(line.strip())
+    pages.append(page)
+    if len(pages) < 2:
+        return set()
+
+    page_counts = Counter(line for page in pages for line in page)
+    min_pages = max(2, int(len(pages) * REPEATED_LINE_MIN_PAGE_SHARE) + 1)
+    return {line for line, count in page_counts.items() if count >= min_pages}
+
+
+def clean_markdown(markdown: str) -> str:
+    """
+    - drops image placeholders, page-break markers and "Page x of y" lines
+    - keeps only the first copy of text lines repeated on most pages
+      (letterheads, footers, legal notices)
+    - drops table header rows repeated when a table continues on the next page
+    - removes table cell padding, runs of spaces and extra blank lines
+
+    Table rows are never dropped as duplicates: two identical invoice lines
+    are still two invoices.
+    """
+    lines = [line.rstrip() for line in markdown.splitlines()]
+    is_table = [line.lstrip().startswith("|") for line in lines]
+    repeated = repeated_lines(lines, is_table)
+    page_count = 1 + sum(1 for line in lines if PAGE_BREAK.match(line))
+
+    cleaned, seen_repeated = [], set()
+    table_header = None        # (header row, separator) of the last table seen
+    i = 0
+    while i < len(lines):
+        line, table = lines[i], is_table[i]
+        stripped = line.strip()
+
+        if table:
+            row = compact_table_row(line)
+            next_is_separator = i + 1 < len(lines) and TABLE_SEPARATOR.match(lines[i + 1])
+            if next_is_separator:
+                header = (row, compact_table_row(lines[i + 1]))
+                # Same table continued after a page break, with only dropped
+                # boilerplate in between: keep the rows only, joined to the previous ones
+                previous = next((c for c in reversed(cleaned) if c), "")
+                if header == table_header and previous.startswith("|"):
+                    while cleaned[-1] == "":
+                        cleaned.pop()
+                    i += 2
+                    continue
+                table_header = header
+            cleaned.append(row)
+            i += 1
+            continue
+
+        i += 1
+        if IMAGE_PLACEHOLDER.match(line) or PAGE_BREAK.match(line) or is_page_number(line, page_count):
+            continue
+        if stripped in repeated:
+            if stripped in seen_repeated:
+                continue
+            seen_repeated.add(stripped)
+        if stripped:
+            cleaned.append(SPACES.sub(" ", stripped))
+        elif cleaned and cleaned[-1] != "":
+            cleaned.append("")
+
+    return "\n".join(cleaned).strip() + "\n"
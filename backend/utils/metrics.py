@@ -0,0 +1,230 @@
+"""
+utils/metrics.py
+Process-wide counters, gauges and histograms in the Prometheus text format
+"""
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines += self._samples(key, value)
+        return lines
+
+    def _samples(self, key, value) -> list:
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        if value is None:
+            return
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, key, value) -> list:
+        counts, total = value
+        lines = [
+            f"{self.name}_bucket{_labels(self.label_names, key, [('le', _number(bound))])} {count}"
+            for bound, count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+        lines.append(f"{self.name}_count{_labels(self.label_names, key)} {counts[-1]}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render() -> str:
+    """Every metric of this process, Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+def start_http_server(port: int, host: str = "0.0.0.0"):
+    """Serve /metrics from a background thread (standalone worker processes)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = render().encode("utf-8")
+            self.send_response(200 if self.path.split("?")[0] in ("/", "/metrics") else 404)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+# ---------------------------------------------
+# PIPELINE METRICS
+# ---------------------------------------------
+
+CONVERT_SECONDS = Histogram(
+    "ocr_convert_seconds", "PDF to markdown conversion time per document", ["route"])
+CONVERT_PAGE_SECONDS = Histogram(
+    "ocr_convert_page_seconds", "PDF to markdown conversion time per page", ["route"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+CONVERTER_RSS_BYTES = Gauge(
+    "ocr_converter_worker_rss_bytes", "Resident memory of each Docling worker after its last document", ["slot"])
+CONVERTER_PEAK_RSS_BYTES = Gauge(
+    "ocr_converter_worker_peak_rss_bytes", "Peak resident memory of each slot's current Docling worker", ["slot"])
+CONVERTER_RECYCLED = Counter(
+    "ocr_converter_workers_replaced_total", "Docling workers replaced, by reason", ["reason"])
+LLM_REQUEST_SECONDS = Histogram(
+    "ocr_llm_request_seconds", "Chat completion latency per API call", ["outcome", "deployment"])
+LLM_ROUTED = Counter(
+    "ocr_llm_routed_total", "Chat completion calls sent to each deployment", ["deployment"])
+LLM_COOLDOWNS = Counter(
+    "ocr_llm_deployment_cooldowns_total", "Times a deployment was taken out of rotation", ["deployment"])
+LLM_RETRIES = Counter(
+    "ocr_llm_retries_total", "Chat completion calls retried", ["reason"])
+PROMPT_TOKENS = Histogram(
+    "ocr_llm_prompt_tokens", "Prompt tokens per extracted file", buckets=TOKEN_BUCKETS)
+COMPLETION_TOKENS = Histogram(
+    "ocr_llm_completion_tokens", "Completion tokens per extracted file", buckets=TOKEN_BUCKETS)
+EXTRACTIONS = Counter(
+    "ocr_extractions_total", "Files extracted, by source of the result", ["source"])
+EXCEL_SECONDS = Histogram(
+    "ocr_excel_write_seconds", "Excel report write time per document")
+DOWNLOAD_BYTES = Counter(
+    "ocr_download_bytes_total", "Output ZIP bytes sent, by kind of download", ["mode"])
+FILES = Counter(
+    "ocr_files_total", "Documents finished, by outcome", ["state"])
+TASKS = Counter(
+    "ocr_tasks_total", "Tasks finished, by outcome", ["status"])
+TASK_SECONDS = Histogram(
+    "ocr_task_seconds", "Pipeline run time per task", ["status"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 3600))
+QUEUE_DEPTH = Gauge(
+    "ocr_queue_depth", "Tasks queued and waiting for a worker")
+ACTIVE_TASKS = Gauge(
+    "ocr_active_tasks", "Tasks running on any worker")
+QUEUED_WORK = Gauge(
+    "ocr_queued_work", "Work (pages or files) of queued tasks")
+RUNNING_WORK = Gauge(
+    "ocr_running_work", "Work (pages or files) of running tasks")
+ADMISSION_REJECTED = Counter(
+    "ocr_admission_rejected_total", "Uploads and starts refused with 429/503", ["reason"])
+
+
+# ---------------------------------------------
+# TRACE SPANS
+# ---------------------------------------------
+
+class TaskTrace:
+    """Timed spans of one task run (saved to the task record as "trace")."""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, seconds: float, **attrs):
+        span = {"name": name, "start": round(start, 3), "seconds": round(seconds, 3),
+                **{k: v for k, v in attrs.items() if v is not None}}
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        start, started = time.time(), time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - started, **attrs)
+
+    def to_list(self) -> list:
+        with self._lock:
+            return sorted(self.spans, key=lambda s: s["start"])
@@ -0,0 +1,95 @@
+"""
+utils/page_ranges.py
+Splits PDFs into page ranges and stitches the ranges' markdown back together
+"""
+
+import re
+
+from utils import lazy
+from utils.markdown_chunker import PAGE_BREAK
+
+# PyMuPDF is optional; without it PDFs are always converted whole
+fitz = lazy.optional("fitz")
+
+
+TABLE_SEPARATOR = re.compile(r"^\s*\|?(\s*:?-+:?\s*\|)+\s*:?-*:?\s*$")
+
+
+def available() -> bool:
+    return fitz is not None
+
+
+def page_count(pdf_path) -> int:
+    with fitz.open(pdf_path) as doc:
+        return len(doc)
+
+
+def plan_ranges(page_routes: list, max_pages: int = 0) -> list:
+    """
+    page_routes: converter per page, e.g. ["text", "text", "docling", ...].
+    Returns [(start, end, route)] (0-based, end exclusive): runs of pages on
+    the same route, "docling" runs cut to max_pages each (0 = no limit).
+    """
+    ranges = []
+    for number, route in enumerate(page_routes):
+        if ranges and ranges[-1][2] == route and (
+            route != "docling" or not max_pages or number - ranges[-1][0] < max_pages
+        ):
+            ranges[-1] = (ranges[-1][0], number + 1, route)
+        else:
+            ranges.append((number, number + 1, route))
+    return ranges
+
+
+def write_range(pdf_path, start: int, end: int, out_path):
+    """Copies pages [start, end) of pdf_path into a PDF of their own."""
+    with fitz.open(pdf_path) as src, fitz.open() as part:
+        part.insert_pdf(src, from_page=start, to_page=end - 1)
+        part.save(out_path)
+
+
+# ---------------------------------------------
+# STITCHING
+# ---------------------------------------------
+
+def _columns(row: str) -> int:
+    return row.strip().strip("|").count("|") + 1
+
+
+def _normalize(row: str) -> str:
+    return "|".join(cell.strip().lower() for cell in row.strip().strip("|").split("|"))
+
+
+def stitch_markdown(parts: list) -> str:
+    """
+    Joins the markdown of consecutive page ranges. A table cut by a range
+    boundary is glued back into one table when the next range starts with
+    rows of the same width and no header of their own, or repeats the
+    table's header (dropped). A table with a different header is a new
+    table, even with the same number of columns.
+    """
+    lines = []
+    for part in parts:
+        part_lines = part.strip("\n").split("\n")
+        if not part.strip():
+            continue
+        if not lines:
+            lines = part_lines
+            continue
+
+        if lines[-1].lstrip().startswith("|") and part_lines[0].lstrip().startswith("|"):
+            start = len(lines) - 1
+            while start > 0 and lines[start - 1].lstrip().startswith("|"):
+                start -= 1
+            header = lines[start]
+
+            has_header = len(part_lines) > 1 and TABLE_SEPARATOR.match(part_lines[1])
+            if not has_header and _columns(header) == _columns(part_lines[0]):
+                lines += part_lines
+                continue
+            if has_header and _normalize(part_lines[0]) == _normalize(header):
+                lines += part_lines[2:]
+                continue
+
+        lines += ["", PAGE_BREAK, ""] + part_lines
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,175 @@
+"""
+utils/scheduler.py
+Runs several pipeline tasks at once and shares workers fairly between them
+"""
+
+import threading
+import itertools
+from contextlib import contextmanager
+
+from utils.task_store import JOB_LEASE_SECONDS
+from utils.log import get_logger
+
+log = get_logger("scheduler")
+
+
+class FairShare:
+    """
+    A fixed number of slots (converter workers, AI requests in flight)
+    shared by all running tasks.
+
+    When a slot frees up it goes to the waiting task that currently holds
+    the fewest slots, so a 500-file task cannot starve a 2-file task: both
+    end up with an equal share as long as both have work queued.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = max(1, slots)
+        self._cond = threading.Condition()
+        self._active = {}            # task_id -> slots held
+        self._waiting = {}           # ticket -> task_id
+        self._tickets = itertools.count()
+
+    def _next_ticket(self):
+        # Fewest slots held first, then whoever has been waiting longest
+        return min(self._waiting, key=lambda t: (self._active.get(self._waiting[t], 0), t))
+
+    def acquire(self, task_id: str):
+        with self._cond:
+            ticket = next(self._tickets)
+            self._waiting[ticket] = task_id
+            while sum(self._active.values()) >= self.slots or self._next_ticket() != ticket:
+                self._cond.wait()
+            del self._waiting[ticket]
+            self._active[task_id] = self._active.get(task_id, 0) + 1
+            self._cond.notify_all()
+
+    def release(self, task_id: str):
+        with self._cond:
+            self._active[task_id] -= 1
+            if not self._active[task_id]:
+                del self._active[task_id]
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, task_id: str):
+        self.acquire(task_id)
+        try:
+            yield
+        finally:
+            self.release(task_id)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "in_use": sum(self._active.values()),
+                "waiting": len(self._waiting),
+                "by_task": dict(self._active),
+            }
+
+
+class TaskScheduler:
+    """
+    Pipeline workers of one process: max_concurrent threads, each claiming
+    the next job from the task store's queue and running run_fn(task_id).
+
+    Jobs live in the store, so any number of processes (API with embedded
+    workers, or standalone worker.py) can serve the same queue.
+
+    budget caps the work (pages or files) of all running jobs, across
+    processes; the next job waits until it fits (0 = no cap).
+    """
+
+    def __init__(self, store, run_fn, max_concurrent: int, worker_id: str,
+                 poll_interval: float = 1.0, lease_seconds: int = JOB_LEASE_SECONDS,
+                 budget: int = 0):
+        self.store = store
+        self.run_fn = run_fn
+        self.max_concurrent = max(1, max_concurrent)
+        self.worker_id = worker_id
+        self.budget = budget
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._running = set()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._requeue_stale_jobs()
+        self._threads = [
+            threading.Thread(target=self._worker_loop, name=f"task-worker-{i}", daemon=True)
+            for i in range(self.max_concurrent)
+        ]
+        self._threads.append(threading.Thread(target=self._heartbeat_loop, name="task-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """A job was just queued; check the queue now instead of at the next poll."""
+        self._wake.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "worker_id": self.worker_id,
+                "max_concurrent": self.max_concurrent,
+                "work_budget": self.budget,
+                "running": sorted(self._running),
+            }
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                task_id = self.store.claim_job(self.worker_id, self.budget)
+            except Exception as e:
+                log.error(f"✗ Could not claim a job: {e}")
+                task_id = None
+
+            if task_id is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            with self._lock:
+                self._running.add(task_id)
+            try:
+                self.run_fn(task_id)
+            except Exception as e:
+                log.exception(f"✗ Task {task_id} crashed: {e}", extra={"task_id": task_id})
+            finally:
+                with self._lock:
+                    self._running.discard(task_id)
+                self.store.finish_job(task_id)
+
+    def _requeue_stale_jobs(self):
+        """Jobs of any worker (this process or another) whose heartbeats stopped go back in the queue."""
+        try:
+            requeued = self.store.requeue_stale_jobs(self.lease_seconds)
+        except Exception as e:
+            log.warning(f"✗ Could not re-queue stale jobs: {e}")
+            return
+        if requeued:
+            log.warning(f"↻ Re-queued {len(requeued)} job(s) left by a stopped worker")
+            self._wake.set()
+
+    def _heartbeat_loop(self):
+        # Re-checked on every tick: a worker that restarts within the lease, or
+        # dies while others keep running, is only noticed once its lease runs out
+        interval = max(0.1, self.lease_seconds / 4)
+        while not self._stop.wait(interval):
+            with self._lock:
+                running = list(self._running)
+            for task_id in running:
+                try:
+                    self.store.heartbeat(task_id)
+                except Exception as e:
+                    log.warning(f"✗ Heartbeat failed for {task_id}: {e}", extra={"task_id": task_id})
+            self._requeue_stale_jobs()
+
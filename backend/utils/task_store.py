@@ -0,0 +1,486 @@
+"""
+utils/task_store.py
+Task state, per-file stage status and the job queue, shared by API and workers
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import itertools
+from pathlib import Path
+
+
+# "sqlite" (default, survives restarts, shared between processes) or "memory"
+TASK_BACKEND = os.getenv("TASK_BACKEND", "sqlite")
+TASK_DB_PATH = Path(os.getenv(
+    "TASK_DB_PATH",
+    Path(__file__).resolve().parent.parent / "uploads" / "tasks.sqlite3",
+))
+
+# A running job whose worker has not sent a heartbeat for this long is re-queued
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+
+
+class TaskStore:
+    """
+    Backend interface.
+
+    Tasks are plain dicts (status, progress, task_dir, ...); per-file
+    entries live under task["files"][file_name]. Events are the task's
+    append-only progress log (streamed by /events). Jobs are task ids
+    waiting for, or claimed by, a pipeline worker.
+    """
+
+    # ---- tasks ----
+    def create_task(self, task_id: str, task: dict):
+        raise NotImplementedError
+
+    def get_task(self, task_id: str):
+        """Task dict including "files", or None."""
+        raise NotImplementedError
+
+    def update_task(self, task_id: str, **fields):
+        raise NotImplementedError
+
+    def update_file(self, task_id: str, file_name: str, **fields):
+        raise NotImplementedError
+
+    def delete_task(self, task_id: str):
+        raise NotImplementedError
+
+    # ---- progress events ----
+    def add_event(self, task_id: str, event: dict) -> int:
+        """Append an event to the task's log; returns its increasing id."""
+        raise NotImplementedError
+
+    def get_events(self, task_id: str, after_id: int = 0, limit: int = 500) -> list:
+        """[(id, event)] logged after after_id, oldest first."""
+        raise NotImplementedError
+
+    # ---- job queue ----
+    def enqueue(self, task_id: str, priority: int = 0, work: int = 1, client: str = None):
+        """Queue a job; lower priority runs first, work is its size in pages or files."""
+        raise NotImplementedError
+
+    def claim_job(self, worker_id: str, budget: int = 0):
+        """
+        Atomically take the next queued job (lowest priority, then oldest);
+        returns its task_id or None. With a budget, the job is only taken if
+        its work fits next to the running jobs' (or nothing is running).
+        """
+        raise NotImplementedError
+
+    def heartbeat(self, task_id: str):
+        raise NotImplementedError
+
+    def finish_job(self, task_id: str):
+        raise NotImplementedError
+
+    def queue_position(self, task_id: str) -> int:
+        """1-based place among queued jobs in claim order, 0 if not queued."""
+        raise NotImplementedError
+
+    def client_load(self, client: str) -> dict:
+        """{"tasks", "work"} of the client's queued and running jobs."""
+        raise NotImplementedError
+
+    def requeue_stale_jobs(self, lease_seconds: int = JOB_LEASE_SECONDS) -> list:
+        """Put jobs back in the queue whose worker stopped sending heartbeats."""
+        raise NotImplementedError
+
+    def queue_stats(self) -> dict:
+        """{"queued", "running", "queued_work", "running_work"}"""
+        raise NotImplementedError
+
+
+# ---------------------------------------------
+# IN-MEMORY BACKEND (single process)
+# ---------------------------------------------
+
+class MemoryTaskStore(TaskStore):
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tasks = {}
+        self._events = {}    # task_id -> [(id, event)]
+        self._event_ids = itertools.count(1)
+        self._jobs = {}      # task_id -> {"status", "worker_id", "enqueued_at", "heartbeat_at",
+                             #             "priority", "work", "client"}
+
+    def create_task(self, task_id, task):
+        with self._lock:
+            self._tasks[task_id] = {**task, "files": dict(task.get("files", {}))}
+
+    def get_task(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            return {**task, "files": {k: dict(v) for k, v in task["files"].items()}}
+
+    def update_task(self, task_id, **fields):
+        with self._lock:
+            if task_id in self._tasks:
+                self._tasks[task_id].update(fields)
+
+    def update_file(self, task_id, file_name, **fields):
+        with self._lock:
+            if task_id in self._tasks:
+                self._tasks[task_id]["files"].setdefault(file_name, {}).update(fields)
+
+    def delete_task(self, task_id):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._events.pop(task_id, None)
+            self._jobs.pop(task_id, None)
+
+    def add_event(self, task_id, event):
+        with self._lock:
+            event_id = next(self._event_ids)
+            self._events.setdefault(task_id, []).append((event_id, event))
+            return event_id
+
+    def get_events(self, task_id, after_id=0, limit=500):
+        with self._lock:
+            events = [e for e in self._events.get(task_id, []) if e[0] > after_id]
+            return events[:limit]
+
+    def enqueue(self, task_id, priority=0, work=1, client=None):
+        with self._lock:
+            self._jobs[task_id] = {"status": "queued", "worker_id": None,
+                                   "enqueued_at": time.time(), "heartbeat_at": None,
+                                   "priority": priority, "work": work, "client": client}
+
+    def claim_job(self, worker_id, budget=0):
+        with self._lock:
+            queued = [(j["priority"], j["enqueued_at"], t) for t, j in self._jobs.items() if j["status"] == "queued"]
+            if not queued:
+                return None
+            _, _, task_id = min(queued)
+            if budget:
+                running = sum(j["work"] for j in self._jobs.values() if j["status"] == "running")
+                if running and running + self._jobs[task_id]["work"] > budget:
+                    return None
+            self._jobs[task_id].update(status="running", worker_id=worker_id, heartbeat_at=time.time())
+            return task_id
+
+    def heartbeat(self, task_id):
+        with self._lock:
+            if task_id in self._jobs:
+                self._jobs[task_id]["heartbeat_at"] = time.time()
+
+    def finish_job(self, task_id):
+        with self._lock:
+            self._jobs.pop(task_id, None)
+
+    def queue_position(self, task_id):
+        with self._lock:
+            job = self._jobs.get(task_id)
+            if job is None or job["status"] != "queued":
+                return 0
+            order = (job["priority"], job["enqueued_at"])
+            return 1 + sum(1 for j in self._jobs.values()
+                           if j["status"] == "queued" and (j["priority"], j["enqueued_at"]) < order)
+
+    def client_load(self, client):
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if j["client"] == client]
+            return {"tasks": len(jobs), "work": sum(j["work"] for j in jobs)}
+
+    def requeue_stale_jobs(self, lease_seconds=JOB_LEASE_SECONDS):
+        cutoff = time.time() - lease_seconds
+        with self._lock:
+            stale = [t for t, j in self._jobs.items()
+                     if j["status"] == "running" and (j["heartbeat_at"] or 0) < cutoff]
+            for task_id in stale:
+                self._jobs[task_id].update(status="queued", worker_id=None)
+            return stale
+
+    def queue_stats(self):
+        with self._lock:
+            stats = {"queued": 0, "running": 0, "queued_work": 0, "running_work": 0}
+            for job in self._jobs.values():
+                stats[job["status"]] += 1
+                stats[job["status"] + "_work"] += job["work"]
+            return stats
+
+
+# ---------------------------------------------
+# SQLITE BACKEND (default; shared by API and worker processes)
+# ---------------------------------------------
+
+class SQLiteTaskStore(TaskStore):
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS task_files (
+                    task_id TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (task_id, file_name)
+                );
+                CREATE TABLE IF NOT EXISTS task_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_task_events_task ON task_events(task_id, id);
+                CREATE TABLE IF NOT EXISTS jobs (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    worker_id TEXT,
+                    enqueued_at REAL NOT NULL,
+                    heartbeat_at REAL
+                );
+            """)
+            # Columns added after the first release
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, ddl in (("priority", "INTEGER NOT NULL DEFAULT 0"),
+                                ("work", "INTEGER NOT NULL DEFAULT 1"),
+                                ("client", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}")
+            conn.execute("DROP INDEX IF EXISTS idx_jobs_status")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority, enqueued_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_client ON jobs(client)")
+
+    def _connect(self):
+        # isolation_level=None: transactions are opened explicitly where needed
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _merge(self, conn, table, where, params, fields):
+        row = conn.execute(f"SELECT data FROM {table} WHERE {where}", params).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        data.update(fields)
+        return json.dumps(data, ensure_ascii=False)
+
+    def create_task(self, task_id, task):
+        files = task.get("files", {})
+        task = {k: v for k, v in task.items() if k != "files"}
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO tasks VALUES (?, ?, ?)",
+                         (task_id, json.dumps(task, ensure_ascii=False), time.time()))
+            conn.execute("DELETE FROM task_files WHERE task_id = ?", (task_id,))
+            conn.executemany("INSERT INTO task_files VALUES (?, ?, ?)",
+                             [(task_id, name, json.dumps(data)) for name, data in files.items()])
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def get_task(self, task_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            task = json.loads(row[0])
+            task["files"] = {
+                name: json.loads(data)
+                for name, data in conn.execute(
+                    "SELECT file_name, data FROM task_files WHERE task_id = ? ORDER BY rowid", (task_id,)
+                )
+            }
+            return task
+        finally:
+            conn.close()
+
+    def update_task(self, task_id, **fields):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            data = self._merge(conn, "tasks", "task_id = ?", (task_id,), fields)
+            if data is not None:
+                conn.execute("UPDATE tasks SET data = ?, updated_at = ? WHERE task_id = ?",
+                             (data, time.time(), task_id))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def update_file(self, task_id, file_name, **fields):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            data = self._merge(conn, "task_files", "task_id = ? AND file_name = ?", (task_id, file_name), fields)
+            if data is None:
+                conn.execute("INSERT INTO task_files VALUES (?, ?, ?)",
+                             (task_id, file_name, json.dumps(fields, ensure_ascii=False)))
+            else:
+                conn.execute("UPDATE task_files SET data = ? WHERE task_id = ? AND file_name = ?",
+                             (data, task_id, file_name))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def delete_task(self, task_id):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("tasks", "task_files", "task_events", "jobs"):
+                conn.execute(f"DELETE FROM {table} WHERE task_id = ?", (task_id,))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def add_event(self, task_id, event):
+        conn = self._connect()
+        try:
+            cursor = conn.execute("INSERT INTO task_events (task_id, data) VALUES (?, ?)",
+                                  (task_id, json.dumps(event, ensure_ascii=False)))
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def get_events(self, task_id, after_id=0, limit=500):
+        conn = self._connect()
+        try:
+            return [
+                (event_id, json.loads(data))
+                for event_id, data in conn.execute(
+                    "SELECT id, data FROM task_events WHERE task_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (task_id, after_id, limit),
+                )
+            ]
+        finally:
+            conn.close()
+
+    def enqueue(self, task_id, priority=0, work=1, client=None):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (task_id, status, worker_id, enqueued_at, heartbeat_at, "
+                "priority, work, client) VALUES (?, 'queued', NULL, ?, NULL, ?, ?, ?)",
+                (task_id, time.time(), priority, work, client),
+            )
+        finally:
+            conn.close()
+
+    def claim_job(self, worker_id, budget=0):
+        conn = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front: two workers never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT task_id, work FROM jobs WHERE status = 'queued' "
+                "ORDER BY priority, enqueued_at LIMIT 1"
+            ).fetchone()
+            if row is not None and budget:
+                running = conn.execute(
+                    "SELECT COALESCE(SUM(work), 0) FROM jobs WHERE status = 'running'"
+                ).fetchone()[0]
+                if running and running + row[1] > budget:
+                    row = None
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_id = ?, heartbeat_at = ? WHERE task_id = ?",
+                    (worker_id, time.time(), row[0]),
+                )
+            conn.execute("COMMIT")
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def heartbeat(self, task_id):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE task_id = ?", (time.time(), task_id))
+        finally:
+            conn.close()
+
+    def finish_job(self, task_id):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM jobs WHERE task_id = ?", (task_id,))
+        finally:
+            conn.close()
+
+    def queue_position(self, task_id):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT priority, enqueued_at FROM jobs WHERE task_id = ? AND status = 'queued'", (task_id,)
+            ).fetchone()
+            if row is None:
+                return 0
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' "
+                "AND (priority < ? OR (priority = ? AND enqueued_at < ?))",
+                (row[0], row[0], row[1]),
+            ).fetchone()[0]
+            return ahead + 1
+        finally:
+            conn.close()
+
+    def client_load(self, client):
+        conn = self._connect()
+        try:
+            tasks, work = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(work), 0) FROM jobs WHERE client = ?", (client,)
+            ).fetchone()
+            return {"tasks": tasks, "work": work}
+        finally:
+            conn.close()
+
+    def requeue_stale_jobs(self, lease_seconds=JOB_LEASE_SECONDS):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cutoff = time.time() - lease_seconds
+            stale = [r[0] for r in conn.execute(
+                "SELECT task_id FROM jobs WHERE status = 'running' AND COALESCE(heartbeat_at, 0) < ?",
+                (cutoff,),
+            )]
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', worker_id = NULL "
+                "WHERE status = 'running' AND COALESCE(heartbeat_at, 0) < ?",
+                (cutoff,),
+            )
+            conn.execute("COMMIT")
+            return stale
+        finally:
+            conn.close()
+
+    def queue_stats(self):
+        conn = self._connect()
+        try:
+            stats = {"queued": 0, "running": 0, "queued_work": 0, "running_work": 0}
+            for status, count, work in conn.execute(
+                "SELECT status, COUNT(*), COALESCE(SUM(work), 0) FROM jobs GROUP BY status"
+            ):
+                stats[status] = count
+                stats[status + "_work"] = work
+            return stats
+        finally:
+            conn.close()
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store() -> TaskStore:
+    """The configured task store (TASK_BACKEND), shared within the process."""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            if TASK_BACKEND == "memory":
+                _STORE = MemoryTaskStore()
+            elif TASK_BACKEND == "sqlite":
+                _STORE = SQLiteTaskStore(TASK_DB_PATH)
+            else:
+                raise ValueError(f"Unknown TASK_BACKEND: {TASK_BACKEND}")
+        return _STORE
@@ -0,0 +1,118 @@
+"""
+utils/text_layer.py
+Fast PDF → markdown for born-digital pages, straight from the PDF text layer
+"""
+
+import os
+
+from utils import lazy
+
+# PyMuPDF is optional; without it every PDF goes through Docling
+fitz = lazy.optional("fitz")
+
+
+# A page needs this much extractable text to skip Docling
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "100"))
+
+# Pages mostly covered by images are scans (maybe with an OCR layer): Docling
+TEXT_LAYER_MAX_IMAGE_COVERAGE = float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", "0.5"))
+
+# Share of unmappable glyphs (U+FFFD) above which the text layer is unusable
+TEXT_LAYER_MAX_BAD_CHARS = 0.02
+
+
+def available() -> bool:
+    return fitz is not None
+
+
+def page_report(page) -> dict:
+    """Text layer quality of one page and whether the fast path can take it."""
+    text = page.get_text("text")
+    chars = len(text.strip())
+    bad_chars = text.count("�")
+
+    page_area = abs(page.rect) or 1
+    image_area = 0.0
+    for info in page.get_image_info():
+        image_area += abs(fitz.Rect(info["bbox"]) & page.rect)
+    image_coverage = min(image_area / page_area, 1.0)
+
+    usable = (
+        chars >= TEXT_LAYER_MIN_CHARS
+        and bad_chars <= TEXT_LAYER_MAX_BAD_CHARS * max(chars, 1)
+        and image_coverage <= TEXT_LAYER_MAX_IMAGE_COVERAGE
+    )
+    return {
+        "chars": chars,
+        "image_coverage": round(image_coverage, 3),
+        "usable": usable,
+    }
+
+
+def analyze_pdf(pdf_path) -> list:
+    """page_report() for every page, in order."""
+    with fitz.open(pdf_path) as doc:
+        return [page_report(page) for page in doc]
+
+
+# ---------------------------------------------
+# MARKDOWN
+# ---------------------------------------------
+
+def _cell(value) -> str:
+    return " ".join(str(value or "").split()).replace("|", "/")
+
+
+def table_to_markdown(rows: list) -> str:
+    rows = [[_cell(c) for c in row] for row in rows if any(c for c in row)]
+    if not rows:
+        return ""
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + "---|" * width]
+    lines += ["| " + " | ".join(row) + " |" for row in rows[1:]]
+    return "\n".join(lines)
+
+
+def page_to_markdown(page) -> str:
+    """
+    Text blocks and ruled tables of one page in reading order (top to
+    bottom); tables as markdown tables, like Docling's export.
+    """
+    items = []
+    table_boxes = []
+    try:
+        tables = page.find_tables().tables
+    except Exception:
+        # Older PyMuPDF or an unparseable table: plain text only
+        tables = []
+    for table in tables:
+        markdown = table_to_markdown(table.extract())
+        if markdown:
+            box = fitz.Rect(table.bbox)
+            table_boxes.append(box)
+            items.append((box.y0, box.x0, markdown))
+
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks", sort=True):
+        if block_type != 0 or not text.strip():
+            continue
+        box = fitz.Rect(x0, y0, x1, y1)
+        if any(box.intersects(t) for t in table_boxes):
+            continue
+        items.append((y0, x0, "\n".join(" ".join(line.split()) for line in text.strip().splitlines())))
+
+    items.sort(key=lambda item: (round(item[0]), item[1]))
+    return "\n\n".join(text for _, _, text in items)
+
+
+def convert_pdf(pdf_path, txt_path, pages: list = None) -> int:
+    """
+    Writes the markdown of pages (0-based, default all) to txt_path, with
+    Docling's page-break placeholder between pages. Returns pages written.
+    """
+    with fitz.open(pdf_path) as doc:
+        numbers = range(len(doc)) if pages is None else pages
+        markdown = "\n\n<!-- page break -->\n\n".join(page_to_markdown(doc[n]) for n in numbers)
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write(markdown)
+    return len(numbers)
@@ -0,0 +1,550 @@
+"""
+utils/vendor_templates.py
+Learned statement layouts: deterministic extraction for recurring vendors
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from utils.markdown_chunker import split_blocks
+
+
+TEMPLATES_ENABLED = os.getenv("TEMPLATES_ENABLED", "1") == "1"
+TEMPLATES_PATH = Path(os.getenv(
+    "TEMPLATES_PATH",
+    Path(__file__).resolve().parent.parent / "cache" / "templates.sqlite3",
+))
+
+# LLM outputs a template must reproduce before it replaces the LLM
+TEMPLATE_MIN_VERIFICATIONS = int(os.getenv("TEMPLATE_MIN_VERIFICATIONS", "2"))
+# Below this, a matching document still goes to the LLM
+TEMPLATE_MIN_CONFIDENCE = float(os.getenv("TEMPLATE_MIN_CONFIDENCE", "0.95"))
+
+TABLE_KEY = "   "
+TOP_LEVEL_FIELDS = ["", "Company Code", "Legal Entity Name", "Vendor No", "Vendor Name", " ", "Subject", "  "]
+INVOICE_FIELDS = ["Invoice Date", "Invoice No", "Purchase order No. if available", "Invoice Amount",
+                  "Invoice Currency", "Invoice Due Date", "Remarks if any"]
+DATE_FIELDS = ("Invoice Date", "Invoice Due Date")
+AMOUNT_FIELD = "Invoice Amount"
+TOTAL_FIELD = "Purchase order No. if available"
+
+DATE_FORMATS = ["%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d.%m.%y", "%d/%m/%y",
+                "%d-%m-%y", "%m/%d/%Y", "%d %b %Y", "%d-%b-%Y", "%d-%b-%y", "%d %B %Y"]
+AMOUNT_STYLES = ["eu", "us"]                      # 1.234,56 / 1,234.56
+TEXT_TRANSFORMS = ["text", "number"]
+
+# VAT ID prefixes (EU member states, Northern Ireland, UK, Switzerland)
+VAT_PREFIXES = "AT|BE|BG|CY|CZ|DE|DK|EE|EL|ES|FI|FR|HR|HU|IE|IT|LT|LU|LV|MT|NL|PL|PT|RO|SE|SI|SK|XI|GB|CHE"
+
+VENDOR_ID_PATTERNS = [
+    re.compile(r"\b[A-Z]{2}\d{2}[A-Z0-9]{11,30}\b"),              # IBAN
+    # EU VAT ID: known prefix, 8-12 characters with at least 7 digits (not words or reference numbers)
+    re.compile(rf"\b(?:{VAT_PREFIXES})(?=[0-9A-Z]{{8,12}}\b)(?:[A-Z]{{0,2}}\d){{7}}[0-9A-Z]*\b"),
+    re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]\b"),  # GSTIN
+]
+LABEL_LINE = re.compile(r"^([A-Za-z][^:|]{1,40}):")
+# A cell that is a total label ("Total", "Total balance", "Grand total"), not "Subtotal" or "TotalEnergies"
+TOTAL_LABEL = re.compile(r"^(grand\s+)?total\b", re.IGNORECASE)
+
+
+# ---------------------------------------------
+# MARKDOWN STRUCTURE
+# ---------------------------------------------
+
+def norm(value) -> str:
+    return " ".join(str(value if value is not None else "").split())
+
+
+def _cells(row: str) -> list:
+    return [norm(c) for c in row.strip().strip("|").split("|")]
+
+
+def parse_tables(markdown: str) -> list:
+    """[(header cells, [row cells, ...])] of every markdown table, in order."""
+    tables = []
+    for kind, text in split_blocks(markdown):
+        if kind != "table":
+            continue
+        rows = text.split("\n")
+        if len(rows) > 1 and set(rows[1].replace("|", "").strip()) <= set("-: "):
+            tables.append((_cells(rows[0]), [_cells(r) for r in rows[2:]]))
+        else:
+            tables.append(([], [_cells(r) for r in rows]))
+    return tables
+
+
+def text_lines(markdown: str) -> list:
+    return [norm(line) for kind, text in split_blocks(markdown) if kind == "text"
+            for line in text.split("\n") if line.strip()]
+
+
+def header_key(header: list) -> str:
+    return "|".join(h.lower() for h in header)
+
+
+def layout_of(markdown: str) -> dict:
+    """Table column headers, header labels and vendor identifiers of a document."""
+    lines = text_lines(markdown)
+    ids = set()
+    for line in lines:
+        for pattern in VENDOR_ID_PATTERNS:
+            ids.update(pattern.findall(line))
+    return {
+        "tables": sorted({header_key(h) for h, _ in parse_tables(markdown) if h}),
+        "labels": sorted({m.group(1).strip().lower() for m in map(LABEL_LINE.match, lines) if m}),
+        "ids": sorted(ids),
+    }
+
+
+def fingerprint(layout: dict):
+    """Same vendor layout → same fingerprint. None for documents without tables."""
+    if not layout["tables"]:
+        return None
+    parts = {"tables": layout["tables"], "ids": layout["ids"]}
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# ---------------------------------------------
+# VALUE TRANSFORMS
+# ---------------------------------------------
+
+def parse_amount(text, style):
+    text = norm(text)
+    negative = "(" in text or "-" in text
+    digits = re.sub(r"[^\d.,]", "", text)
+    if not re.search(r"\d", digits):
+        return None
+    if style == "eu":
+        digits = digits.replace(".", "").replace(",", ".")
+    else:
+        digits = digits.replace(",", "")
+    try:
+        value = float(digits)
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+def apply_transform(transform: str, cell: str):
+    """Source cell → output value; None when the cell does not fit the transform."""
+    kind, _, arg = transform.partition(":")
+    cell = norm(cell)
+    if kind == "date":
+        if not cell:
+            return ""
+        try:
+            return datetime.strptime(cell, arg).strftime("%d-%m-%Y")
+        except ValueError:
+            return None
+    if kind == "amount":
+        return parse_amount(cell, arg)
+    if kind == "number":
+        match = re.search(r"\d[\d\-/]*", cell)
+        return match.group(0) if match else ""
+    return cell
+
+
+def same_value(a, b) -> bool:
+    if isinstance(a, (int, float)) or isinstance(b, (int, float)):
+        try:
+            return abs(float(a) - float(b)) < 0.005
+        except (TypeError, ValueError):
+            return False
+    return norm(a) == norm(b)
+
+
+def candidate_transforms(field: str) -> list:
+    if field in DATE_FIELDS:
+        return [f"date:{f}" for f in DATE_FORMATS]
+    if field == AMOUNT_FIELD:
+        return [f"amount:{s}" for s in AMOUNT_STYLES]
+    return TEXT_TRANSFORMS
+
+
+# ---------------------------------------------
+# LEARNING FROM AN LLM OUTPUT
+# ---------------------------------------------
+
+def _is_total_row(row: list) -> bool:
+    return any(TOTAL_LABEL.match(cell) for cell in row)
+
+
+def _data_rows(tables: list, key: str) -> list:
+    """Non-empty, non-total rows of every table with this header, in order."""
+    return [row for header, rows in tables if header_key(header) == key
+            for row in rows if any(row) and not _is_total_row(row)]
+
+
+def _align(rows: list, invoices: list):
+    """Table row for each output invoice (by invoice number, in order), or None."""
+    if len(rows) == len(invoices):
+        return list(rows)
+    aligned, start = [], 0
+    for invoice in invoices:
+        number = norm(invoice.get("Invoice No"))
+        if not number:
+            return None
+        for i in range(start, len(rows)):
+            if number in rows[i]:
+                aligned.append(rows[i])
+                start = i + 1
+                break
+        else:
+            return None
+    return aligned
+
+
+def _learn_field(field, rows, invoices):
+    """(column, transform) reproducing the field for every row, else a constant, else None."""
+    values = [inv.get(field, "") for inv in invoices]
+    width = min(len(r) for r in rows)
+    for column in range(width):
+        for transform in candidate_transforms(field):
+            if all(same_value(apply_transform(transform, row[column]), value)
+                   for row, value in zip(rows, values)):
+                # An all-empty column only explains all-empty values
+                if any(norm(v) for v in values) or not any(row[column] for row in rows):
+                    return {"column": column, "transform": transform}
+    if len({json.dumps(v) for v in values}) == 1 and field not in (AMOUNT_FIELD, "Invoice No"):
+        return {"constant": values[0]}
+    return None
+
+
+def _learn_total(markdown, tables, total, style):
+    amount = total.get(AMOUNT_FIELD)
+    for _, rows in tables:
+        for row in rows:
+            if not _is_total_row(row):
+                continue
+            label = next(c for c in row if TOTAL_LABEL.match(c))
+            for column, cell in enumerate(row):
+                if cell != label and same_value(parse_amount(cell, style), amount):
+                    return {"source": "table", "label": label.lower(), "column": column}
+    for line in text_lines(markdown):
+        match = re.search(r"[-(]?\d[\d.,]*\)?", line)
+        if match and re.search(r"[A-Za-z]", line[:match.start()]) \
+                and same_value(parse_amount(match.group(0), style), amount):
+            return {"source": "text", "label": line[:match.start()].strip().lower()}
+    return None
+
+
+def _learn_top_level(markdown, output):
+    lines = text_lines(markdown)
+    fields = {}
+    for field in TOP_LEVEL_FIELDS:
+        value = norm(output.get(field, ""))
+        rule = {"constant": output.get(field, "")}
+        if value:
+            for line in lines:
+                if line.endswith(value) and len(line) > len(value):
+                    label = line[:-len(value)].strip()
+                    if re.search(r"[A-Za-z]", label) and len(label) <= 60:
+                        rule = {"label": label}
+                        break
+        fields[field] = rule
+    return fields
+
+
+def learn_template(markdown: str, output: dict):
+    """
+    A template reproducing output (an LLM result) from markdown, or None
+    when the layout cannot be explained column by column.
+    """
+    layout = layout_of(markdown)
+    if fingerprint(layout) is None:
+        return None
+
+    invoices = [inv for inv in output.get(TABLE_KEY, []) if norm(inv.get(TOTAL_FIELD)).lower() != "total"]
+    totals = [inv for inv in output.get(TABLE_KEY, []) if norm(inv.get(TOTAL_FIELD)).lower() == "total"]
+    if not invoices or len(totals) > 1:
+        return None
+
+    tables = parse_tables(markdown)
+    for key in layout["tables"]:
+        rows = _align(_data_rows(tables, key), invoices)
+        if not rows:
+            continue
+        fields = {}
+        for field in INVOICE_FIELDS:
+            rule = _learn_field(field, rows, invoices)
+            if rule is None:
+                break
+            fields[field] = rule
+        else:
+            style = fields[AMOUNT_FIELD]["transform"].split(":")[1]
+            template = {
+                "table": key,
+                "fields": fields,
+                "top_level": _learn_top_level(markdown, output),
+                "labels": layout["labels"],
+                "total": None,
+            }
+            if totals:
+                rule = _learn_total(markdown, tables, totals[0], style)
+                if rule is None:
+                    return None
+                rule["currency"] = totals[0].get("Invoice Currency", "")
+                template["total"] = rule
+            return template
+    return None
+
+
+# ---------------------------------------------
+# APPLYING A TEMPLATE
+# ---------------------------------------------
+
+def apply_template(template: dict, markdown: str):
+    """
+    Deterministic extraction. Returns (output, confidence 0..1): the lowest
+    of header-label overlap, total found and labelled fields found.
+    (None, 0.0) as soon as one table row does not parse: dropping it would
+    lose an invoice, so the document goes to the LLM instead.
+    """
+    tables = parse_tables(markdown)
+    rows = _data_rows(tables, template["table"])
+    if not rows:
+        return None, 0.0
+    fields = template["fields"]
+
+    invoices = []
+    for row in rows:
+        invoice = {}
+        for field in INVOICE_FIELDS:
+            rule = fields[field]
+            if "constant" in rule:
+                invoice[field] = rule["constant"]
+                continue
+            value = apply_transform(rule["transform"], row[rule["column"]]) if rule["column"] < len(row) else None
+            if value is None:
+                break
+            invoice[field] = value
+        if len(invoice) != len(INVOICE_FIELDS) or not norm(invoice["Invoice No"]):
+            return None, 0.0
+        invoices.append(invoice)
+    checks = [1.0]         # every row parsed
+
+    style = fields[AMOUNT_FIELD]["transform"].split(":")[1]
+    total = template.get("total")
+    if total:
+        amount = _find_total(markdown, tables, total, style)
+        checks.append(1.0 if amount is not None else 0.0)
+        if amount is not None:
+            invoices.append({
+                "Invoice Date": "", "Invoice No": "", TOTAL_FIELD: "Total", AMOUNT_FIELD: amount,
+                "Invoice Currency": total["currency"], "Invoice Due Date": "", "Remarks if any": "",
+            })
+
+    output, found, labelled = {}, 0, 0
+    lines = text_lines(markdown)
+    for field in TOP_LEVEL_FIELDS:
+        rule = template["top_level"][field]
+        if "label" in rule:
+            labelled += 1
+            value = next((line[len(rule["label"]):].strip() for line in lines
+                          if line.startswith(rule["label"])), None)
+            found += value is not None
+            output[field] = value or ""
+        else:
+            output[field] = rule["constant"]
+    if labelled:
+        checks.append(found / labelled)
+
+    if template["labels"]:
+        labels = set(layout_of(markdown)["labels"])
+        expected = set(template["labels"])
+        checks.append(len(labels & expected) / len(labels | expected))
+
+    output[TABLE_KEY] = invoices
+    return output, min(checks)
+
+
+def _find_total(markdown, tables, rule, style):
+    if rule["source"] == "table":
+        for _, rows in tables:
+            for row in rows:
+                if any(c.lower() == rule["label"] for c in row) and rule["column"] < len(row):
+                    return parse_amount(row[rule["column"]], style)
+        return None
+    for line in text_lines(markdown):
+        if line.lower().startswith(rule["label"]):
+            match = re.search(r"[-(]?\d[\d.,]*\)?", line[len(rule["label"]):])
+            if match:
+                return parse_amount(match.group(0), style)
+    return None
+
+
+def outputs_match(a: dict, b: dict) -> bool:
+    """Same extraction result (numbers compared to the cent)."""
+    if any(not same_value(a.get(f, ""), b.get(f, "")) for f in TOP_LEVEL_FIELDS):
+        return False
+    rows_a, rows_b = a.get(TABLE_KEY, []), b.get(TABLE_KEY, [])
+    return len(rows_a) == len(rows_b) and all(
+        same_value(ra.get(f, ""), rb.get(f, "")) for ra, rb in zip(rows_a, rows_b) for f in INVOICE_FIELDS
+    )
+
+
+# ---------------------------------------------
+# TEMPLATE INDEX
+# ---------------------------------------------
+
+class TemplateIndex:
+    """
+    One template per layout fingerprint (SQLite). A template answers
+    instead of the LLM once TEMPLATE_MIN_VERIFICATIONS LLM results were
+    reproduced exactly; a mismatch deactivates it (verifications back to 0)
+    and re-learns it from the latest result.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"matches": 0, "fallbacks": 0, "learned": 0, "verified": 0, "mismatches": 0}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS templates (
+                    fingerprint TEXT PRIMARY KEY,
+                    vendor TEXT,
+                    template TEXT NOT NULL,
+                    verifications INTEGER NOT NULL DEFAULT 1,
+                    mismatches INTEGER NOT NULL DEFAULT 0,
+                    uses INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _get(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT template, verifications FROM templates WHERE fingerprint = ?", (key,)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, 0)
+
+    def match(self, markdown: str):
+        """(output, info) when a verified template extracts markdown confidently, else (None, info)."""
+        key = fingerprint(layout_of(markdown))
+        if key is None:
+            return None, {}
+        template, verifications = self._get(key)
+        if template is None or verifications < TEMPLATE_MIN_VERIFICATIONS:
+            return None, {}
+
+        output, confidence = apply_template(template, markdown)
+        info = {"template": key[:12], "template_confidence": round(confidence, 3)}
+        if output is None or confidence < TEMPLATE_MIN_CONFIDENCE:
+            self._count("fallbacks")
+            return None, info
+
+        with self._connect() as conn:
+            conn.execute("UPDATE templates SET uses = uses + 1, updated_at = ? WHERE fingerprint = ?",
+                         (time.time(), key))
+        self._count("matches")
+        return output, info
+
+    def learn(self, markdown: str, output: dict):
+        """Verify the layout's template against an LLM result, or (re)learn it from it."""
+        key = fingerprint(layout_of(markdown))
+        if key is None:
+            return
+        template, _ = self._get(key)
+
+        if template is not None:
+            result, _ = apply_template(template, markdown)
+            if result is not None and outputs_match(result, output):
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE templates SET verifications = verifications + 1, updated_at = ? WHERE fingerprint = ?",
+                        (time.time(), key),
+                    )
+                self._count("verified")
+                return
+            # Out of rotation right away: it stays inactive unless re-learning succeeds
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE templates SET verifications = 0, mismatches = mismatches + 1, updated_at = ? "
+                    "WHERE fingerprint = ?",
+                    (time.time(), key),
+                )
+            self._count("mismatches")
+
+        learned = learn_template(markdown, output)
+        if learned is None:
+            return
+        result, _ = apply_template(learned, markdown)
+        if result is None or not outputs_match(result, output):
+            return
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO templates (fingerprint, vendor, template, verifications, mismatches, created_at, updated_at)
+                VALUES (?, ?, ?, 1, 0, ?, ?)
+                ON CONFLICT(fingerprint) DO UPDATE SET
+                    vendor = excluded.vendor, template = excluded.template, verifications = 1,
+                    updated_at = excluded.updated_at
+                """,
+                (key, output.get("Vendor Name", ""), json.dumps(learned, ensure_ascii=False), now, now),
+            )
+        self._count("learned")
+
+    def list(self) -> list:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT fingerprint, vendor, verifications, mismatches, uses, created_at, updated_at "
+                "FROM templates ORDER BY uses DESC, updated_at DESC"
+            ).fetchall()
+        return [
+            {
+                "fingerprint": r[0], "vendor": r[1], "verifications": r[2], "mismatches": r[3],
+                "uses": r[4], "active": r[2] >= TEMPLATE_MIN_VERIFICATIONS,
+                "created_at": r[5], "updated_at": r[6],
+            }
+            for r in rows
+        ]
+
+    def delete(self, key: str) -> int:
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM templates WHERE fingerprint = ?", (key,)).rowcount
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            total, active = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(verifications >= ?), 0) FROM templates",
+                (TEMPLATE_MIN_VERIFICATIONS,),
+            ).fetchone()
+        with self._lock:
+            counters = dict(self._stats)
+        return {**counters, "templates": total, "active": active,
+                "min_verifications": TEMPLATE_MIN_VERIFICATIONS, "min_confidence": TEMPLATE_MIN_CONFIDENCE}
+
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index():
+    """Return the shared template index, or None when templates are disabled."""
+    global _INDEX
+    if not TEMPLATES_ENABLED:
+        return None
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = TemplateIndex(TEMPLATES_PATH)
+        return _INDEX
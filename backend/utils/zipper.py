@@ -1,24 +1,227 @@
 """
 utils/zipper.py
-Helper function to zip output folder
+ZIP archives of a task's outputs, built on the fly while they are downloaded
+
+Members are STORED: XLSX and Parquet files are ZIP-compressed already, so
+deflating them again costs CPU for no gain. Stored members also give the
+archive a size and byte layout known before any data is read, which is
+what Content-Length and HTTP Range need.
 """
 
-import zipfile
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from collections import namedtuple
 from pathlib import Path
 
 
-def zip_output_folder(source_dir: Path, output_zip: Path):
+CHUNK_SIZE = 1024 * 1024
+
+# Files being written under this suffix are not outputs yet
+PARTIAL_SUFFIX = ".part"
+
+# Sizes, offsets and counts from these on go in ZIP64 records
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+# Placeholders in the classic fields when the value is in a ZIP64 record
+_ZIP64_MARKER = 0xFFFFFFFF
+_ZIP64_COUNT_MARKER = 0xFFFF
+
+_UTF8_FLAG = 0x0800
+_FILE_ATTRS = 0o100644 << 16    # regular file, rw-r--r--
+
+
+Member = namedtuple("Member", "name path size mtime_ns crc")
+
+
+# ---------------------------------------------
+# MEMBERS
+# ---------------------------------------------
+
+_crc_cache = {}
+_crc_lock = threading.Lock()
+
+
+def file_crc32(path, size: int, mtime_ns: int) -> int:
+    """CRC-32 of the file, remembered per (path, size, mtime) for repeated downloads."""
+    key = (str(path), size, mtime_ns)
+    with _crc_lock:
+        if key in _crc_cache:
+            return _crc_cache[key]
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            crc = zlib.crc32(block, crc)
+    with _crc_lock:
+        if len(_crc_cache) > 10000:
+            _crc_cache.clear()
+        _crc_cache[key] = crc
+    return crc
+
+
+def scan_members(source_dir: Path, recursive: bool = True) -> list:
+    """Finished files under source_dir as Members, sorted by archive name."""
+    source_dir = Path(source_dir)
+    if not source_dir.is_dir():
+        return []
+    paths = source_dir.rglob("*") if recursive else source_dir.iterdir()
+    members = []
+    for path in paths:
+        if path.name.endswith(PARTIAL_SUFFIX):
+            continue
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if not path.is_file():
+            continue
+        members.append(Member(
+            name=path.relative_to(source_dir).as_posix(),
+            path=path,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            crc=file_crc32(path, stat.st_size, stat.st_mtime_ns),
+        ))
+    return sorted(members, key=lambda m: m.name)
+
+
+# ---------------------------------------------
+# RECORDS
+# ---------------------------------------------
+
+def _dos_time(mtime_ns: int) -> tuple:
+    t = time.localtime(max(mtime_ns // 1_000_000_000, 315532800))  # not before 1980
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def local_header(member: Member) -> bytes:
+    name = member.name.encode("utf-8")
+    dos_time, dos_date = _dos_time(member.mtime_ns)
+    extra = b""
+    size = member.size
+    if size >= ZIP64_LIMIT:
+        extra = struct.pack("<HHQQ", 0x0001, 16, member.size, member.size)
+        size = _ZIP64_MARKER
+    return struct.pack(
+        "<IHHHHHIIIHH", 0x04034B50, 45 if extra else 20, _UTF8_FLAG, 0, dos_time, dos_date,
+        member.crc, size, size, len(name), len(extra),
+    ) + name + extra
+
+
+def central_header(member: Member, offset: int) -> bytes:
+    name = member.name.encode("utf-8")
+    dos_time, dos_date = _dos_time(member.mtime_ns)
+    zip64 = []
+    size = member.size
+    if size >= ZIP64_LIMIT:
+        zip64 += [member.size, member.size]
+        size = _ZIP64_MARKER
+    if offset >= ZIP64_LIMIT:
+        zip64.append(offset)
+        offset = _ZIP64_MARKER
+    extra = struct.pack(f"<HH{len(zip64)}Q", 0x0001, 8 * len(zip64), *zip64) if zip64 else b""
+    version = 45 if extra else 20
+    return struct.pack(
+        "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | version, version, _UTF8_FLAG, 0, dos_time, dos_date,
+        member.crc, size, size, len(name), len(extra), 0, 0, 0, _FILE_ATTRS, offset,
+    ) + name + extra
+
+
+def end_records(count: int, cd_offset: int, cd_size: int) -> bytes:
+    """End of central directory, preceded by its ZIP64 variant when anything overflows."""
+    if count < ZIP64_COUNT_LIMIT and cd_offset < ZIP64_LIMIT and cd_size < ZIP64_LIMIT:
+        return struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, cd_size, cd_offset, 0)
+    zip64_offset = cd_offset + cd_size
+    return (
+        struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        + struct.pack("<IIQI", 0x07064B50, 0, zip64_offset, 1)
+        + struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, _ZIP64_COUNT_MARKER, _ZIP64_COUNT_MARKER,
+                      _ZIP64_MARKER, _ZIP64_MARKER, 0)
+    )
+
+
+def _read(path, start: int, end: int, chunk_size: int = CHUNK_SIZE):
+    """Bytes [start, end) of the file, in chunks."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(chunk_size, remaining))
+            if not block:
+                raise OSError(f"{path} changed while being downloaded")
+            remaining -= len(block)
+            yield block
+
+
+# ---------------------------------------------
+# ARCHIVES
+# ---------------------------------------------
+
+class ZipStream:
     """
-    Zip all files in source_dir into output_zip
-    
-    Args:
-        source_dir: Directory containing Excel files
-        output_zip: Path where zip file should be created
+    STORED archive of a fixed list of members. Its size, ETag and any byte
+    range are known up front, so a download can be resumed from an offset.
     """
-    with zipfile.ZipFile(output_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        # Walk through all files in source directory
-        for file_path in source_dir.rglob('*'):
-            if file_path.is_file():
-                # Add file to zip with relative path
-                arcname = file_path.relative_to(source_dir)
-                zipf.write(file_path, arcname)
\ No newline at end of file
+
+    def __init__(self, members: list):
+        self.members = list(members)
+        self._parts = []    # (offset, length, bytes or Member)
+        offset = 0
+        central = []
+        for member in self.members:
+            header = local_header(member)
+            central.append(central_header(member, offset))
+            self._parts.append((offset, len(header), header))
+            self._parts.append((offset + len(header), member.size, member))
+            offset += len(header) + member.size
+        directory = b"".join(central)
+        directory += end_records(len(self.members), offset, len(directory))
+        self._parts.append((offset, len(directory), directory))
+        self.size = offset + len(directory)
+
+    @property
+    def etag(self) -> str:
+        digest = hashlib.sha1()
+        for m in self.members:
+            digest.update(f"{m.name}\0{m.size}\0{m.mtime_ns}\0{m.crc}\n".encode("utf-8"))
+        return f'"{digest.hexdigest()}"'
+
+    def iter_bytes(self, start: int = 0, end: int = None, chunk_size: int = CHUNK_SIZE):
+        """Bytes [start, end) of the archive (end defaults to the whole archive)."""
+        end = self.size if end is None else min(end, self.size)
+        for offset, length, part in self._parts:
+            lo, hi = max(start, offset), min(end, offset + length)
+            if lo >= hi:
+                continue
+            if isinstance(part, Member):
+                yield from _read(part.path, lo - offset, hi - offset, chunk_size)
+            else:
+                yield part[lo - offset:hi - offset]
+
+
+class ZipFollower:
+    """
+    Archive written member by member as outputs become ready (size unknown
+    until the end); finish() returns the central directory.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.added = {}     # name -> Member
+        self._central = []
+
+    def add(self, member: Member, chunk_size: int = CHUNK_SIZE):
+        """Local header and data of the member, in chunks."""
+        self.added[member.name] = member
+        self._central.append(central_header(member, self.offset))
+        header = local_header(member)
+        self.offset += len(header) + member.size
+        yield header
+        yield from _read(member.path, 0, member.size, chunk_size)
+
+    def finish(self) -> bytes:
+        directory = b"".join(self._central)
+        return directory + end_records(len(self._central), self.offset, len(directory))
@@ -0,0 +1,322 @@
+"""
+Pipeline worker
+Claims queued tasks from the task store and runs full_pipeline on them.
+
+Runs embedded in the API process (EMBEDDED_WORKERS=1, default) or as
+separate processes, so API and pipeline workers scale independently:
+
+    uvicorn main:app --workers 4          # EMBEDDED_WORKERS=0
+    python worker.py                      # one or more, same TASK_DB_PATH
+"""
+
+import os
+import time
+import uuid
+import socket
+import threading
+from contextlib import nullcontext
+from pathlib import Path
+from dotenv import load_dotenv
+
+import full_pipeline
+from utils import converter_pool, metrics, checkpoints, admission
+from utils.log import get_logger, setup_logging
+from utils.task_store import get_store
+from utils.scheduler import TaskScheduler, FairShare
+
+load_dotenv()
+
+log = get_logger("worker")
+
+# "streaming" runs each PDF through all steps on its own,
+# "batch" runs each step over the whole folder before the next one
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "streaming")
+
+# Warm Docling worker processes shared by all tasks (0 = convert in-process)
+DOCLING_POOL_SIZE = int(os.getenv("DOCLING_POOL_SIZE", "2"))
+
+# Tasks running side by side, and AI requests in flight across all of them
+MAX_CONCURRENT_TASKS = int(os.getenv("MAX_CONCURRENT_TASKS", "4"))
+AI_TOTAL_CONCURRENCY = int(os.getenv("AI_TOTAL_CONCURRENCY", "8"))
+
+# Converter workers and AI requests are split fairly between running tasks
+CONVERT_SLOTS = FairShare(DOCLING_POOL_SIZE or 1)
+AI_SLOTS = FairShare(AI_TOTAL_CONCURRENCY)
+
+# Standalone workers serve their own /metrics on this port (0 = off)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Save per-file stage spans and step timings to the task record as "trace"
+TASK_TRACE = os.getenv("TASK_TRACE", "0") == "1"
+
+# Per-file stage checkpoints (task_dir/manifest.json): re-runs and retries skip finished stages
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS_ENABLED", "1") == "1"
+
+# Per-file states reported by full_pipeline.run_streaming_pipeline
+FILE_STATE_PROGRESS = {
+    "queued": 0,
+    "converting": 0,
+    "converted": 1,
+    "extracting": 1,
+    "extracted": 2,
+    "writing": 2,
+    "done": 3,
+    "failed": 3,
+}
+
+STORE = get_store()
+SCHEDULER = None
+
+# Background start-up of the embedded worker (models loading while the API already answers)
+_STARTUP = {"thread": None, "started_at": None, "seconds": None, "error": None}
+
+
+def publish_event(task_id: str, event_type: str, **data):
+    """Append to the task's event log (streamed to clients by /events)."""
+    try:
+        STORE.add_event(task_id, {"type": event_type, "task_id": task_id, "at": time.time(),
+                                  **{k: v for k, v in data.items() if v is not None}})
+    except Exception as e:
+        log.warning(f"✗ Could not record event for {task_id}: {e}", extra={"task_id": task_id})
+
+
+def set_task_status(task_id: str, **fields):
+    """update_task + a "task" event, so pushed clients see status changes too."""
+    STORE.update_task(task_id, **fields)
+    publish_event(task_id, "task", **fields)
+
+
+# Stage that ends with each per-file state, and the info kept on its trace span
+SPAN_STAGES = {"converted": "convert", "extracted": "extract", "done": "excel"}
+SPAN_ATTRS = ("route", "pages", "markdown_cache", "llm_cache", "extraction", "prompt_tokens", "completion_tokens")
+
+
+def make_progress_callback(task_id: str, file_names: list, trace=None):
+    """
+    Returns an on_event callback that records per-file state in the task
+    store, derives the overall progress (5–90%) and cache counters from it,
+    and publishes a "file" event for every stage transition. With a trace
+    (metrics.TaskTrace), every finished stage is also recorded as a span.
+    """
+    states = {f: "queued" for f in file_names}
+    cache = {"markdown_hits": 0, "markdown_misses": 0, "llm_hits": 0, "llm_misses": 0}
+    lock = threading.Lock()
+
+    def on_event(file_name: str, state: str, error: str = None, **info):
+        with lock:
+            states[file_name] = state
+            entry = {"state": state, **{k: v for k, v in info.items() if v is not None}}
+            if error:
+                entry["error"] = error
+            if trace is not None and state in SPAN_STAGES and "seconds" in info:
+                trace.add(SPAN_STAGES[state], time.time() - info["seconds"], info["seconds"], file=file_name,
+                          **{k: info.get(k) for k in SPAN_ATTRS})
+
+            if info.get("markdown_cache") == "hit":
+                cache["markdown_hits"] += 1
+            elif info.get("markdown_cache") == "miss":
+                cache["markdown_misses"] += 1
+            if info.get("llm_cache") == "hit":
+                cache["llm_hits"] += 1
+            elif info.get("llm_cache") == "miss":
+                cache["llm_misses"] += 1
+
+            total_steps = 3 * max(len(states), 1)
+            done_steps = sum(FILE_STATE_PROGRESS[s] for s in states.values())
+
+            progress = 5 + int(85 * done_steps / total_steps)
+
+            STORE.update_file(task_id, file_name, **entry)
+            STORE.update_task(task_id, progress=progress, cache=dict(cache))
+            publish_event(task_id, "file", file=file_name, progress=progress, **entry)
+
+    return on_event
+
+
+def run_pipeline(task_id: str):
+    """
+    Background process:
+    - Builds this task's pipeline context (paths, shared worker slots)
+    - Runs three steps (streamed per file, or batch)
+    - Leaves the Excel outputs in place: /download zips them on the fly
+    """
+    started = time.perf_counter()
+    trace = metrics.TaskTrace() if TASK_TRACE else None
+    status = "failed"
+    try:
+        task = STORE.get_task(task_id)
+        if task is None:
+            log.warning(f"✗ Task {task_id} no longer exists, skipping", extra={"task_id": task_id})
+            status = None
+            return
+        task_dir = Path(task["task_dir"])
+
+        # Update task status
+        set_task_status(task_id, status="running", progress=5, error=None)
+
+        # Per-task paths: concurrent tasks never share module state
+        ctx = full_pipeline.PipelineContext.for_task_dir(
+            task_dir,
+            task_id=task_id,
+            file_hashes={name: f.get("sha256") for name, f in task["files"].items()},
+            convert_slots=CONVERT_SLOTS,
+            ai_slots=AI_SLOTS,
+            exports=task.get("exports"),
+            manifest=checkpoints.Manifest(task_dir) if CHECKPOINTS_ENABLED else None,
+        )
+
+        # Verify correct paths
+        log.info("Pipeline paths", extra={
+            "task_id": task_id,
+            "input_folder": ctx.input_folder,
+            "temp_txt_folder": ctx.temp_txt_folder,
+            "output_json_folder": ctx.output_json_folder,
+            "output_excel_folder": ctx.output_excel_folder,
+            "files": os.listdir(ctx.input_folder),
+        })
+        step = trace.span if trace is not None else (lambda name: nullcontext())
+
+        summary = {"done": [], "failed": {}}
+        if PIPELINE_MODE == "batch":
+            # Step 1: PDF → TXT
+            set_task_status(task_id, progress=30, step="convert")
+            with step("convert"):
+                full_pipeline.convert_pdfs_to_text(ctx)
+
+            # Step 2: TXT → JSON (Azure AI)
+            set_task_status(task_id, progress=60, step="extract")
+            with step("extract"):
+                full_pipeline.extract_data_with_ai(ctx)
+
+            # Step 3: JSON → EXCEL
+            set_task_status(task_id, progress=85, step="excel")
+            with step("excel"):
+                full_pipeline.convert_json_to_excel(ctx)
+        else:
+            # Steps 1–3 per file: PDF → TXT → JSON → EXCEL
+            file_names = [f for f in os.listdir(ctx.input_folder) if f.lower().endswith(".pdf")]
+            for file_name in file_names:
+                STORE.update_file(task_id, file_name, state="queued")
+            summary = full_pipeline.run_streaming_pipeline(
+                ctx, on_event=make_progress_callback(task_id, file_names, trace)
+            )
+
+        # Optional: one sheet / CSV / Parquet across all documents
+        if ctx.exports:
+            set_task_status(task_id, progress=92, step="export")
+            with step("export"):
+                export = full_pipeline.export_consolidated(ctx)
+            STORE.update_task(task_id, export=export)
+
+        # Invoices already seen in another document: output_excel/duplicates.csv
+        with step("duplicates"):
+            duplicates = full_pipeline.report_duplicates(ctx)
+        if duplicates is not None:
+            STORE.update_task(task_id, duplicate_invoices=duplicates)
+
+        # Finished
+        # Files without a complete output; POST /retry/{task_id} re-runs just these
+        if ctx.manifest is not None:
+            failed_files = {name: f["error"] for name, f in ctx.manifest.failed_files().items()}
+        else:
+            failed_files = summary["failed"]
+
+        set_task_status(task_id, status="finished", progress=100, failed_files=failed_files)
+        status = "finished"
+
+    except Exception as e:
+        set_task_status(task_id, status="failed", error=str(e))
+        log.exception(f"❌ PIPELINE ERROR: {e}", extra={"task_id": task_id})
+
+    finally:
+        if status is not None:
+            metrics.TASKS.inc(status=status)
+            metrics.TASK_SECONDS.observe(time.perf_counter() - started, status=status)
+        if status is not None and trace is not None:
+            try:
+                STORE.update_task(task_id, trace=trace.to_list())
+            except Exception as e:
+                log.warning(f"✗ Could not save trace for {task_id}: {e}", extra={"task_id": task_id})
+
+
+def start_workers():
+    """Warm the converter pool and start claiming jobs in this process."""
+    global SCHEDULER
+    if SCHEDULER is not None:
+        return SCHEDULER
+
+    if DOCLING_POOL_SIZE > 0:
+        converter_pool.start_pool(DOCLING_POOL_SIZE)
+    full_pipeline.preload(docling=DOCLING_POOL_SIZE == 0)
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    SCHEDULER = TaskScheduler(STORE, run_pipeline, MAX_CONCURRENT_TASKS, worker_id,
+                              budget=admission.WORK_BUDGET)
+    SCHEDULER.start()
+    log.info(f"✓ Pipeline worker {worker_id} ready: {MAX_CONCURRENT_TASKS} task slot(s)")
+    return SCHEDULER
+
+
+def start_workers_in_background():
+    """start_workers() in a thread, so the API serves requests while models load."""
+    if _STARTUP["thread"] is not None:
+        return
+
+    def run():
+        try:
+            start_workers()
+        except Exception as e:
+            _STARTUP["error"] = str(e)
+            log.exception(f"✗ Pipeline worker could not start: {e}")
+        _STARTUP["seconds"] = round(time.perf_counter() - _STARTUP["started_at"], 3)
+
+    _STARTUP["started_at"] = time.perf_counter()
+    _STARTUP["thread"] = threading.Thread(target=run, name="worker-startup", daemon=True)
+    _STARTUP["thread"].start()
+
+
+def readiness() -> dict:
+    """Whether this process's workers have their models loaded and claim jobs."""
+    if SCHEDULER is not None:
+        return {"status": "ok", "startup_seconds": _STARTUP["seconds"]}
+    if _STARTUP["error"] is not None:
+        return {"status": "failed", "error": _STARTUP["error"]}
+    if _STARTUP["thread"] is not None:
+        return {"status": "starting", "seconds": round(time.perf_counter() - _STARTUP["started_at"], 1)}
+    return {"status": "stopped"}
+
+
+def stop_workers():
+    global SCHEDULER
+    if _STARTUP["thread"] is not None:
+        # Still loading models: let it finish, then stop what it started
+        _STARTUP["thread"].join()
+        _STARTUP["thread"] = None
+    if SCHEDULER is not None:
+        SCHEDULER.stop()
+        SCHEDULER = None
+    converter_pool.shutdown_pool()
+
+
+def worker_stats():
+    """This process's worker slots and how shared workers are split between tasks."""
+    if SCHEDULER is None:
+        return None
+    return {
+        **SCHEDULER.stats(),
+        "convert_slots": CONVERT_SLOTS.stats(),
+        "ai_slots": AI_SLOTS.stats(),
+    }
+
+
+if __name__ == "__main__":
+    setup_logging()
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+        log.info(f"✓ Metrics on :{METRICS_PORT}/metrics")
+    start_workers()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        log.info("Stopping worker...")
+        stop_workers()